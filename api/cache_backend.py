@@ -0,0 +1,556 @@
+"""
+快取儲存後端模組
+weather_api 的 CACHE 透過這裡建立，依 config.ini [cache] backend 設定選擇：
+- memory: 行程內 LRU 快取 (預設，每個 worker 各自一份，有筆數與大小上限)
+- sqlite: 磁碟上的 SQLite 檔案 (同一台主機的多個 worker 與重啟後共用)
+- redis:  Redis 協定伺服器 (多台主機共用；內建精簡 RESP 客戶端，不需額外套件)
+
+所有後端都提供與 dict 相同的介面 (get / [] / in / pop / len / clear)，
+值為 (timestamp, data)；sqlite 與 redis 以 JSON 序列化 data。
+"""
+
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(__file__), '..', 'backend', 'data', 'weather_cache.db')
+DEFAULT_REDIS_URL = "redis://127.0.0.1:6379/0"
+
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+PURGE_INTERVAL = 60  # 每隔多少秒主動清除一次過期資料
+DECODED_MEMO_SIZE = 64  # sqlite / redis 後端在行程內保留的已解碼資料筆數
+
+
+SIZE_SAMPLE = 8     # 估算大小時每個 list / dict 抽樣的元素數
+SIZE_MAX_DEPTH = 6  # 估算大小時往下走的最大層數
+
+
+def _estimate_value_size(value, depth=0):
+    """
+    估算資料序列化為 JSON 後的長度：list / dict 只抽樣前 SIZE_SAMPLE 個元素再依總數放大，
+    不必像 json.dumps 一樣走過整份資料 (全台 AQI 索引等大型資料每次寫入都要估算)
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value) + 2
+    if value is None or isinstance(value, (bool, int, float)):
+        return 8
+    if isinstance(value, dict):
+        if not value:
+            return 2
+        if depth >= SIZE_MAX_DEPTH:
+            return 64 * len(value)
+        sample = list(itertools.islice(value.items(), SIZE_SAMPLE))
+        sampled = sum(len(str(k)) + 4 + _estimate_value_size(v, depth + 1) for k, v in sample)
+        return 2 + sampled * len(value) // len(sample)
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 2
+        if depth >= SIZE_MAX_DEPTH:
+            return 64 * len(value)
+        sample = value[:SIZE_SAMPLE]
+        sampled = sum(_estimate_value_size(v, depth + 1) + 1 for v in sample)
+        return 2 + sampled * len(value) // len(sample)
+    return len(repr(value))
+
+
+def _estimate_size(key, data):
+    """
+    估算一筆快取資料佔用的位元組數 (以 JSON 長度近似，抽樣估算)
+    """
+    return len(key) + _estimate_value_size(data)
+
+
+class MemoryCacheBackend:
+    """
+    行程內快取 (原本的 CACHE = {})
+    以 LRU 順序保存，超過筆數或大約位元組上限時淘汰最久未使用的資料，
+    並定期主動清除超過 ttl 的過期資料
+    """
+
+    name = "memory"
+
+    def __init__(self, ttl=None, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (timestamp, data, size)
+        self._bytes = 0
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _maybe_purge(self, now):
+        # 讀取與寫入都會觸發，每 PURGE_INTERVAL 秒最多掃描一次
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._purge_expired(now)
+
+    def _is_expired(self, timestamp, now):
+        return self.ttl is not None and now - timestamp >= self.ttl
+
+    def _purge_expired(self, now):
+        if self.ttl is None:
+            return
+        expired = [key for key, (timestamp, _, _) in self._entries.items() if now - timestamp >= self.ttl]
+        for key in expired:
+            self._remove(key)
+        self._stats["expired"] += len(expired)
+        self._last_purge = now
+
+    def get(self, key, default=None):
+        with self._lock:
+            now = time.time()
+            self._maybe_purge(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            timestamp, data, _ = entry
+            if self._is_expired(timestamp, now):
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return timestamp, data
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key, entry):
+        timestamp, data = entry
+        size = _estimate_size(key, data)
+        with self._lock:
+            self._maybe_purge(time.time())
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (timestamp, data, size)
+            self._bytes += size
+            # 淘汰最久未使用的資料 (至少保留剛寫入的這一筆)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            now = time.time()
+            self._maybe_purge(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if self._is_expired(entry[0], now):
+                self._remove(key)
+                self._stats["expired"] += 1
+                return False
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            timestamp, data, _ = self._entries[key]
+            self._remove(key)
+            return timestamp, data
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def purge_expired(self):
+        """
+        立即清除所有過期資料
+        """
+        with self._lock:
+            self._purge_expired(time.time())
+
+    def stats(self):
+        """
+        取得命中 / 未命中 / 淘汰統計與目前用量
+        """
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes
+            }
+
+
+class _DecodedMemo:
+    """
+    sqlite / redis 後端共用：記住最近解碼過的資料 (key -> (timestamp, data))
+    同一個 key 的時間戳記沒有變動時直接回傳，不必每次讀取都 JSON 解碼整份資料 (例如全台 AQI 索引)
+    """
+
+    def __init__(self, size=DECODED_MEMO_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, timestamp, data):
+        with self._lock:
+            self._entries[key] = (timestamp, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    以 SQLite 檔案儲存快取，多個行程可同時讀寫 (WAL 模式)
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, ttl=None):
+        self.path = path
+        self.ttl = ttl  # 超過此秒數的資料視為不存在並在寫入時清除
+        self._local = threading.local()
+        self._memo = _DecodedMemo()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                value TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=67108864")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        memo = self._memo.get(key)
+        try:
+            # 時間戳記與已解碼的資料相同時不取出 value (回傳 NULL)
+            row = self._conn().execute(
+                "SELECT timestamp, CASE WHEN timestamp = ? THEN NULL ELSE value END "
+                "FROM cache_entries WHERE key = ?",
+                (memo[0] if memo else None, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite 讀取失敗: {e}")
+            return default
+        if row is None:
+            return default
+        timestamp, value = row
+        if self.ttl is not None and time.time() - timestamp >= self.ttl:
+            return default
+        if value is None:
+            return memo
+        data = json.loads(value)
+        self._memo.put(key, timestamp, data)
+        return timestamp, data
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key, entry):
+        timestamp, data = entry
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, timestamp, value) VALUES (?, ?, ?)",
+                    (key, timestamp, json.dumps(data, ensure_ascii=False))
+                )
+                if self.ttl is not None:
+                    conn.execute("DELETE FROM cache_entries WHERE timestamp < ?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite 寫入失敗: {e}")
+            return
+        self._memo.put(key, timestamp, data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def pop(self, key, default=None):
+        entry = self.get(key, default)
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite 刪除失敗: {e}")
+        self._memo.discard(key)
+        return entry
+
+    def __len__(self):
+        try:
+            return self._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache_entries")
+        self._memo.clear()
+
+
+class RedisError(Exception):
+    """Redis 連線失敗或伺服器回傳錯誤"""
+
+
+class RedisReplyError(RedisError):
+    """Redis 伺服器回傳的錯誤訊息 (-ERR ...)，連線本身仍可使用"""
+
+
+class RedisCacheBackend:
+    """
+    以 Redis 協定 (RESP) 伺服器儲存快取
+    僅使用 GET / SET PX / DEL / SCAN / PING，任何相容伺服器皆可 (redis、valkey、測試用替身)
+    連線失敗時視為快取未命中，不影響主要功能
+    """
+
+    name = "redis"
+    RETRY_AFTER = 10  # 連線失敗後幾秒內不再嘗試
+
+    def __init__(self, url=DEFAULT_REDIS_URL, ttl=None, prefix="weather:", socket_timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.socket_timeout = socket_timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._down_until = 0  # 連線失敗後暫停重試的時間點，避免每次讀取都等待 timeout
+        self._memo = _DecodedMemo()
+
+    # --- RESP 協定 ---
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise RedisError("連線已關閉")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisReplyError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            if count == -1:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RedisError(f"無法解析的回應: {line!r}")
+
+    def execute(self, *args):
+        """
+        送出一個 Redis 指令 (連線中斷時自動重連一次)
+        """
+        with self._lock:
+            if time.time() < self._down_until:
+                raise RedisError("Redis 暫時無法連線")
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        try:
+                            self._connect()
+                        except RedisReplyError:
+                            self._close()
+                            raise
+                    return self._send(*args)
+                except RedisReplyError:
+                    raise
+                except (OSError, RedisError) as e:
+                    self._close()
+                    if attempt == 1:
+                        self._down_until = time.time() + self.RETRY_AFTER
+                        raise RedisError(str(e)) from e
+
+    # --- dict 介面 ---
+
+    def get(self, key, default=None):
+        try:
+            raw = self.execute('GET', self.prefix + key)
+        except RedisError as e:
+            print(f"[Cache] Redis 讀取失敗: {e}")
+            return default
+        if raw is None:
+            return default
+        # 值為 JSON 陣列 [timestamp, data]：先只解析開頭的時間戳記，與已解碼的資料相同時不再解碼
+        memo = self._memo.get(key)
+        if memo is not None:
+            head = raw[1:raw.find(b',')]
+            try:
+                if float(head) == memo[0]:
+                    return memo
+            except ValueError:
+                pass
+        timestamp, data = json.loads(raw)
+        self._memo.put(key, timestamp, data)
+        return timestamp, data
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key, entry):
+        timestamp, data = entry
+        value = json.dumps([timestamp, data], ensure_ascii=False)
+        args = ['SET', self.prefix + key, value]
+        if self.ttl is not None:
+            args += ['PX', int(self.ttl * 1000)]
+        try:
+            self.execute(*args)
+        except RedisError as e:
+            print(f"[Cache] Redis 寫入失敗: {e}")
+            return
+        self._memo.put(key, timestamp, data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def pop(self, key, default=None):
+        entry = self.get(key, default)
+        try:
+            self.execute('DEL', self.prefix + key)
+        except RedisError as e:
+            print(f"[Cache] Redis 刪除失敗: {e}")
+        self._memo.discard(key)
+        return entry
+
+    def _keys(self):
+        keys = []
+        cursor = b'0'
+        while True:
+            cursor, batch = self.execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            keys.extend(batch)
+            if cursor in (b'0', 0, '0'):
+                return keys
+
+    def __len__(self):
+        try:
+            return len(self._keys())
+        except RedisError:
+            return 0
+
+    def clear(self):
+        keys = self._keys()
+        if keys:
+            self.execute('DEL', *keys)
+        self._memo.clear()
+
+
+def create_cache_backend(config=None, ttl=None):
+    """
+    依 config.ini 的 [cache] 區段建立快取後端
+
+    Args:
+        config: configparser.ConfigParser (可為 None，表示使用預設的 memory)
+        ttl: 共享後端保存資料的最長秒數 (通常為 hard TTL)
+    """
+    section = config['cache'] if config is not None and 'cache' in config else {}
+    backend = section.get('backend', 'memory').strip().lower()
+
+    if backend == 'sqlite':
+        path = section.get('sqlite_path', DEFAULT_SQLITE_PATH)
+        print(f"[Cache] 使用 SQLite 快取: {path}")
+        return SQLiteCacheBackend(path, ttl=ttl)
+
+    if backend == 'redis':
+        url = section.get('redis_url', DEFAULT_REDIS_URL)
+        prefix = section.get('redis_prefix', 'weather:')
+        print(f"[Cache] 使用 Redis 快取: {url}")
+        return RedisCacheBackend(url, ttl=ttl, prefix=prefix)
+
+    if backend != 'memory':
+        print(f"[警告] 未知的快取後端 '{backend}'，改用 memory")
+    try:
+        max_entries = int(section.get('max_entries', DEFAULT_MAX_ENTRIES))
+        max_bytes = int(section.get('max_bytes', DEFAULT_MAX_BYTES))
+    except ValueError:
+        print("[警告] config.ini [cache] max_entries / max_bytes 格式錯誤，使用預設值")
+        max_entries, max_bytes = DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES
+    return MemoryCacheBackend(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
@@ -0,0 +1,293 @@
+"""
+跨行程 leader 選舉模組
+同一台主機上的多個 worker (gunicorn、debug reloader) 以 SQLite 租約表選出一個 leader，
+只有 leader 執行背景工作 (警報監控、全台天氣快照、快取預熱、歷史資料保留)，
+並把結果發布到同一個 SQLite 檔案；其餘 worker 定期讀取發布的結果，不直接呼叫上游 API。
+
+租約在 LEASE_TTL 秒內沒有續約即失效 (leader 行程結束或卡住)，由其他 worker 接手。
+
+以 gunicorn --preload 啟動時，app.py 在 master 行程匯入：搭配 backend/gunicorn.conf.py (設定 MASTER_PID_ENV)
+時 master 本身不參加選舉，由 post_fork hook 在每個 worker 中開始選舉，背景工作只在 worker 中執行。
+"""
+
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+LEADER_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'backend', 'data', 'weather_leader.db')
+LEASE_NAME = "scheduler"
+LEASE_TTL = 30          # 租約有效秒數
+TICK_INTERVAL = 5       # 續約 / 嘗試取得租約 / follower 同步的間隔 (秒)
+# 記錄 gunicorn master 的 PID (由 gunicorn.conf.py 設定)；在此行程中不參加選舉
+MASTER_PID_ENV = "WEATHER_GUNICORN_MASTER_PID"
+
+def _new_owner_id():
+    """本行程的唯一識別 (主機名稱:PID:隨機碼)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+OWNER_ID = _new_owner_id()
+
+# 已登記的背景工作：name -> {"start", "stop", "sync"}
+JOBS = {}
+IS_LEADER = False
+ELECTION_THREAD = None
+ELECTION_REQUESTED = False  # 已呼叫 start_leader_election (gunicorn post_fork 據此在 worker 中開始選舉)
+LAST_RENEWED = 0            # 最近一次成功取得 / 續約租約的時間
+STOP_EVENT = threading.Event()
+LEADER_STATS = {
+    "elections_won": 0,   # 成為 leader 的次數
+    "demotions": 0,       # 失去 leader 身分的次數
+    "syncs": 0,           # follower 讀取發布結果的次數
+    "errors": 0,
+}
+
+_local = threading.local()
+
+
+def _reset_after_fork():
+    """
+    fork 出的子行程沒有父行程的執行緒與 SQLite 連線：只重設狀態，不在這裡開始選舉
+    (任何 fork 都會觸發，例如 subprocess / multiprocessing；gunicorn worker 由 post_fork hook 呼叫 start_leader_election)
+    """
+    global OWNER_ID, IS_LEADER, ELECTION_THREAD, STOP_EVENT, LAST_RENEWED, _local
+    OWNER_ID = _new_owner_id()
+    IS_LEADER = False
+    ELECTION_THREAD = None
+    LAST_RENEWED = 0
+    STOP_EVENT = threading.Event()
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _conn():
+    """
+    每個執行緒各自的 SQLite 連線 (WAL 模式，多個行程可同時讀寫)
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(LEADER_DB_PATH)), exist_ok=True)
+        conn = sqlite3.connect(LEADER_DB_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS published (
+                name TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                value TEXT NOT NULL
+            )
+        ''')
+        _local.conn = conn
+    return conn
+
+
+def try_acquire(name=LEASE_NAME):
+    """
+    取得或續約租約 (租約不存在、已過期或本來就屬於本行程時成功)
+
+    Returns:
+        bool: 本行程是否持有租約
+    """
+    conn = _conn()
+    now = time.time()
+    # BEGIN IMMEDIATE 先取得寫入鎖，避免兩個行程同時判斷租約已過期 (取得失敗時直接拋出)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        acquired = row is None or row[0] == OWNER_ID or row[1] <= now
+        if acquired:
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, OWNER_ID, now + LEASE_TTL)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return acquired
+
+
+def release(name=LEASE_NAME):
+    """
+    釋放本行程持有的租約，讓其他 worker 不必等到過期即可接手
+    """
+    try:
+        _conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, OWNER_ID))
+    except sqlite3.Error as e:
+        print(f"[Leader] 釋放租約失敗: {e}")
+
+
+def get_lease_owner(name=LEASE_NAME):
+    """
+    取得目前持有有效租約的行程 (沒有時為 None)
+    """
+    try:
+        row = _conn().execute(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def publish(name, data):
+    """
+    由 leader 發布背景工作的結果 (JSON 序列化)，供其他 worker 讀取
+    """
+    try:
+        _conn().execute(
+            "INSERT OR REPLACE INTO published (name, updated_at, value) VALUES (?, ?, ?)",
+            (name, time.time(), json.dumps(data, ensure_ascii=False))
+        )
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"[Leader] 發布 {name} 失敗: {e}")
+
+
+def read_published(name):
+    """
+    讀取 leader 發布的結果
+
+    Returns:
+        (資料, 發布時間)；尚未發布時為 (None, None)
+    """
+    try:
+        row = _conn().execute("SELECT value, updated_at FROM published WHERE name = ?", (name,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"[Leader] 讀取 {name} 失敗: {e}")
+        return None, None
+    if row is None:
+        return None, None
+    return json.loads(row[0]), row[1]
+
+
+def register_job(name, start, stop=None, sync=None):
+    """
+    登記背景工作
+
+    Args:
+        start: 成為 leader 時呼叫 (啟動背景執行緒)
+        stop: 失去 leader 身分時呼叫
+        sync: 身為 follower 時每 TICK_INTERVAL 秒呼叫一次，從發布的結果更新本行程的資料
+    """
+    JOBS[name] = {"start": start, "stop": stop, "sync": sync}
+
+
+def _run_jobs(action):
+    for name, job in JOBS.items():
+        func = job[action]
+        if func is None:
+            continue
+        try:
+            func()
+        except Exception as e:
+            LEADER_STATS["errors"] += 1
+            print(f"[Leader] {name} {action} 失敗: {e}")
+
+
+def _elect_once():
+    """
+    嘗試取得 / 續約租約，並依身分變化啟動或停止背景工作；follower 則同步發布的結果
+    """
+    global IS_LEADER, LAST_RENEWED
+    attempted_at = time.time()
+    try:
+        leader = try_acquire()
+        if leader:
+            LAST_RENEWED = attempted_at
+    except sqlite3.Error as e:
+        # 無法存取租約表時，leader 只在租約確定撐到下一次續約前維持身分；
+        # 否則主動停止背景工作，避免租約過期由其他 worker 接手後兩邊同時執行
+        LEADER_STATS["errors"] += 1
+        print(f"[Leader] 租約存取失敗: {e}")
+        leader = IS_LEADER and time.time() + TICK_INTERVAL < LAST_RENEWED + LEASE_TTL
+
+    if leader and not IS_LEADER:
+        IS_LEADER = True
+        LEADER_STATS["elections_won"] += 1
+        print(f"[Leader] {OWNER_ID} 成為 leader，啟動背景工作")
+        _run_jobs("start")
+    elif not leader and IS_LEADER:
+        IS_LEADER = False
+        LEADER_STATS["demotions"] += 1
+        print(f"[Leader] {OWNER_ID} 失去 leader 身分，停止背景工作")
+        _run_jobs("stop")
+
+    if not IS_LEADER:
+        LEADER_STATS["syncs"] += 1
+        _run_jobs("sync")
+
+
+def election_loop():
+    """
+    背景迴圈：定期續約或嘗試成為 leader
+    """
+    while not STOP_EVENT.wait(TICK_INTERVAL):
+        _elect_once()
+    if IS_LEADER:
+        _run_jobs("stop")
+        release()
+
+
+def start_leader_election():
+    """
+    立即進行一次選舉 (leader 會直接啟動背景工作)，再啟動定期續約的執行緒
+
+    在 gunicorn master 行程 (preload) 中只記錄需要選舉，等 fork 出 worker 後才在 worker 中進行。
+    """
+    global ELECTION_THREAD, ELECTION_REQUESTED
+    ELECTION_REQUESTED = True
+    if os.environ.get(MASTER_PID_ENV) == str(os.getpid()):
+        print("[Leader] gunicorn master 行程不參加選舉，背景工作由 worker 執行")
+        return
+    if ELECTION_THREAD and ELECTION_THREAD.is_alive():
+        return
+    STOP_EVENT.clear()
+    _elect_once()
+    ELECTION_THREAD = threading.Thread(target=election_loop, name='leader-election', daemon=True)
+    ELECTION_THREAD.start()
+
+
+def stop_leader_election():
+    """
+    停止選舉並釋放租約
+    """
+    STOP_EVENT.set()
+    if IS_LEADER:
+        release()
+
+
+# 行程結束時停止選舉並釋放租約 (只登記一次；尚未開始選舉時不做任何事)
+atexit.register(stop_leader_election)
+
+
+def is_leader():
+    """本行程目前是否為 leader"""
+    return IS_LEADER
+
+
+def get_leader_stats():
+    """
+    取得 leader 選舉狀態 (本行程身分、目前的 leader 與統計)
+    """
+    return {
+        "owner": OWNER_ID,
+        "is_leader": IS_LEADER,
+        "leader": get_lease_owner(),
+        "jobs": list(JOBS),
+        **LEADER_STATS
+    }
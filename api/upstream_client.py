@@ -0,0 +1,223 @@
+"""
+上游 API 連線模組
+所有對中央氣象署 (CWA) 與環境部 (MOENV) 的請求共用同一個 HTTP Session：
+- 連線池 + keep-alive，重複請求不需重新進行 TLS 握手
+- 依 endpoint 設定 (連線, 讀取) timeout，避免慢速上游卡住 Flask 執行緒
+- 有限次數重試，搭配指數退避與隨機抖動 (jitter)
+- 斷路器：連續失敗 (5xx、429、連線錯誤、逾時) 達門檻後暫停呼叫該 endpoint，冷卻後再試；
+  其他 4xx 代表請求本身有誤 (上游正常回應)，直接交給呼叫端，不計入斷路器
+"""
+
+import random
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# 禁用 SSL 警告 (上游憑證鏈在部分環境無法驗證，沿用 verify=False)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 各 endpoint 的 (連線 timeout, 讀取 timeout) 秒數
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    "F-C0032-001": (3.05, 10),   # 36 小時預報 (全台資料較大)
+    "F-D0047-091": (3.05, 15),   # 一週預報 (批次查詢時回應較大)
+    "W-C0033-001": (3.05, 10),   # 天氣特報
+    "aqx_p_432": (3.05, 10),     # 空氣品質
+}
+
+# 重試設定
+MAX_RETRIES = 2            # 第一次之外最多再試幾次
+BACKOFF_BASE = 0.5         # 退避基準秒數 (0.5, 1, 2 ...)
+BACKOFF_MAX = 4.0          # 單次退避上限
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 斷路器設定
+BREAKER_FAILURE_THRESHOLD = 5   # 連續失敗幾次後打開斷路器
+BREAKER_COOLDOWN = 60           # 打開後暫停多少秒才允許試探請求
+
+# 連線池大小 (每個 host 保留的 keep-alive 連線數)
+POOL_MAXSIZE = 20
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """斷路器開啟中，未實際送出請求"""
+
+
+class _CircuitBreaker:
+    """單一 endpoint 的斷路器 (closed → open → half-open)"""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def allow(self, now):
+        if self.opened_at is None:
+            return True
+        if now - self.opened_at < BREAKER_COOLDOWN or self.trial_in_progress:
+            return False
+        # 冷卻時間已過，只放行一個試探請求 (half-open)
+        self.trial_in_progress = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def release(self):
+        """請求結束但不影響斷路器狀態 (例如 4xx)，只釋放半開狀態的試探名額"""
+        self.trial_in_progress = False
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self.opened_at = now
+
+    def state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at < BREAKER_COOLDOWN:
+            return "open"
+        return "half-open"
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_BREAKERS = {}
+_BREAKER_LOCK = threading.Lock()
+UPSTREAM_STATS = {
+    "requests": 0,        # 實際送出的 HTTP 請求數 (含重試)
+    "retries": 0,         # 重試次數
+    "failures": 0,        # 重試後仍失敗的呼叫數
+    "client_errors": 0,   # 上游回應 4xx (非 429) 的呼叫數，不計入斷路器
+    "short_circuited": 0  # 因斷路器開啟而直接拒絕的呼叫數
+}
+
+
+def get_session():
+    """
+    取得共用的 requests.Session (第一次呼叫時建立)
+    """
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.verify = False
+                _SESSION = session
+    return _SESSION
+
+
+def _get_breaker(endpoint):
+    with _BREAKER_LOCK:
+        breaker = _BREAKERS.get(endpoint)
+        if breaker is None:
+            breaker = _CircuitBreaker()
+            _BREAKERS[endpoint] = breaker
+        return breaker
+
+
+def _backoff_delay(attempt):
+    """
+    計算第 attempt 次重試前的等待秒數 (full jitter)
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def get(url, endpoint, timeout=None, **kwargs):
+    """
+    以共用 Session 發出 GET 請求
+
+    Args:
+        url: 完整請求網址
+        endpoint: endpoint 名稱 (例如 F-C0032-001)，用於 timeout 與斷路器
+        timeout: 覆寫預設 timeout
+
+    Returns:
+        requests.Response (已確認 HTTP 狀態碼為成功)
+
+    Raises:
+        requests.exceptions.RequestException: 重試後仍失敗或斷路器開啟
+    """
+    if timeout is None:
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+
+    breaker = _get_breaker(endpoint)
+    with _BREAKER_LOCK:
+        allowed = breaker.allow(time.time())
+        if not allowed:
+            UPSTREAM_STATS["short_circuited"] += 1
+    if not allowed:
+        raise CircuitOpenError(f"{endpoint} 斷路器開啟中，暫停呼叫上游 API")
+
+    session = get_session()
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt > 0:
+            UPSTREAM_STATS["retries"] += 1
+            time.sleep(_backoff_delay(attempt - 1))
+        UPSTREAM_STATS["requests"] += 1
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+            if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                last_error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Error for {endpoint}", response=response
+                )
+                continue
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and status < 500 and status not in RETRY_STATUS_CODES:
+                # 4xx (非 429) 屬於請求本身的問題：不重試，也不代表上游故障，直接交給呼叫端
+                with _BREAKER_LOCK:
+                    breaker.release()
+                    UPSTREAM_STATS["client_errors"] += 1
+                raise
+            last_error = e
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            last_error = e
+            continue
+        except requests.exceptions.RequestException as e:
+            # 其他請求錯誤 (無效網址、重新導向過多、回應中斷等) 重試也不會成功
+            last_error = e
+            break
+        except Exception:
+            # 非預期的錯誤也要記錄失敗，否則半開狀態的試探請求會一直佔住斷路器
+            _record_failure(breaker)
+            raise
+
+        with _BREAKER_LOCK:
+            breaker.record_success()
+        return response
+
+    _record_failure(breaker)
+    raise last_error
+
+
+def _record_failure(breaker):
+    """記錄一次呼叫失敗 (重新開啟或累計斷路器失敗次數)"""
+    with _BREAKER_LOCK:
+        breaker.record_failure(time.time())
+        UPSTREAM_STATS["failures"] += 1
+
+
+def get_upstream_stats():
+    """
+    取得上游連線統計與各 endpoint 的斷路器狀態
+    """
+    now = time.time()
+    with _BREAKER_LOCK:
+        breakers = {
+            endpoint: {"state": breaker.state(now), "failures": breaker.failures}
+            for endpoint, breaker in _BREAKERS.items()
+        }
+    return {**UPSTREAM_STATS, "breakers": breakers}
@@ -2,33 +2,37 @@ import requests
 import json
 import configparser
 import os
+import unicodedata
 import urllib3
+import upstream_client
 
 # 禁用 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+CONFIG_PATHS = [
+    "config.ini",
+    "../backend/config.ini",
+    os.path.join(os.path.dirname(__file__), "../backend/config.ini"),
+    os.path.join(os.path.dirname(__file__), "config.ini")
+]
+
+def _read_config():
+    """
+    讀取 config.ini (依序嘗試 CONFIG_PATHS)，找不到時回傳 None
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    for path in CONFIG_PATHS:
+        if config.read(path):
+            return config
+    return None
+
 def get_api_key():
     """
     從 config.ini 讀取 CWA API Key
     """
-    config = configparser.ConfigParser()
-    
-    # Try different paths
-    paths = [
-        "config.ini",
-        "../backend/config.ini",
-        os.path.join(os.path.dirname(__file__), "../backend/config.ini"),
-        os.path.join(os.path.dirname(__file__), "config.ini")
-    ]
-    
-    found = False
-    for path in paths:
-        if config.read(path):
-            found = True
-            break
-            
-    if not found:
-        return None, f"錯誤：找不到 config.ini 檔案 (嘗試路徑: {paths})。"
+    config = _read_config()
+    if config is None:
+        return None, f"錯誤：找不到 config.ini 檔案 (嘗試路徑: {CONFIG_PATHS})。"
     
     if 'cwa' not in config or 'api_key' not in config['cwa']:
         return None, "錯誤：config.ini 檔案中找不到 [cwa] 或 api_key。"
@@ -40,10 +44,199 @@ API_KEY, error_msg = get_api_key()
 if error_msg:
     print(error_msg)
 
-# --- In-Memory Cache ---
+def get_cache_config():
+    """
+    從 config.ini 的 [cache] 區段讀取快取 TTL 設定
+    
+    soft_ttl: 超過後仍回傳舊資料，但在背景重新抓取 (stale-while-revalidate)
+    hard_ttl: 超過後舊資料不再使用，請求必須等待上游回應
+    """
+    soft_ttl, hard_ttl = 600, 1800
+    config = _read_config()
+    if config is not None and 'cache' in config:
+        section = config['cache']
+        try:
+            soft_ttl = section.getint('soft_ttl', soft_ttl)
+            hard_ttl = section.getint('hard_ttl', hard_ttl)
+        except ValueError:
+            print("[警告] config.ini [cache] TTL 設定格式錯誤，使用預設值")
+    return soft_ttl, max(soft_ttl, hard_ttl)
+
+# --- Cache (memory / sqlite / redis，依 config.ini [cache] backend 選擇) ---
 import time
-CACHE = {}
-CACHE_TTL = 600  # 10 minutes
+import threading
+import cache_backend
+CACHE_TTL, CACHE_HARD_TTL = get_cache_config()  # 預設 10 分鐘 / 30 分鐘
+CACHE = cache_backend.create_cache_backend(_read_config(), ttl=CACHE_HARD_TTL)
+CACHE_STATS = {
+    "stale_hits": 0,            # 回傳過期 (soft) 資料的次數
+    "background_refreshes": 0,  # 排入背景更新的次數
+    "negative_hits": 0,         # 因近期查詢失敗而直接回傳錯誤的次數
+}
+
+# --- Negative cache (上游查詢失敗的結果短暫記住，避免重複打上游與寫錯誤日誌) ---
+NEGATIVE_CACHE = {}
+NEGATIVE_CACHE_TTL = 30  # 秒
+
+# --- Single-flight (同一 cache key 同時只允許一個上游請求) ---
+# 快取過期瞬間若有多個請求同時 miss，只讓第一個執行緒 (leader) 呼叫上游 API，
+# 其餘執行緒等待 leader 的結果，避免對 CWA / MOENV 發出重複請求。
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+SINGLE_FLIGHT_STATS = {
+    "leader_calls": 0,     # 實際呼叫上游的次數
+    "coalesced_calls": 0,  # 等待他人結果、未呼叫上游的次數
+}
+
+
+class _InFlightCall:
+    """一次進行中的上游請求，等待者透過 event 取得 leader 的結果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = (None, None)
+
+
+def _cache_lookup(cache_key):
+    """
+    取得未過期的快取資料，沒有則回傳 None
+    """
+    entry = CACHE.get(cache_key)
+    if entry is None:
+        return None
+    timestamp, cached_data = entry
+    if time.time() - timestamp < CACHE_TTL:
+        return cached_data
+    return None
+
+
+def _single_flight(cache_key, fetch):
+    """
+    以 cache_key 為單位合併同時發生的上游請求
+    
+    Args:
+        cache_key: 快取鍵 (例如 week_臺北市)
+        fetch: 實際呼叫上游的函式，回傳 (資料, 錯誤訊息)
+        
+    Returns:
+        (資料, 錯誤訊息)
+    """
+    with _INFLIGHT_LOCK:
+        call = _INFLIGHT.get(cache_key)
+        is_leader = call is None
+        if is_leader:
+            call = _InFlightCall()
+            _INFLIGHT[cache_key] = call
+            SINGLE_FLIGHT_STATS["leader_calls"] += 1
+        else:
+            SINGLE_FLIGHT_STATS["coalesced_calls"] += 1
+
+    if not is_leader:
+        call.event.wait()
+        return call.result
+
+    try:
+        # 前一個 leader 可能剛寫入快取，再確認一次以免重複呼叫
+        cached_data = _cache_lookup(cache_key)
+        if cached_data is not None:
+            call.result = (cached_data, None)
+        else:
+            call.result = fetch()
+    except Exception as e:
+        call.result = (None, f"處理 API 資料時發生錯誤: {e}")
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(cache_key, None)
+        call.event.set()
+    return call.result
+
+
+def _refresh_in_background(cache_key, fetch):
+    """
+    在背景執行緒重新抓取資料，若已有相同 key 的請求在進行中則略過
+    """
+    with _INFLIGHT_LOCK:
+        if cache_key in _INFLIGHT:
+            return
+        CACHE_STATS["background_refreshes"] += 1
+
+    def worker():
+        try:
+            _single_flight(cache_key, fetch)
+        except Exception as e:
+            print(f"[Cache] 背景更新 {cache_key} 失敗: {e}")
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+def _cached_fetch(cache_key, fetch, label):
+    """
+    依 soft / hard TTL 決定使用快取、回傳舊資料並背景更新，或同步呼叫上游
+    
+    Args:
+        cache_key: 快取鍵
+        fetch: 實際呼叫上游的函式，回傳 (資料, 錯誤訊息)
+        label: 日誌顯示用名稱
+        
+    Returns:
+        (資料, 錯誤訊息)
+    """
+    entry = CACHE.get(cache_key)
+    if entry is not None:
+        timestamp, cached_data = entry
+        age = time.time() - timestamp
+        if age < CACHE_TTL:
+            print(f"[{label}] 使用快取資料 (無需呼叫 API)")
+            return cached_data, None
+        if age < CACHE_HARD_TTL:
+            print(f"[{label}] 使用舊快取資料，背景更新中...")
+            CACHE_STATS["stale_hits"] += 1
+            _refresh_in_background(cache_key, fetch)
+            return cached_data, None
+
+    negative = NEGATIVE_CACHE.get(cache_key)
+    if negative is not None and time.time() - negative[0] < NEGATIVE_CACHE_TTL:
+        CACHE_STATS["negative_hits"] += 1
+        return None, negative[1]
+
+    data, error = _single_flight(cache_key, fetch)
+    if error:
+        NEGATIVE_CACHE[cache_key] = (time.time(), error)
+    else:
+        NEGATIVE_CACHE.pop(cache_key, None)
+    return data, error
+
+
+def get_cache_stats():
+    """
+    取得快取 (stale-while-revalidate) 的統計資訊
+    """
+    stats = {
+        "backend": CACHE.name,
+        "soft_ttl": CACHE_TTL,
+        "hard_ttl": CACHE_HARD_TTL,
+        "entries": len(CACHE),
+        "stale_hits": CACHE_STATS["stale_hits"],
+        "background_refreshes": CACHE_STATS["background_refreshes"],
+        "negative_hits": CACHE_STATS["negative_hits"]
+    }
+    # memory 後端另外提供命中 / 淘汰統計
+    if hasattr(CACHE, 'stats'):
+        stats.update(CACHE.stats())
+    return stats
+
+
+def get_single_flight_stats():
+    """
+    取得請求合併的統計資訊
+    """
+    with _INFLIGHT_LOCK:
+        return {
+            "leader_calls": SINGLE_FLIGHT_STATS["leader_calls"],
+            "coalesced_calls": SINGLE_FLIGHT_STATS["coalesced_calls"],
+            "in_flight": len(_INFLIGHT)
+        }
 
 def get_weather(city_name):
     """
@@ -52,21 +245,25 @@ def get_weather(city_name):
     if not API_KEY:
         return None, "錯誤：無法讀取 API Key，請檢查 config.ini 檔案。"
 
-    # Check Cache
+    city = normalize_city_name(city_name)
+    if city is None:
+        return None, f"找不到縣市: {city_name}"
+    city_name = city
+
     cache_key = f"city_{city_name}"
-    if cache_key in CACHE:
-        timestamp, cached_data = CACHE[cache_key]
-        if time.time() - timestamp < CACHE_TTL:
-            print(f"[{city_name}] 使用快取資料 (無需呼叫 API)")
-            return cached_data, None
+    return _cached_fetch(cache_key, lambda: _fetch_weather(city_name, cache_key), city_name)
 
+
+def _fetch_weather(city_name, cache_key):
+    """
+    實際呼叫 CWA API F-C0032-001 (單一縣市) 並寫入快取
+    """
     url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001?Authorization={API_KEY}&locationName={city_name}"
     print(f"正在查詢 {city_name} 的天氣資料 (CWA)...")
 
     data = {} # 確保 data 在 try 外部被定義
     try:
-        response = requests.get(url, verify=False)
-        response.raise_for_status()
+        response = upstream_client.get(url, "F-C0032-001")
         data = response.json()
 
         if not data.get("success"):
@@ -169,22 +366,36 @@ def get_all_weather():
     if not API_KEY:
         return None, "錯誤：無法讀取 API Key，請檢查 config.ini 檔案。"
 
-    # Check Cache
     cache_key = "all_cities"
-    if cache_key in CACHE:
-        timestamp, cached_data = CACHE[cache_key]
-        if time.time() - timestamp < CACHE_TTL:
-            print(f"[全台] 使用快取資料 (無需呼叫 API)")
-            return cached_data, None
+    return _cached_fetch(cache_key, lambda: _fetch_all_weather(cache_key), "全台")
+
+
+def refresh_all_weather():
+    """
+    不經過快取，直接重新查詢全台天氣資料並寫入快取 (供背景快照排程使用)
+    回傳: ({縣市名: 天氣資料字典}, 錯誤訊息)
+    """
+    if not API_KEY:
+        return None, "錯誤：無法讀取 API Key，請檢查 config.ini 檔案。"
+
+    cache_key = "all_cities"
+    data, error = _fetch_all_weather(cache_key)
+    if not error:
+        NEGATIVE_CACHE.pop(cache_key, None)
+    return data, error
+
 
+def _fetch_all_weather(cache_key):
+    """
+    實際呼叫 CWA API F-C0032-001 (全台) 並寫入快取
+    """
     # 不指定 locationName 即可獲取全部資料
     url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001?Authorization={API_KEY}"
     print(f"正在查詢全台天氣資料 (CWA)...")
 
     data = {}
     try:
-        response = requests.get(url, verify=False)
-        response.raise_for_status()
+        response = upstream_client.get(url, "F-C0032-001")
         data = response.json()
 
         if not data.get("success"):
@@ -239,130 +450,139 @@ def get_week_forecast(city_name):
     if not API_KEY:
         return None, "錯誤：無法讀取 API Key，請檢查 config.ini 檔案。"
 
-    # Check Cache
+    city = normalize_city_name(city_name)
+    if city is None:
+        return None, f"找不到縣市: {city_name}"
+    city_name = city
+
     cache_key = f"week_{city_name}"
-    if cache_key in CACHE:
-        timestamp, cached_data = CACHE[cache_key]
-        if time.time() - timestamp < CACHE_TTL:
-            print(f"[{city_name}] 使用快取資料 (無需呼叫 API)")
-            return cached_data, None
+    return _cached_fetch(cache_key, lambda: _fetch_week_forecast(city_name, cache_key), city_name)
 
-    # F-D0047-091: 臺灣各縣市鄉鎮未來1週逐12小時天氣預報
-    # locationName in this API requires a specific city name, sometimes followed by district.
-    # But F-D0047-091 actually returns ALL districts for a specific County if we don't specify locationName?
-    # Wait, F-D0047-091 parameter is 'locationName' which is the County/City name (e.g., 宜蘭縣).
-    # Then inside 'location' list, it contains districts.
-    # However, F-D0047-091 is "Taiwan 7-Day Forecast by Location (City)".
+
+def _pick_week_location(city_name, locations, fallback_first=True):
+    """
+    從 F-D0047-091 的 Location 列表中挑選代表該縣市的觀測點
+    
+    Args:
+        city_name: 縣市名稱 (例如 臺北市)
+        locations: F-D0047-091 回傳的 Location 列表
+        fallback_first: 找不到符合名稱時是否退回使用第一筆
+    """
+    # 完全相同的名稱優先 (避免 新竹市/新竹縣、嘉義市/嘉義縣 互相誤判)
+    for loc in locations:
+        if loc['LocationName'] == city_name:
+            return loc
+
+    # 其次找名稱包含縣市名 (去掉 市/縣) 的觀測點
+    city_base_name = city_name.replace('市', '').replace('縣', '')
+    for loc in locations:
+        if city_base_name in loc['LocationName']:
+            return loc
+
+    # If not found, just use the first available location as fallback
+    if fallback_first and locations:
+        return locations[0]
+    return None
+
+def _parse_week_location(location):
+    """
+    將單一觀測點的 WeatherElement 轉換為逐 12 小時預報列表
     
+    Returns:
+        list: 預報列表；找不到'天氣現象'資料時回傳 None
+    """
+    weather_elements = location['WeatherElement']
+
+    def find_element(name):
+        return next(item for item in weather_elements if item["ElementName"] == name)
+
+    # F-D0047-091 使用中文 ElementName
+    # 天氣現象: Weather (Value: Weather, WeatherCode)
+    # 最高溫度: MaxTemperature (Value: MaxTemperature)
+    # 最低溫度: MinTemperature (Value: MinTemperature)
+    # 12小時降雨機率: 12小時降雨機率 (Value: ProbabilityOfPrecipitation)
+    
+    forecasts = []
+    # Usually 14 periods for 7 days
+    try:
+        time_periods = find_element('天氣現象')['Time']
+    except StopIteration:
+        return None
+
+    for i in range(len(time_periods)):
+        wx_time = time_periods[i]
+        start_time = wx_time['StartTime']
+        end_time = wx_time['EndTime']
+        
+        # Extract Weather and WeatherCode
+        # Structure: ElementValue: [ { "Weather": "...", "WeatherCode": "..." } ]
+        wx_val_list = wx_time['ElementValue'][0]
+        weather_state = wx_val_list.get('Weather', '')
+        weather_code = wx_val_list.get('WeatherCode', '')
+        
+        # Extract Max Temp
+        try:
+            max_t_time = find_element('最高溫度')['Time'][i]
+            max_temp = max_t_time['ElementValue'][0]['MaxTemperature']
+        except:
+            max_temp = "-"
+
+        # Extract Min Temp
+        try:
+            min_t_time = find_element('最低溫度')['Time'][i]
+            min_temp = min_t_time['ElementValue'][0]['MinTemperature']
+        except:
+            min_temp = "-"
+        
+        # Extract PoP (12h)
+        try:
+            pop_time = find_element('12小時降雨機率')['Time'][i]
+            pop = pop_time['ElementValue'][0]['ProbabilityOfPrecipitation']
+            if pop == ' ': pop = "0"
+        except:
+            pop = "0"
+
+        forecasts.append({
+            "start_time": start_time,
+            "end_time": end_time,
+            "weather_state": weather_state,
+            "weather_code": weather_code,
+            "max_temp": max_temp,
+            "min_temp": min_temp,
+            "pop": pop
+        })
+
+    return forecasts
+
+def _fetch_week_forecast(city_name, cache_key):
+    """
+    實際呼叫 CWA API F-D0047-091 並寫入快取
+    """
+    # F-D0047-091: 臺灣各縣市鄉鎮未來1週逐12小時天氣預報
+    # locationName 為縣市名稱 (例如 宜蘭縣)，回傳的 Location 列表為該縣市的預報點
     url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-091?Authorization={API_KEY}&locationName={city_name}"
     print(f"正在查詢 {city_name} 的一週天氣資料 (CWA Week)...")
 
     data = {}
     try:
-        response = requests.get(url, verify=False)
-        response.raise_for_status()
+        response = upstream_client.get(url, "F-D0047-091")
         data = response.json()
 
         if not data.get("success"):
             raise ValueError("CWA API 回應失敗 (success=false)。")
 
-        # The result typically contains a list of locations. Since we filtered by locationName={city_name},
-        # we should get that city's data.
-        # But wait, F-D0047-091 returns "Content: The weather forecasts for the townships in the specified county/city."
-        # This means we will get a list of TOWNSHIPS (e.g. Banqiao, Xinzhuang...).
-        # We need to pick ONE representative township for the "City View".
-        # As a heuristic, we will pick the first location returned, or try to find a district that matches the city name (usually not applicable for Counties).
-        # Let's just pick the first one which is usually the County Seat or a major district.
-        
+        # 回傳的 Location 可能包含多個預報點，挑選一個代表該縣市
         locations = data['records']['Locations'][0]['Location']
         if not locations:
             return None, "找不到該縣市的預報資料"
             
-        # Find the location that matches the city name
-        # The city_name is typically the county/city (e.g., "臺北市", "新北市")
-        # We need to find a district/location that best represents this city
-        location = None
-        
-        # First, try to find a location whose name contains the city name (without 市/縣)
-        city_base_name = city_name.replace('市', '').replace('縣', '')
-        for loc in locations:
-            if city_base_name in loc['LocationName']:
-                location = loc
-                break
-        
-        # If not found, just use the first available location as fallback
-        if location is None:
-            location = locations[0]
-            
+        location = _pick_week_location(city_name, locations)
         print(f"使用觀測點: {location['LocationName']}")
 
-        weather_elements = location['WeatherElement']
-
-        def find_element(name):
-            return next(item for item in weather_elements if item["ElementName"] == name)
-
-        # F-D0047-091 typically has:
-        # Wx: Weather Description
-        # MaxT: Max Temp
-        # MinT: Min Temp
-        # PoP12h: Probability of Precipitation (12h)
-        
-        # F-D0047-091 使用中文 ElementName
-        # 天氣現象: Weather (Value: Weather, WeatherCode)
-        # 最高溫度: MaxTemperature (Value: MaxTemperature)
-        # 最低溫度: MinTemperature (Value: MinTemperature)
-        # 12小時降雨機率: 12小時降雨機率 (Value: ProbabilityOfPrecipitation)
-        
-        forecasts = []
-        # Usually 14 periods for 7 days
-        try:
-            time_periods = find_element('天氣現象')['Time']
-        except StopIteration:
+        forecasts = _parse_week_location(location)
+        if forecasts is None:
             return None, "找不到'天氣現象'資料"
 
-        for i in range(len(time_periods)):
-            wx_time = time_periods[i]
-            start_time = wx_time['StartTime']
-            end_time = wx_time['EndTime']
-            
-            # Extract Weather and WeatherCode
-            # Structure: ElementValue: [ { "Weather": "...", "WeatherCode": "..." } ]
-            wx_val_list = wx_time['ElementValue'][0]
-            weather_state = wx_val_list.get('Weather', '')
-            weather_code = wx_val_list.get('WeatherCode', '')
-            
-            # Extract Max Temp
-            try:
-                max_t_time = find_element('最高溫度')['Time'][i]
-                max_temp = max_t_time['ElementValue'][0]['MaxTemperature']
-            except:
-                max_temp = "-"
-
-            # Extract Min Temp
-            try:
-                min_t_time = find_element('最低溫度')['Time'][i]
-                min_temp = min_t_time['ElementValue'][0]['MinTemperature']
-            except:
-                min_temp = "-"
-            
-            # Extract PoP (12h)
-            try:
-                pop_time = find_element('12小時降雨機率')['Time'][i]
-                pop = pop_time['ElementValue'][0]['ProbabilityOfPrecipitation']
-                if pop == ' ': pop = "0"
-            except:
-                pop = "0"
-
-            forecasts.append({
-                "start_time": start_time,
-                "end_time": end_time,
-                "weather_state": weather_state,
-                "weather_code": weather_code,
-                "max_temp": max_temp,
-                "min_temp": min_temp,
-                "pop": pop
-            })
-
         result = (forecasts, None)
         CACHE[cache_key] = (time.time(), result[0])
         return result
@@ -376,28 +596,103 @@ def get_week_forecast(city_name):
         print(f"API 回應已寫入錯誤日誌: {log_filename}")
         return None, f"處理 API 資料時發生錯誤: {e}"
 
+# 批次查詢一週預報時，每次請求最多帶入的縣市數量 (22 縣市可一次查完)
+WEEK_BULK_BATCH_SIZE = 22
+
+def refresh_all_week_forecasts(cities=None, batch_size=None):
+    """
+    批次查詢多個縣市的一週天氣預報，一次解析並寫入所有 week_{city} 快取
+    
+    Args:
+        cities: 縣市名稱列表，預設為全台 22 縣市
+        batch_size: 每次請求的縣市數量，預設為 WEEK_BULK_BATCH_SIZE
+        
+    Returns:
+        ({縣市名: 預報列表}, 錯誤訊息)
+    """
+    if not API_KEY:
+        return None, "錯誤：無法讀取 API Key，請檢查 config.ini 檔案。"
+
+    if cities is None:
+        cities = list(CITY_TO_AQI_STATION.keys())
+    batch_size = batch_size or WEEK_BULK_BATCH_SIZE
+
+    results = {}
+    errors = []
+    for i in range(0, len(cities), batch_size):
+        batch = cities[i:i + batch_size]
+        batch_key = "week_bulk_" + ",".join(batch)
+        batch_result, error = _single_flight(batch_key, lambda batch=batch: _fetch_week_forecast_bulk(batch))
+        if error:
+            errors.append(error)
+            continue
+        results.update(batch_result)
+
+    if not results and errors:
+        return None, errors[0]
+    return results, None
+
+def _fetch_week_forecast_bulk(cities):
+    """
+    以單一請求查詢多個縣市的 F-D0047-091 並寫入各縣市快取
+    """
+    location_names = ",".join(cities)
+    url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-091?Authorization={API_KEY}&locationName={location_names}"
+    print(f"正在批次查詢 {len(cities)} 個縣市的一週天氣資料 (CWA Week)...")
+
+    data = {}
+    try:
+        response = upstream_client.get(url, "F-D0047-091")
+        data = response.json()
+
+        if not data.get("success"):
+            raise ValueError("CWA API 回應失敗 (success=false)。")
+
+        # Locations 可能依縣市分組 (LocationsName 為縣市名)，也可能是單一群組內含所有縣市
+        grouped = {}
+        all_locations = []
+        for group in data['records']['Locations']:
+            group_locations = group.get('Location', [])
+            grouped[group.get('LocationsName', '')] = group_locations
+            all_locations.extend(group_locations)
+
+        now = time.time()
+        results = {}
+        for city_name in cities:
+            if city_name in grouped:
+                location = _pick_week_location(city_name, grouped[city_name])
+            else:
+                location = _pick_week_location(city_name, all_locations, fallback_first=False)
+            if location is None:
+                print(f"[{city_name}] 批次資料中找不到對應觀測點")
+                continue
+
+            forecasts = _parse_week_location(location)
+            if forecasts is None:
+                continue
+
+            results[city_name] = forecasts
+            CACHE[f"week_{city_name}"] = (now, forecasts)
+
+        print(f"批次一週預報完成：{len(results)}/{len(cities)} 個縣市已寫入快取")
+        return results, None
+
+    except (requests.exceptions.RequestException, ValueError, KeyError, IndexError, StopIteration) as e:
+        log_dir = "error_logs"
+        os.makedirs(log_dir, exist_ok=True)
+        log_filename = os.path.join(log_dir, "cwa_api_week_error_BULK.json")
+        with open(log_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        print(f"API 回應已寫入錯誤日誌: {log_filename}")
+        return None, f"處理 API 資料時發生錯誤: {e}"
+
 def get_aqi_key():
     """
     從 config.ini 讀取環境部 API Key
     """
-    config = configparser.ConfigParser()
-    
-    # Try different paths
-    paths = [
-        "config.ini",
-        "../backend/config.ini",
-        os.path.join(os.path.dirname(__file__), "../backend/config.ini"),
-        os.path.join(os.path.dirname(__file__), "config.ini")
-    ]
-    
-    found = False
-    for path in paths:
-        if config.read(path):
-            found = True
-            break
-            
-    if not found:
-        return None, f"錯誤：找不到 config.ini 檔案 (嘗試路徑: {paths})。"
+    config = _read_config()
+    if config is None:
+        return None, f"錯誤：找不到 config.ini 檔案 (嘗試路徑: {CONFIG_PATHS})。"
     
     if 'moenv' not in config or 'api_key' not in config['moenv']:
         return None, "錯誤：config.ini 檔案中找不到 [moenv] 或 api_key。"
@@ -436,105 +731,152 @@ CITY_TO_AQI_STATION = {
     "連江縣": "連江縣"
 }
 
+def _build_city_aliases():
+    """
+    建立 縣市別名 → 正式名稱 對照表
+    包含 臺/台 兩種寫法，以及去掉 市/縣 的簡稱 (新竹、嘉義 這類市縣同名者除外)
+    """
+    aliases = {}
+    ambiguous = set()
+    for city in CITY_TO_AQI_STATION:
+        base = city[:-1]
+        for name in {city, city.replace('臺', '台'), base, base.replace('臺', '台')}:
+            if aliases.get(name, city) != city:
+                ambiguous.add(name)
+            aliases.setdefault(name, city)
+    for name in ambiguous:
+        del aliases[name]
+    return aliases
+
+CITY_ALIASES = _build_city_aliases()
+
+def normalize_city_name(city_name):
+    """
+    將使用者輸入的縣市名稱轉為正式名稱 (例如 台北 → 臺北市)
+    不在 22 縣市內的名稱回傳 None，呼叫端應在發出任何上游請求前拒絕
+    """
+    if not city_name:
+        return None
+    name = unicodedata.normalize('NFKC', city_name).strip()
+    return CITY_ALIASES.get(name)
+
 def get_aqi_data(city_name):
     """
     查詢指定城市的空氣品質資料 (使用環境部 API AQX_P_432)
+    所有縣市共用同一份測站索引，查詢時只需字典查找
     回傳: (資料字典, 錯誤訊息)
     """
     if not AQI_API_KEY:
         return None, "錯誤：無法讀取環境部 API Key，請檢查 config.ini 檔案中的 [moenv] 設定。"
 
-    # Check Cache
-    cache_key = f"aqi_{city_name}"
-    if cache_key in CACHE:
-        timestamp, cached_data = CACHE[cache_key]
-        if time.time() - timestamp < CACHE_TTL:
-            print(f"[{city_name} AQI] 使用快取資料 (無需呼叫 API)")
-            return cached_data, None
+    city = normalize_city_name(city_name)
+    if city is None:
+        return None, f"找不到縣市: {city_name}"
+    city_name = city
 
+    aqi_index, error = get_aqi_index()
+    if error:
+        return None, error
+
+    result_data = find_city_aqi(aqi_index, city_name)
+    if result_data is None:
+        return None, f"找不到 {city_name} 的空氣品質測站資料"
+    return result_data, None
+
+def find_city_aqi(aqi_index, city_name):
+    """
+    在 AQI 測站索引中查找縣市 (正規名稱) 的 AQI 資料，找不到時回傳 None
+    """
     # Map city name to monitoring station county
     aqi_county = CITY_TO_AQI_STATION.get(city_name, city_name)
-    
+    result_data = aqi_index["best"].get(aqi_county)
+    if result_data is None:
+        result_data = _find_aqi_by_sitename(aqi_index, city_name)
+    return result_data
+
+def get_aqi_index():
+    """
+    取得全台 AQI 測站索引 (整份資料只下載與解析一次，依快取 TTL 更新)
+    回傳: ({"by_county": {縣市: [測站]}, "best": {縣市: AQI 資料}}, 錯誤訊息)
+    """
+    if not AQI_API_KEY:
+        return None, "錯誤：無法讀取環境部 API Key，請檢查 config.ini 檔案中的 [moenv] 設定。"
+
+    cache_key = "aqi_index"
+    return _cached_fetch(cache_key, lambda: _fetch_aqi_index(cache_key), "AQI")
+
+def peek_aqi_index():
+    """
+    只讀取快取中的 AQI 測站索引，不在呼叫端等待上游 (推薦系統等請求路徑使用)
+    快取不存在或已過 soft TTL 時排入背景更新，本次仍回傳現有資料 (超過 hard TTL 則為 None)
+    回傳: (AQI 測站索引, 快取時間)；沒有可用資料時為 (None, None)
+    """
+    if not AQI_API_KEY:
+        return None, None
+
+    cache_key = "aqi_index"
+    entry = CACHE.get(cache_key)
+    now = time.time()
+    age = None if entry is None else now - entry[0]
+    if age is None or age >= CACHE_TTL:
+        negative = NEGATIVE_CACHE.get(cache_key)
+        if negative is None or now - negative[0] >= NEGATIVE_CACHE_TTL:
+            _refresh_in_background(cache_key, lambda: _fetch_aqi_index_or_remember_error(cache_key))
+    if age is None or age >= CACHE_HARD_TTL:
+        return None, None
+    return entry[1], entry[0]
+
+def _fetch_aqi_index_or_remember_error(cache_key):
+    """
+    背景更新用：查詢失敗時記入 negative cache，避免每個請求都再排入一次更新
+    """
+    aqi_index, error = _fetch_aqi_index(cache_key)
+    if error:
+        NEGATIVE_CACHE[cache_key] = (time.time(), error)
+    else:
+        NEGATIVE_CACHE.pop(cache_key, None)
+    return aqi_index, error
+
+def _fetch_aqi_index(cache_key):
+    """
+    實際呼叫環境部 API AQX_P_432，建立縣市 → 測站索引並寫入快取
+    """
     # Taiwan EPA AQI API URL
     url = f"https://data.moenv.gov.tw/api/v2/aqx_p_432?api_key={AQI_API_KEY}&limit=1000&sort=ImportDate%20desc&format=json"
-    print(f"正在查詢 {city_name} 的空氣品質資料 (EPA)...")
+    print(f"正在查詢全台空氣品質資料 (EPA)...")
 
     data = {}
     try:
-        response = requests.get(url, verify=False, timeout=10)
-        response.raise_for_status()
+        response = upstream_client.get(url, "aqx_p_432")
         data = response.json()
 
         if 'records' not in data:
             raise ValueError("EPA API 回應格式不正確")
 
-        records = data['records']
-        
-        # Find stations in the specified county
-        county_stations = [r for r in records if r.get('county') == aqi_county]
-        
-        if not county_stations:
-            # Fallback: try to find any station with the city name
-            county_stations = [r for r in records if city_name.replace('市', '').replace('縣', '') in r.get('sitename', '')]
-        
-        if not county_stations:
-            return None, f"找不到 {city_name} 的空氣品質測站資料"
-        
-        # Use the first valid station with AQI data
-        station_data = None
-        for station in county_stations:
-            if station.get('aqi') and station.get('aqi') != '':
-                station_data = station
-                break
-        
-        if not station_data:
-            # If no station has AQI, just use the first one
-            station_data = county_stations[0]
-        
-        # Extract AQI information
-        aqi_value = station_data.get('aqi', '-')
-        pm25_value = station_data.get('pm2.5', '-')
-        status = station_data.get('status', '-')
-        pollutant = station_data.get('pollutant', '-')
-        sitename = station_data.get('sitename', '-')
-        
-        # Determine AQI level and color
-        aqi_level = 'unknown'
-        try:
-            aqi_num = int(aqi_value) if aqi_value != '-' else 0
-            if aqi_num <= 50:
-                aqi_level = 'good'
-            elif aqi_num <= 100:
-                aqi_level = 'moderate'
-            elif aqi_num <= 150:
-                aqi_level = 'unhealthy-sensitive'
-            elif aqi_num <= 200:
-                aqi_level = 'unhealthy'
-            elif aqi_num <= 300:
-                aqi_level = 'very-unhealthy'
-            else:
-                aqi_level = 'hazardous'
-        except ValueError:
-            aqi_level = 'unknown'
-        
-        result_data = {
-            "aqi": aqi_value,
-            "pm25": pm25_value,
-            "status": status,
-            "pollutant": pollutant,
-            "sitename": sitename,
-            "level": aqi_level
+        by_county = {}
+        for record in data['records']:
+            by_county.setdefault(record.get('county') or '', []).append(record)
+
+        best = {
+            county: _build_aqi_result(_pick_aqi_station(stations))
+            for county, stations in by_county.items()
+        }
+
+        aqi_index = {
+            "by_county": by_county,
+            "best": best,
+            "by_sitename": {}  # 以城市名稱比對測站名稱的結果 (查詢時才填入)
         }
         
         # Cache the result
-        CACHE[cache_key] = (time.time(), result_data)
-        return result_data, None
+        CACHE[cache_key] = (time.time(), aqi_index)
+        return aqi_index, None
 
     except (requests.exceptions.RequestException, ValueError, KeyError) as e:
         # Log error
         log_dir = "error_logs"
         os.makedirs(log_dir, exist_ok=True)
-        log_filename = os.path.join(log_dir, f"epa_aqi_error_{city_name}.json")
+        log_filename = os.path.join(log_dir, "epa_aqi_error.json")
         
         with open(log_filename, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
@@ -542,6 +884,73 @@ def get_aqi_data(city_name):
         print(f"AQI API 回應已寫入錯誤日誌: {log_filename}")
         return None, f"處理 AQI API 資料時發生錯誤: {e}"
 
+def _pick_aqi_station(stations):
+    """
+    Use the first valid station with AQI data; if none has AQI, use the first one
+    """
+    for station in stations:
+        if station.get('aqi') and station.get('aqi') != '':
+            return station
+    return stations[0]
+
+def _find_aqi_by_sitename(aqi_index, city_name):
+    """
+    Fallback: 找不到縣市時，以城市名稱比對測站名稱 (結果會記在索引中)
+    """
+    by_sitename = aqi_index["by_sitename"]
+    if city_name in by_sitename:
+        return by_sitename[city_name]
+
+    city_base_name = city_name.replace('市', '').replace('縣', '')
+    matched = [
+        station
+        for stations in aqi_index["by_county"].values()
+        for station in stations
+        if city_base_name in station.get('sitename', '')
+    ]
+    result_data = _build_aqi_result(_pick_aqi_station(matched)) if matched else None
+    by_sitename[city_name] = result_data
+    return result_data
+
+def _build_aqi_result(station_data):
+    """
+    將測站原始資料轉換為前端使用的 AQI 資料字典
+    """
+    # Extract AQI information
+    aqi_value = station_data.get('aqi', '-')
+    pm25_value = station_data.get('pm2.5', '-')
+    status = station_data.get('status', '-')
+    pollutant = station_data.get('pollutant', '-')
+    sitename = station_data.get('sitename', '-')
+    
+    # Determine AQI level and color
+    aqi_level = 'unknown'
+    try:
+        aqi_num = int(aqi_value) if aqi_value != '-' else 0
+        if aqi_num <= 50:
+            aqi_level = 'good'
+        elif aqi_num <= 100:
+            aqi_level = 'moderate'
+        elif aqi_num <= 150:
+            aqi_level = 'unhealthy-sensitive'
+        elif aqi_num <= 200:
+            aqi_level = 'unhealthy'
+        elif aqi_num <= 300:
+            aqi_level = 'very-unhealthy'
+        else:
+            aqi_level = 'hazardous'
+    except ValueError:
+        aqi_level = 'unknown'
+    
+    return {
+        "aqi": aqi_value,
+        "pm25": pm25_value,
+        "status": status,
+        "pollutant": pollutant,
+        "sitename": sitename,
+        "level": aqi_level
+    }
+
 if __name__ == '__main__':
 
     if not API_KEY:
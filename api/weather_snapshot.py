@@ -0,0 +1,194 @@
+"""
+全台天氣快照模組
+由背景執行緒在快取過期前定期重新查詢全台天氣 (F-C0032-001)，
+整理成不可變的快照後一次替換 (參照指派為原子操作)，
+/api/weather/all 與推薦系統直接讀取快照，請求路徑上不需要等待上游 API。
+"""
+
+import json
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, NamedTuple, Optional
+
+import leader_election
+from weather_api import CACHE_HARD_TTL, CACHE_TTL, NEGATIVE_CACHE_TTL, get_all_weather, refresh_all_weather
+
+# 在 soft TTL 到期前多久重新整理快照 (秒)
+SNAPSHOT_REFRESH_MARGIN = 60
+# 重新整理的最短間隔 (秒)
+SNAPSHOT_MIN_INTERVAL = 30
+
+STOP_EVENT = threading.Event()
+SNAPSHOT_THREAD = None
+SNAPSHOT_STATS = {
+    "refreshes": 0,   # 成功發布快照的次數
+    "failures": 0,    # 重新整理失敗的次數
+    "fallbacks": 0,   # 沒有可用快照、改走一般查詢的次數
+    "last_error": None,
+}
+
+
+class WeatherSnapshot(NamedTuple):
+    """
+    一份已發布的全台天氣快照 (發布後不再修改)
+
+    data: {縣市名: 天氣資料} 的唯讀 mapping
+    payload: /api/weather/all 的回應內容 (已序列化的 JSON bytes)
+    """
+    data: MappingProxyType
+    payload: bytes
+    created_at: float
+    refresh_duration: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+# 目前發布中的快照 (尚未成功查詢過時為 None)
+_SNAPSHOT: Optional[WeatherSnapshot] = None
+
+
+def get_refresh_interval() -> float:
+    """
+    快照重新整理間隔：在 soft TTL 到期前 SNAPSHOT_REFRESH_MARGIN 秒
+    """
+    return max(SNAPSHOT_MIN_INTERVAL, CACHE_TTL - SNAPSHOT_REFRESH_MARGIN)
+
+
+def build_snapshot(
+    all_weather: Dict[str, Dict[str, Any]],
+    refresh_duration: float = 0.0,
+    created_at: Optional[float] = None
+) -> WeatherSnapshot:
+    """
+    將全台天氣資料複製為唯讀結構，並預先序列化 /api/weather/all 的回應
+    """
+    data = MappingProxyType({
+        city_name: MappingProxyType(dict(city_data))
+        for city_name, city_data in all_weather.items()
+    })
+    payload = json.dumps({'success': True, 'data': all_weather}, ensure_ascii=False).encode('utf-8')
+    return WeatherSnapshot(data, payload, created_at or time.time(), refresh_duration)
+
+
+def refresh_snapshot() -> Optional[str]:
+    """
+    重新查詢全台天氣並發布新快照；失敗時保留舊快照
+
+    Returns:
+        錯誤訊息 (成功時為 None)
+    """
+    global _SNAPSHOT
+    start = time.time()
+    all_weather, error = refresh_all_weather()
+    if error:
+        SNAPSHOT_STATS["failures"] += 1
+        SNAPSHOT_STATS["last_error"] = error
+        print(f"[Snapshot] 全台天氣快照更新失敗: {error}")
+        return error
+
+    _SNAPSHOT = build_snapshot(all_weather, round(time.time() - start, 3))
+    SNAPSHOT_STATS["refreshes"] += 1
+    SNAPSHOT_STATS["last_error"] = None
+    # 發布到共用儲存區，其他 worker 不需再查詢上游
+    leader_election.publish("weather_snapshot", {
+        "data": all_weather,
+        "created_at": _SNAPSHOT.created_at,
+        "refresh_duration": _SNAPSHOT.refresh_duration
+    })
+    return None
+
+
+def sync_snapshot_from_shared() -> None:
+    """
+    follower 從共用儲存區讀取 leader 發布的快照 (發布時間不同時才重新建立)
+    """
+    global _SNAPSHOT
+    shared, _ = leader_election.read_published("weather_snapshot")
+    if not shared:
+        return
+    if _SNAPSHOT is None or _SNAPSHOT.created_at != shared["created_at"]:
+        _SNAPSHOT = build_snapshot(shared["data"], shared["refresh_duration"], shared["created_at"])
+
+
+def get_snapshot() -> Optional[WeatherSnapshot]:
+    """
+    取得目前可用的快照；尚未建立或已超過 hard TTL (持續更新失敗) 時回傳 None
+    """
+    snapshot = _SNAPSHOT
+    if snapshot is None or snapshot.age >= CACHE_HARD_TTL:
+        return None
+    return snapshot
+
+
+def get_all_weather_snapshot():
+    """
+    與 get_all_weather 相同的回傳格式，優先讀取快照
+    沒有可用快照時 (服務剛啟動或持續更新失敗) 才退回一般的快取查詢
+
+    回傳: ({縣市名: 天氣資料}, 錯誤訊息)
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.data, None
+    SNAPSHOT_STATS["fallbacks"] += 1
+    return get_all_weather()
+
+
+def snapshot_loop() -> None:
+    """
+    背景迴圈：啟動時立即建立快照，之後在快取過期前定期重新整理 (失敗時較快重試)
+    """
+    print("[Snapshot] 全台天氣快照服務已啟動")
+    while not STOP_EVENT.is_set():
+        try:
+            error = refresh_snapshot()
+        except Exception as e:
+            SNAPSHOT_STATS["failures"] += 1
+            SNAPSHOT_STATS["last_error"] = str(e)
+            error = str(e)
+            print(f"[Snapshot] 全台天氣快照更新發生錯誤: {e}")
+        if STOP_EVENT.wait(NEGATIVE_CACHE_TTL if error else get_refresh_interval()):
+            break
+    print("[Snapshot] 全台天氣快照服務已停止")
+
+
+def start_snapshot_refresher() -> None:
+    """
+    啟動背景快照執行緒
+    """
+    global SNAPSHOT_THREAD
+    if SNAPSHOT_THREAD and SNAPSHOT_THREAD.is_alive():
+        return
+    STOP_EVENT.clear()
+    SNAPSHOT_THREAD = threading.Thread(target=snapshot_loop, name='weather-snapshot', daemon=True)
+    SNAPSHOT_THREAD.start()
+
+
+def stop_snapshot_refresher() -> None:
+    """
+    停止背景快照執行緒
+    """
+    STOP_EVENT.set()
+
+
+def get_snapshot_stats() -> Dict[str, Any]:
+    """
+    取得快照的年齡、上次重新整理耗時與更新統計
+    """
+    snapshot = _SNAPSHOT
+    return {
+        "available": snapshot is not None and snapshot.age < CACHE_HARD_TTL,
+        "age": None if snapshot is None else round(snapshot.age, 1),
+        "created_at": None if snapshot is None else snapshot.created_at,
+        "refresh_duration": None if snapshot is None else snapshot.refresh_duration,
+        "refresh_interval": get_refresh_interval(),
+        "cities": 0 if snapshot is None else len(snapshot.data),
+        "refreshes": SNAPSHOT_STATS["refreshes"],
+        "failures": SNAPSHOT_STATS["failures"],
+        "fallbacks": SNAPSHOT_STATS["fallbacks"],
+        "last_error": SNAPSHOT_STATS["last_error"],
+        "running": bool(SNAPSHOT_THREAD and SNAPSHOT_THREAD.is_alive())
+    }
@@ -1,102 +1,330 @@
 """
 極端天氣警報監控系統 (Feature #15)
 背景執行緒定期檢查中央氣象署警報 (W-C0033-001)
+
+每次輪詢帶上 ETag / Last-Modified 條件請求；上游不支援時以內容雜湊判斷資料是否變動，
+沒有變動就不重新解析。有變動時計算新增 / 解除 / 內容變更的警報並遞增版本號，
+下游可用 wait_for_change 等待下一次變動。輪詢間隔依警報狀態調整：有警報時較頻繁；
+平靜時預設維持 CALM_INTERVAL，可在 config.ini [alerts] max_calm_interval 設定較長的上限讓平靜時逐步放慢。
+推播 (SSE) 的事件 ID 為警報內容雜湊 (alerts_event_id)，不同 worker 與重新啟動後都相同。
 """
 
+import configparser
+import os
 import threading
 import time
-import requests
 import json
+import hashlib
+import upstream_client
+import leader_election
 from weather_api import API_KEY
 
 # 全域變數儲存最新警報
 CURRENT_ALERTS = []
-LAST_UPDATE_TIME = 0
+LAST_UPDATE_TIME = 0    # 最近一次成功檢查的時間
+LAST_CHANGE_TIME = 0    # 警報內容最近一次變動的時間
+ALERTS_VERSION = 0      # 警報內容每變動一次加 1 (只在本行程內有意義)
+LAST_DIFF = {"added": [], "removed": [], "changed": []}
 MONITOR_THREAD = None
 STOP_EVENT = threading.Event()
+# 警報變動時通知等待中的下游 (wait_for_change)
+ALERTS_CHANGED = threading.Condition()
+
+# 條件請求與內容雜湊 (判斷上游資料是否變動)
+ETAG = None
+LAST_MODIFIED = None
+PAYLOAD_HASH = None
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.ini')
+
+# 輪詢間隔 (秒)：有警報時固定較短；沒有警報時每次未變動就放慢，直到上限
+# 災害警報需要及時送達，上限預設與 CALM_INTERVAL 相同 (不放慢)；條件請求已讓平靜時的輪詢很便宜
+ACTIVE_INTERVAL = 60
+CALM_INTERVAL = 300
+CALM_BACKOFF = 1.5
+CURRENT_INTERVAL = CALM_INTERVAL
+
+
+def get_max_calm_interval():
+    """
+    讀取 config.ini 的 [alerts] max_calm_interval (平靜時輪詢間隔的上限，不小於 CALM_INTERVAL)
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.read(CONFIG_PATH, encoding='utf-8')
+    try:
+        value = config.getint('alerts', 'max_calm_interval', fallback=CALM_INTERVAL)
+    except ValueError:
+        print(f"[Warn] config.ini [alerts] max_calm_interval 格式錯誤，使用預設值 {CALM_INTERVAL}")
+        value = CALM_INTERVAL
+    return max(CALM_INTERVAL, value)
+
+
+MAX_CALM_INTERVAL = get_max_calm_interval()
+
+POLL_STATS = {
+    "polls": 0,         # 輪詢次數
+    "not_modified": 0,  # 上游回應 304 的次數
+    "unchanged": 0,     # 內容雜湊相同 (或解析後沒有差異) 而略過的次數
+    "changed": 0,       # 警報內容變動的次數
+    "errors": 0,
+}
 
 # 測試模式：強制產生假警報以供展示
-TEST_MODE = False 
+TEST_MODE = False
+# 測試模式的假警報 (內容固定，重複輪詢不會被視為變動)
+TEST_ALERT = {
+    "title": "海上陸上颱風警報",
+    "type": "颱風",
+    "color": "danger",
+    "location": "全台各地",
+    "description": "強烈颱風接近，請做好防颱準備。",
+}
+
+
+def _alert_id(title, locations):
+    """以警報標題與完整的縣市列表產生固定的警報 ID"""
+    return hashlib.sha1(f"{title}|{locations}".encode('utf-8')).hexdigest()[:12]
+
+
+def parse_alerts(data, previous=None):
+    """
+    將 W-C0033-001 回應轉換為警報列表
+
+    Args:
+        previous: 目前的警報列表；沒有生效時間的警報沿用上次的時間，避免每次解析都被視為變更
+    """
+    previous_time = {alert["id"]: alert["time"] for alert in previous or []}
+    records = data.get('records', {}).get('record', [])
+    alerts = []
+
+    for record in records:
+        # 檢查是否有危害性天氣
+        dataset_info = record.get('datasetDescription', '')
+        location = record.get('location', [])
+
+        # W-C0033-001 結構較複雜，通常 datasetDescription 會包含警報類型
+        # 簡化處理：如果有 record，通常代表有特報
+
+        hazard_content = record.get('contents', {}).get('content', {}).get('contentText', '')
+        if not hazard_content:
+            continue
+
+        locations_str = "、".join([loc['locationName'] for loc in location])
+        title = record.get('datasetDescription', '天氣特報')
+        alert_id = _alert_id(title, locations_str)
+        default_time = previous_time.get(alert_id) or time.strftime("%Y-%m-%d %H:%M")
+
+        alerts.append({
+            "id": alert_id,
+            "title": title,
+            "type": "warning",
+            "color": "warning", # warning, danger
+            "location": locations_str if len(locations_str) < 20 else "多個縣市",
+            "description": hazard_content,
+            "time": record.get('datasetInfo', {}).get('validTime', {}).get('startTime', default_time)
+        })
+    return alerts
+
+
+def alerts_event_id(alerts):
+    """
+    以警報內容雜湊作為 SSE 事件 ID：相同內容在任何 worker、重新啟動後都得到相同 ID，
+    用戶端帶 Last-Event-ID 重新連線時可以正確判斷是否錯過變動
+    """
+    payload = json.dumps(alerts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def format_alert_event(alerts, last_update, event_id=None):
+    """將警報列表轉換為一則 SSE 事件"""
+    event_id = event_id or alerts_event_id(alerts)
+    payload = json.dumps({
+        'alerts': alerts,
+        'last_update': last_update,
+        'event_id': event_id
+    }, ensure_ascii=False)
+    return f"id: {event_id}\nevent: alerts\ndata: {payload}\n\n"
+
+
+def diff_alerts(old_alerts, new_alerts):
+    """
+    比較新舊警報列表 (以警報 ID 對應)
+
+    Returns:
+        {"added": [警報], "removed": [警報], "changed": [新版警報]}
+    """
+    old_by_id = {alert["id"]: alert for alert in old_alerts}
+    new_by_id = {alert["id"]: alert for alert in new_alerts}
+    return {
+        "added": [alert for alert_id, alert in new_by_id.items() if alert_id not in old_by_id],
+        "removed": [alert for alert_id, alert in old_by_id.items() if alert_id not in new_by_id],
+        "changed": [
+            alert for alert_id, alert in new_by_id.items()
+            if alert_id in old_by_id and old_by_id[alert_id] != alert
+        ],
+    }
+
+
+def _publish_alerts(alerts):
+    """
+    與目前警報比較，有差異時才替換 CURRENT_ALERTS、遞增版本號並通知等待者
+
+    Returns:
+        差異 (沒有變動時為 None)
+    """
+    global CURRENT_ALERTS, LAST_UPDATE_TIME, LAST_CHANGE_TIME, ALERTS_VERSION, LAST_DIFF
+    LAST_UPDATE_TIME = time.time()
+    diff = diff_alerts(CURRENT_ALERTS, alerts)
+    if not (diff["added"] or diff["removed"] or diff["changed"]):
+        POLL_STATS["unchanged"] += 1
+        return None
+
+    with ALERTS_CHANGED:
+        CURRENT_ALERTS = alerts
+        LAST_DIFF = diff
+        LAST_CHANGE_TIME = LAST_UPDATE_TIME
+        ALERTS_VERSION += 1
+        ALERTS_CHANGED.notify_all()
+    POLL_STATS["changed"] += 1
+    print(f"[AlertMonitor] 警報更新：新增 {len(diff['added'])}、解除 {len(diff['removed'])}、"
+          f"變更 {len(diff['changed'])}，目前有 {len(alerts)} 則警報")
+    return diff
+
 
 def fetch_alerts():
     """
     呼叫 CWA API 取得警報資料
     API: W-C0033-001 (天氣特報-各縣市)
+
+    Returns:
+        警報差異 {"added", "removed", "changed"}；資料沒有變動或查詢失敗時為 None
     """
-    global CURRENT_ALERTS, LAST_UPDATE_TIME
-    
+    global LAST_UPDATE_TIME, ETAG, LAST_MODIFIED, PAYLOAD_HASH
+
     if not API_KEY:
         print("[AlertMonitor] 無法啟動：找不到 API Key")
-        return
+        return None
+
+    POLL_STATS["polls"] += 1
 
     # 測試模式：模擬颱風警報
     if TEST_MODE:
         print("[AlertMonitor] 測試模式：生成模擬警報")
-        CURRENT_ALERTS = [{
-            "title": "海上陸上颱風警報",
-            "type": "颱風",
-            "color": "danger",
-            "location": "全台各地",
-            "description": "強烈颱風接近，請做好防颱準備。",
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
-        }]
-        LAST_UPDATE_TIME = time.time()
-        return
+        alert_id = _alert_id(TEST_ALERT["title"], TEST_ALERT["location"])
+        # 沿用第一次產生的時間，避免每次輪詢都推播一次「變動」
+        previous_time = next((alert["time"] for alert in CURRENT_ALERTS if alert["id"] == alert_id), None)
+        return _publish_alerts([{
+            "id": alert_id,
+            **TEST_ALERT,
+            "time": previous_time or time.strftime("%Y-%m-%d %H:%M:%S")
+        }])
 
     url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/W-C0033-001?Authorization={API_KEY}"
-    
+
+    # 條件請求：上游資料未變動時回應 304，不需下載內容
+    headers = {}
+    if ETAG:
+        headers["If-None-Match"] = ETAG
+    if LAST_MODIFIED:
+        headers["If-Modified-Since"] = LAST_MODIFIED
+
     try:
-        response = requests.get(url, verify=False, timeout=10)
-        response.raise_for_status()
+        response = upstream_client.get(url, "W-C0033-001", headers=headers)
+        if response.status_code == 304:
+            POLL_STATS["not_modified"] += 1
+            LAST_UPDATE_TIME = time.time()
+            return None
+
+        ETAG = response.headers.get("ETag")
+        LAST_MODIFIED = response.headers.get("Last-Modified")
+
+        # 上游沒有提供 ETag 時以內容雜湊判斷，相同內容不重新解析
+        payload_hash = hashlib.sha256(response.content).hexdigest()
+        if payload_hash == PAYLOAD_HASH:
+            POLL_STATS["unchanged"] += 1
+            LAST_UPDATE_TIME = time.time()
+            return None
+
         data = response.json()
-        
+
         if not data.get("success"):
             print("[AlertMonitor] API 呼叫失敗")
-            return
-
-        records = data.get('records', {}).get('record', [])
-        alerts = []
-        
-        for record in records:
-            # 檢查是否有危害性天氣
-            dataset_info = record.get('datasetDescription', '')
-            location = record.get('location', [])
-            
-            # W-C0033-001 結構較複雜，通常 datasetDescription 會包含警報類型
-            # 簡化處理：如果有 record，通常代表有特報
-            
-            hazard_content = record.get('contents', {}).get('content', {}).get('contentText', '')
-            if not hazard_content:
-                continue
-                
-            locations_str = "、".join([loc['locationName'] for loc in location])
-            
-            alerts.append({
-                "title": record.get('datasetDescription', '天氣特報'),
-                "type": "warning", 
-                "color": "warning", # warning, danger
-                "location": locations_str if len(locations_str) < 20 else "多個縣市",
-                "description": hazard_content,
-                "time": record.get('datasetInfo', {}).get('validTime', {}).get('startTime', time.strftime("%Y-%m-%d %H:%M"))
-            })
-            
-        CURRENT_ALERTS = alerts
-        LAST_UPDATE_TIME = time.time()
-        print(f"[AlertMonitor] 警報更新完成，目前有 {len(alerts)} 則警報")
-        
+            POLL_STATS["errors"] += 1
+            return None
+
+        diff = _publish_alerts(parse_alerts(data, CURRENT_ALERTS))
+        # 成功解析後才記住雜湊，解析失敗的內容下次仍會重試
+        PAYLOAD_HASH = payload_hash
+        return diff
+
     except Exception as e:
+        POLL_STATS["errors"] += 1
         print(f"[AlertMonitor] 抓取錯誤: {e}")
+        return None
+
+
+def _share_state():
+    """
+    將目前警報發布到共用儲存區，供其他 worker 讀取 (只有 leader 執行監控)
+    """
+    with ALERTS_CHANGED:
+        state = {
+            "alerts": CURRENT_ALERTS,
+            "last_update": LAST_UPDATE_TIME,
+            "last_change": LAST_CHANGE_TIME,
+            "version": ALERTS_VERSION,
+            "last_diff": LAST_DIFF
+        }
+    leader_election.publish("alerts", state)
+
+
+def sync_alerts_from_shared():
+    """
+    follower 從共用儲存區讀取 leader 發布的警報；版本變動時替換並通知等待者 (SSE)
+    """
+    global CURRENT_ALERTS, LAST_UPDATE_TIME, LAST_CHANGE_TIME, ALERTS_VERSION, LAST_DIFF
+    state, _ = leader_election.read_published("alerts")
+    if not state:
+        return
+    LAST_UPDATE_TIME = state["last_update"]
+    if state["version"] == ALERTS_VERSION:
+        return
+    with ALERTS_CHANGED:
+        CURRENT_ALERTS = state["alerts"]
+        LAST_DIFF = state["last_diff"]
+        LAST_CHANGE_TIME = state["last_change"]
+        ALERTS_VERSION = state["version"]
+        ALERTS_CHANGED.notify_all()
+
+
+def next_interval(current, changed, active):
+    """
+    計算下一次輪詢的間隔
+
+    Args:
+        current: 目前的間隔 (秒)
+        changed: 本次輪詢警報是否變動
+        active: 目前是否有警報
+    """
+    if active:
+        return ACTIVE_INTERVAL
+    if changed:
+        return CALM_INTERVAL
+    return min(MAX_CALM_INTERVAL, max(CALM_INTERVAL, current * CALM_BACKOFF))
+
 
 def monitor_loop():
     """
     監控迴圈
     """
+    global CURRENT_INTERVAL
     print("[AlertMonitor] 背景監控服務已啟動")
     while not STOP_EVENT.is_set():
-        fetch_alerts()
-        # 每 1 小時 (3600秒) 檢查一次，開發期間縮短為 5 分鐘 (300秒)
+        diff = fetch_alerts()
+        _share_state()
+        CURRENT_INTERVAL = next_interval(CURRENT_INTERVAL, diff is not None, bool(CURRENT_ALERTS))
         # 用 wait 這樣可以被立即中斷
-        if STOP_EVENT.wait(300):
+        if STOP_EVENT.wait(CURRENT_INTERVAL):
             break
     print("[AlertMonitor] 背景監控服務已停止")
 
@@ -107,7 +335,7 @@ def start_alert_monitor():
     global MONITOR_THREAD
     if MONITOR_THREAD and MONITOR_THREAD.is_alive():
         return
-        
+
     STOP_EVENT.clear()
     MONITOR_THREAD = threading.Thread(target=monitor_loop, daemon=True)
     MONITOR_THREAD.start()
@@ -118,12 +346,42 @@ def stop_alert_monitor():
     """
     STOP_EVENT.set()
 
+def wait_for_change(version, timeout=None):
+    """
+    等待警報版本超過 version (已超過時立即回傳)
+
+    Returns:
+        目前的警報版本號
+    """
+    with ALERTS_CHANGED:
+        ALERTS_CHANGED.wait_for(lambda: ALERTS_VERSION != version, timeout)
+        return ALERTS_VERSION
+
 def get_current_alerts():
     """
     取得目前警報
     """
+    # 在鎖內讀取，確保警報列表與版本號一致
+    with ALERTS_CHANGED:
+        return {
+            "success": True,
+            "alerts": CURRENT_ALERTS,
+            "last_update": LAST_UPDATE_TIME,
+            "last_change": LAST_CHANGE_TIME,
+            "version": ALERTS_VERSION,
+            "event_id": alerts_event_id(CURRENT_ALERTS)
+        }
+
+def get_alert_monitor_stats():
+    """
+    取得警報輪詢統計 (條件請求命中、內容變動次數、目前輪詢間隔與最近一次差異)
+    """
     return {
-        "success": True,
-        "alerts": CURRENT_ALERTS,
-        "last_update": LAST_UPDATE_TIME
+        **POLL_STATS,
+        "interval": CURRENT_INTERVAL,
+        "version": ALERTS_VERSION,
+        "alerts": len(CURRENT_ALERTS),
+        "last_diff": {key: len(value) for key, value in LAST_DIFF.items()},
+        "etag": ETAG is not None,
+        "last_modified": LAST_MODIFIED is not None,
     }
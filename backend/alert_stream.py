@@ -0,0 +1,222 @@
+"""
+警報推播伺服器 (Server-Sent Events)
+以 asyncio 在單一執行緒中服務所有 /api/alerts/stream 連線：每條連線只是一個 coroutine，
+不佔用 gunicorn worker 的執行緒，數千個開著的儀表板也只需要一個行程。
+
+一個 broadcaster 每 STREAM_POLL_INTERVAL 秒讀取一次 leader 發布的警報 (leader_election.read_published)，
+內容變動時只格式化一次事件，再分送到每條連線的佇列；事件 ID 為警報內容雜湊 (alert_monitor.alerts_event_id)，
+用戶端帶 Last-Event-ID 重新連線到任何一個行程都能正確判斷是否錯過變動。
+
+使用方式 (在 backend 目錄下；以 gunicorn.conf.py 部署時會自動啟動):
+    python alert_stream.py [port]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+# Add the api directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import leader_election
+from alert_monitor import alerts_event_id, format_alert_event
+
+DEFAULT_PORT = 5001
+STREAM_PORT_ENV = "WEATHER_ALERT_STREAM_PORT"
+STREAM_PATH = "/api/alerts/stream"
+STATS_PATH = "/api/alerts/stream/stats"
+
+STREAM_POLL_INTERVAL = 1.0  # 讀取 leader 發布結果的間隔 (秒)；與連線數無關，整個行程只讀一次
+STREAM_HEARTBEAT = 15       # 秒，沒有變動時送出註解保持連線，也藉由寫入失敗發現已斷線的用戶端
+STREAM_RETRY_MS = 5000      # 斷線後瀏覽器重新連線的等待時間
+CLIENT_QUEUE_SIZE = 16      # 每條連線最多累積的未送出訊息，超過時視為過慢的用戶端並中斷
+REQUEST_TIMEOUT = 10        # 讀取請求標頭的最長秒數
+
+# 每條連線各一個佇列 (broadcaster 放入訊息，連線的 coroutine 取出寫入)
+CLIENTS = set()
+# 目前的事件 (事件 ID, 已編碼的事件內容)；尚未讀到 leader 發布的警報時為 None
+CURRENT_EVENT = None
+STREAM_STATS = {
+    "connections": 0,   # 累計連線數
+    "events": 0,        # 廣播的警報事件數
+    "slow_clients": 0,  # 佇列滿了而中斷的連線數
+    "errors": 0,
+}
+
+CORS_HEADERS = (
+    "Access-Control-Allow-Origin: *\r\n"
+    "Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n"
+)
+
+
+def _chunk(data: bytes) -> bytes:
+    """以 HTTP/1.1 chunked 編碼包裝一段資料"""
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+def _fan_out(message: bytes) -> None:
+    """
+    將訊息放入每條連線的佇列 (已編碼的內容由所有連線共用)
+    """
+    for queue in list(CLIENTS):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 用戶端跟不上：清空佇列並放入 None 讓連線結束，瀏覽器會自動重新連線
+            STREAM_STATS["slow_clients"] += 1
+            CLIENTS.discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+def _refresh_event() -> bool:
+    """
+    讀取 leader 發布的警報，內容 (事件 ID) 變動時更新 CURRENT_EVENT
+
+    Returns:
+        bool: 事件是否變動
+    """
+    global CURRENT_EVENT
+    state, _ = leader_election.read_published("alerts")
+    if not state:
+        return False
+    event_id = alerts_event_id(state["alerts"])
+    if CURRENT_EVENT is not None and CURRENT_EVENT[0] == event_id:
+        return False
+    event = format_alert_event(state["alerts"], state["last_update"], event_id)
+    CURRENT_EVENT = (event_id, event.encode("utf-8"))
+    return True
+
+
+async def broadcaster() -> None:
+    """
+    背景 coroutine：定期讀取發布的警報，變動時廣播事件，並定期送出 heartbeat
+    (讀取 SQLite 為單一主鍵查詢，直接在事件迴圈中執行)
+    """
+    last_heartbeat = time.monotonic()
+    while True:
+        try:
+            if _refresh_event():
+                STREAM_STATS["events"] += 1
+                _fan_out(CURRENT_EVENT[1])
+        except Exception as e:
+            STREAM_STATS["errors"] += 1
+            print(f"[AlertStream] 讀取警報失敗: {e}")
+        if time.monotonic() - last_heartbeat >= STREAM_HEARTBEAT:
+            last_heartbeat = time.monotonic()
+            _fan_out(b": heartbeat\n\n")
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+
+async def _read_request(reader):
+    """
+    讀取請求行與標頭
+
+    Returns:
+        (method, path, query, headers)
+    """
+    request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        raise ValueError("無效的請求")
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    path, _, query = parts[1].partition("?")
+    return parts[0].upper(), path, query, headers
+
+
+def _simple_response(writer, status: str, body: bytes = b"", content_type: str = "application/json") -> None:
+    writer.write(
+        (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+         f"{CORS_HEADERS}Connection: close\r\n\r\n").encode("latin-1") + body
+    )
+
+
+async def handle_client(reader, writer) -> None:
+    """
+    處理一條連線：送出目前警報 (Last-Event-ID 與目前內容相同時略過)，之後等待 broadcaster 的訊息
+    """
+    queue = None
+    try:
+        method, path, query, headers = await _read_request(reader)
+        if method == "OPTIONS":
+            _simple_response(writer, "204 No Content")
+            return
+        if method == "GET" and path == STATS_PATH:
+            _simple_response(writer, "200 OK", json.dumps(get_stream_stats()).encode("utf-8"))
+            return
+        if method != "GET" or path != STREAM_PATH:
+            _simple_response(writer, "404 Not Found", b'{"success": false, "error": "not found"}')
+            return
+
+        last_event_id = headers.get("last-event-id") or parse_qs(query).get("last_event_id", [None])[0]
+        STREAM_STATS["connections"] += 1
+        writer.write(
+            ("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+             "Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n"
+             f"{CORS_HEADERS}Transfer-Encoding: chunked\r\n\r\n").encode("latin-1")
+        )
+        writer.write(_chunk(f"retry: {STREAM_RETRY_MS}\n\n".encode("utf-8")))
+        # 先登記再讀取 CURRENT_EVENT (中間沒有 await)，不會漏掉之後的廣播
+        queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        CLIENTS.add(queue)
+        if CURRENT_EVENT is not None and CURRENT_EVENT[0] != last_event_id:
+            writer.write(_chunk(CURRENT_EVENT[1]))
+        await writer.drain()
+
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            writer.write(_chunk(message))
+            await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError, ValueError):
+        # 用戶端斷線或送出無效的請求
+        pass
+    finally:
+        if queue is not None:
+            CLIENTS.discard(queue)
+        writer.close()
+
+
+def get_stream_stats():
+    """
+    取得推播伺服器的連線與廣播統計
+    """
+    return {
+        **STREAM_STATS,
+        "clients": len(CLIENTS),
+        "event_id": CURRENT_EVENT[0] if CURRENT_EVENT else None,
+    }
+
+
+async def serve(host: str = "0.0.0.0", port: int = DEFAULT_PORT) -> None:
+    """
+    啟動推播伺服器與 broadcaster (直到被取消)
+    """
+    server = await asyncio.start_server(handle_client, host, port, backlog=1024)
+    broadcast_task = asyncio.create_task(broadcaster())
+    print(f"[AlertStream] 警報推播伺服器已啟動: http://{host}:{port}{STREAM_PATH}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        broadcast_task.cancel()
+        print("[AlertStream] 警報推播伺服器已停止")
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get(STREAM_PORT_ENV) or DEFAULT_PORT)
+    try:
+        asyncio.run(serve(port=port))
+    except KeyboardInterrupt:
+        pass
@@ -1,16 +1,24 @@
 import sys
 import os
+import threading
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Add the api directory to the system path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'api'))
 
-from flask import Flask, render_template, jsonify, send_file, request
-from weather_api import get_weather, get_all_weather, get_lifestyle_advice, get_week_forecast, get_aqi_data
-from data_logger import init_database, log_weather_query, get_export_stats
-from data_exporter import export_to_csv, export_to_excel, export_to_json
+from flask import Flask, render_template, jsonify, send_file, request, Response, stream_with_context
+from weather_api import get_weather, get_all_weather, get_lifestyle_advice, get_week_forecast, get_aqi_data, get_aqi_index, refresh_all_week_forecasts, get_single_flight_stats, get_cache_stats, normalize_city_name
+from upstream_client import get_upstream_stats
+from weather_snapshot import get_snapshot, get_snapshot_stats, start_snapshot_refresher, stop_snapshot_refresher, sync_snapshot_from_shared
+from data_logger import init_database, log_weather_query, get_export_stats, get_log_writer_stats, get_result_cache_stats
+from data_exporter import export_to_excel, stream_csv, stream_json, stream_parquet, stream_arrow
 from data_analysis import get_weather_statistics
-from recommender import get_recommended_cities
-from alert_monitor import start_alert_monitor, get_current_alerts
+from recommender import REGIONS, get_recommended_cities, get_top_cities
+from alert_monitor import start_alert_monitor, stop_alert_monitor, sync_alerts_from_shared, get_current_alerts, get_alert_monitor_stats, wait_for_change, format_alert_event
+from retention import start_retention_scheduler, stop_retention_scheduler, get_retention_status, RESULT_LISTENERS as RETENTION_LISTENERS
+import leader_election
 from datetime import datetime
 
 app = Flask(__name__, 
@@ -19,6 +27,10 @@ app = Flask(__name__,
             static_url_path='')
 app.config['JSON_AS_ASCII'] = False
 
+# 建立資料表並套用尚未執行的 migration (依 user_version 判斷，可重複執行)；
+# 以 gunicorn 匯入時不會經過下方的 __main__，因此在匯入時執行
+init_database()
+
 # 台灣 22 縣市列表
 CITIES = [
     "臺北市", "新北市", "桃園市", "臺中市", "臺南市", "高雄市", "基隆市", "新竹市", "嘉義市",
@@ -26,12 +38,27 @@ CITIES = [
     "臺東縣", "澎湖縣", "金門縣", "連江縣"
 ]
 
+# 單一請求內並行查詢上游 (預報與 AQI 同時進行)
+UPSTREAM_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream')
+# AQI 最多等待的時間 (秒，從請求開始計算)；逾時則回傳 aqi: null，背景查詢完成後會寫入快取
+AQI_LATENCY_BUDGET = 2.0
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
 
 @app.route('/api/weather/<city>')
 def api_get_weather(city):
+    request_start = time.time()
+    # 先將縣市名稱正規化 (台/臺、簡稱)，未知名稱直接拒絕，不呼叫上游也不寫錯誤日誌
+    canonical_city = normalize_city_name(city)
+    if canonical_city is None:
+        return jsonify({'success': False, 'error': f'找不到縣市: {city}'}), 404
+    city = canonical_city
+
+    # AQI 與預報同時查詢，避免冷快取時兩段上游延遲相加
+    aqi_future = UPSTREAM_EXECUTOR.submit(get_aqi_data, city)
+
     # 改用可取得 7 天資料的函式
     data, error = get_week_forecast(city)
     if error:
@@ -52,8 +79,14 @@ def api_get_weather(city):
         first = data[0]
         advice = first.get('advice')
     
-    # 嘗試取得 AQI 資料（不影響主要功能）
-    aqi_data, aqi_error = get_aqi_data(city)
+    # 嘗試取得 AQI 資料（不影響主要功能，超過延遲預算則不等待）
+    remaining = max(0, AQI_LATENCY_BUDGET - (time.time() - request_start))
+    try:
+        aqi_data, aqi_error = aqi_future.result(timeout=remaining)
+    except FutureTimeoutError:
+        aqi_data, aqi_error = None, f"超過 {AQI_LATENCY_BUDGET} 秒延遲預算"
+    except Exception as e:
+        aqi_data, aqi_error = None, str(e)
     if aqi_error:
         print(f"AQI 資料取得失敗: {aqi_error}")
         aqi_data = None
@@ -82,6 +115,13 @@ def api_get_weather(city):
 
 @app.route('/api/weather/all')
 def api_get_all_weather():
+    # 優先回傳背景預先建立的快照 (已序列化，不需要等待上游 API)
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        response = Response(snapshot.payload, mimetype='application/json')
+        response.headers['X-Snapshot-Age'] = str(int(snapshot.age))
+        return response
+
     data, error = get_all_weather()
     if error:
         return jsonify({'success': False, 'error': error}), 500
@@ -102,6 +142,21 @@ def api_export_stats():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/stats/logger')
+def api_get_logger_stats():
+    """取得查詢記錄背景寫入的統計 (佇列深度、丟棄筆數)"""
+    return jsonify({'success': True, 'data': get_log_writer_stats()})
+
+@app.route('/api/stats/retention')
+def api_get_retention_stats():
+    """取得歷史資料保留政策與封存狀態"""
+    status = get_retention_status()
+    if not leader_election.is_leader():
+        # 保留政策由 leader 執行，改讀 leader 發布的最近一次結果
+        status['last_run'], _ = leader_election.read_published('retention')
+        status['last_run'] = status['last_run'] or {}
+    return jsonify({'success': True, 'data': status})
+
 @app.route('/api/stats/analysis')
 def api_get_analysis():
     """取得天氣統計分析數據 (Feature #13)"""
@@ -124,22 +179,140 @@ def api_get_recommendation():
         return jsonify(result), 500
 
 
+@app.route('/api/weather/recommend/top')
+def api_get_top_cities():
+    """
+    依條件篩選舒適度最高的城市
+    參數: k (預設 3)、region (北部/中部/南部/東部/離島)、max_pop、min_temp、max_temp
+    """
+    def optional_arg(name, cast):
+        value = request.args.get(name)
+        return None if value in (None, '') else cast(value)
+
+    try:
+        k = optional_arg('k', int) or 3
+        max_pop = optional_arg('max_pop', int)
+        min_temp = optional_arg('min_temp', float)
+        max_temp = optional_arg('max_temp', float)
+    except ValueError:
+        return jsonify({'success': False, 'error': '參數格式錯誤 (k / max_pop 需為整數，min_temp / max_temp 需為數字)'}), 400
+
+    region = request.args.get('region') or None
+    if region is not None and region not in REGIONS:
+        return jsonify({'success': False, 'error': f'未知的地區: {region} (可用: {", ".join(REGIONS)})'}), 400
+
+    result = get_top_cities(k, region, max_pop, min_temp, max_temp)
+    if result['success']:
+        return jsonify(result)
+    return jsonify(result), 500
+
+
+@app.route('/api/cache/stats')
+def api_get_cache_stats():
+    """取得上游請求快取、合併、統計結果快取、全台天氣快照、警報輪詢與 leader 選舉的統計"""
+    return jsonify({
+        'success': True,
+        'cache': get_cache_stats(),
+        'single_flight': get_single_flight_stats(),
+        'upstream': get_upstream_stats(),
+        'results': get_result_cache_stats(),
+        'snapshot': get_snapshot_stats(),
+        'alerts': get_alert_monitor_stats(),
+        'leader': leader_election.get_leader_stats()
+    })
+
+
+# 警報推播 (SSE)：正式部署時由 alert_stream.py (asyncio，單一執行緒服務所有連線) 提供，
+# gunicorn.conf.py 會啟動它並以環境變數告知 port；/api/alerts/stream 路由供開發伺服器 (python app.py) 使用，
+# 每條連線佔用一個執行緒。沒有變動時定期送出註解保持連線，也讓伺服器及早發現已斷線的用戶端
+ALERT_STREAM_PORT = int(os.environ.get('WEATHER_ALERT_STREAM_PORT') or 0) or None
+ALERT_STREAM_HEARTBEAT = 15     # 秒
+ALERT_STREAM_RETRY_MS = 5000    # 斷線後瀏覽器重新連線的等待時間
+ALERT_STREAM_MAX_DURATION = 600 # 單一連線最長秒數，到期後由瀏覽器帶 Last-Event-ID 重新連線
+
+
 @app.route('/api/alerts')
 def api_get_alerts():
-    """取得即時災害性警報 (Feature #15)"""
-    return jsonify(get_current_alerts())
+    """取得即時災害性警報 (Feature #15)；stream_port 為獨立推播伺服器的 port (沒有時使用本服務的 /api/alerts/stream)"""
+    return jsonify({**get_current_alerts(), 'stream_port': ALERT_STREAM_PORT})
 
 
-# 啟動警報監控背景服務
-start_alert_monitor()
+@app.route('/api/alerts/stream')
+def api_stream_alerts():
+    """
+    以 Server-Sent Events 推播警報變動
+    連線時先送出目前警報 (Last-Event-ID 與目前內容相同時略過)，之後只在 alert_monitor 偵測到變動時推送
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
 
+    def stream():
+        yield f"retry: {ALERT_STREAM_RETRY_MS}\n\n"
+        state = get_current_alerts()
+        if state['event_id'] != last_event_id:
+            yield format_alert_event(state['alerts'], state['last_update'], state['event_id'])
+        version = state['version']
 
-@app.route('/api/export/csv')
+        deadline = time.time() + ALERT_STREAM_MAX_DURATION
+        while time.time() < deadline:
+            if wait_for_change(version, ALERT_STREAM_HEARTBEAT) == version:
+                yield ": heartbeat\n\n"
+                continue
+            state = get_current_alerts()
+            version = state['version']
+            yield format_alert_event(state['alerts'], state['last_update'], state['event_id'])
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 避免反向代理緩衝事件
+        }
+    )
+
+
+# 背景工作只由 leader (同一台主機上的一個 worker) 執行，其餘 worker 讀取 leader 發布的結果
+
+# 警報監控背景服務
+leader_election.register_job('alert_monitor', start_alert_monitor, stop_alert_monitor, sync_alerts_from_shared)
+
+# 歷史資料保留服務 (封存舊月份、刪除過期資料、incremental VACUUM)
+leader_election.register_job('retention', start_retention_scheduler, stop_retention_scheduler)
+RETENTION_LISTENERS.append(lambda result: leader_election.publish('retention', result))
+
+# 背景定期建立全台天氣快照 (/api/weather/all 與推薦系統直接讀取)
+leader_election.register_job('weather_snapshot', start_snapshot_refresher, stop_snapshot_refresher, sync_snapshot_from_shared)
+
+def warm_up_all_cities():
+    """
+    預熱全台縣市的一週預報與 AQI 快取 (leader 啟動時在背景執行緒呼叫)
+    批次請求與 AQI 索引同時進行，批次失敗或缺少的縣市再以 UPSTREAM_EXECUTOR 並行逐一查詢 (已有快取的縣市不呼叫上游)
+    """
+    start = time.time()
+    try:
+        aqi_future = UPSTREAM_EXECUTOR.submit(get_aqi_index)
+        _, bulk_error = refresh_all_week_forecasts(CITIES)
+        if bulk_error:
+            print(f"[Warmup] 批次查詢失敗，改為逐縣市查詢: {bulk_error}")
+        forecasts = list(UPSTREAM_EXECUTOR.map(get_week_forecast, CITIES))
+        aqi_future.result()
+    except Exception as e:
+        print(f"[Warmup] 預熱失敗: {e}")
+        return
+    ready = sum(1 for forecast, error in forecasts if not error)
+    print(f"[Warmup] 預熱完成：{ready}/{len(CITIES)} 個縣市，耗時 {time.time() - start:.2f} 秒")
+
+
+# 背景預熱全台一週預報與 AQI 快取 (批次 + 並行查詢，取代逐縣市呼叫)
+# 搭配 sqlite / redis 快取後端時，預熱結果由所有 worker 共用
+leader_election.register_job('warmup', lambda: threading.Thread(target=warm_up_all_cities, daemon=True).start())
+
+leader_election.start_leader_election()
 
 
 @app.route('/api/export/csv')
 def api_export_csv():
-    """匯出 CSV 格式資料"""
+    """匯出 CSV 格式資料 (串流輸出，不會一次載入全部資料)"""
     try:
         # 取得篩選參數
         start_date = request.args.get('start_date')
@@ -147,7 +320,7 @@ def api_export_csv():
         city = request.args.get('city')
         
         # 匯出資料
-        csv_data, error = export_to_csv(start_date, end_date, city)
+        csv_stream, error = stream_csv(start_date, end_date, city)
         
         if error:
             return jsonify({'success': False, 'error': error}), 400
@@ -156,18 +329,22 @@ def api_export_csv():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'weather_export_{timestamp}.csv'
         
-        # 回傳檔案
-        return send_file(
-            csv_data,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
+        # 以 chunked 回應逐批傳送
+        return _stream_download(csv_stream, 'text/csv; charset=utf-8', filename)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _stream_download(stream, mimetype, filename):
+    """將位元組串流包裝成下載用的 chunked 回應"""
+    return Response(
+        stream_with_context(stream),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
 @app.route('/api/export/excel')
 def api_export_excel():
     """匯出 Excel 格式資料"""
@@ -201,42 +378,64 @@ def api_export_excel():
 
 @app.route('/api/export/json')
 def api_export_json():
-    """匯出 JSON 格式資料"""
+    """匯出 JSON 格式資料 (串流輸出；format=ndjson 時每行一筆)"""
     try:
         # 取得篩選參數
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         city = request.args.get('city')
+        ndjson = request.args.get('format') == 'ndjson'
         
         # 匯出資料
-        json_data, error = export_to_json(start_date, end_date, city)
+        json_stream, error = stream_json(start_date, end_date, city, ndjson=ndjson)
         
         if error:
             return jsonify({'success': False, 'error': error}), 400
         
         # 產生檔名
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'weather_export_{timestamp}.json'
+        if ndjson:
+            return _stream_download(json_stream, 'application/x-ndjson', f'weather_export_{timestamp}.ndjson')
+        return _stream_download(json_stream, 'application/json', f'weather_export_{timestamp}.json')
         
-        # 回傳 JSON 資料
-        from io import BytesIO
-        json_bytes = BytesIO(json_data.encode('utf-8'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/export/parquet')
+def api_export_parquet():
+    """匯出 Parquet 格式資料 (支援 columns 欄位選擇，篩選條件直接下推到 SQL)"""
+    return _export_columnar(stream_parquet, 'application/vnd.apache.parquet', 'parquet')
+
+
+@app.route('/api/export/arrow')
+def api_export_arrow():
+    """匯出 Arrow IPC stream 格式資料 (支援 columns 欄位選擇)"""
+    return _export_columnar(stream_arrow, 'application/vnd.apache.arrow.stream', 'arrows')
+
+
+def _export_columnar(stream_func, mimetype, extension):
+    try:
+        # 取得篩選參數
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        city = request.args.get('city')
+        columns = request.args.get('columns')
         
-        return send_file(
-            json_bytes,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=filename
-        )
+        # 匯出資料
+        data_stream, error = stream_func(start_date, end_date, city, columns)
+        
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        
+        # 產生檔名
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return _stream_download(data_stream, mimetype, f'weather_export_{timestamp}.{extension}')
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 if __name__ == '__main__':
-    # 初始化資料庫
-    print("正在初始化資料庫...")
-    init_database()
-    
     # 啟動 Flask 應用程式
     app.run(debug=True, port=5000)
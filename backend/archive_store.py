@@ -0,0 +1,244 @@
+"""
+歷史資料封存模組
+將 weather_queries 中較舊的月份搬到 data/archive/ 下的每月 Parquet 檔 (zstd 壓縮)，
+並提供依時間 / 城市篩選讀取封存資料的函式，讓歷史查詢可以同時涵蓋資料庫與封存檔。
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from db_connection import DB_DIR
+
+# 封存需要 pyarrow (未安裝時不封存，也不讀取封存檔)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ARCHIVE_DIR = os.path.join(DB_DIR, 'archive')
+ARCHIVE_PREFIX = 'weather_queries_'
+ARCHIVE_COMPRESSION = 'zstd'
+
+# 數值欄位在封存檔中的型別 (其餘欄位以字串保存；query_time 保留原始字串，方便比較與排序)
+NUMERIC_TYPES = {
+    'id': 'int',
+    'temperature': 'float',
+    'min_temp': 'float',
+    'max_temp': 'float',
+    'feels_like': 'float',
+    'humidity': 'int',
+    'pop': 'int',
+    'aqi': 'int',
+    'pm25': 'float',
+}
+
+
+def available() -> bool:
+    """是否可以讀寫封存檔 (需要 pyarrow)"""
+    return pa is not None
+
+
+def month_range(month: str) -> Tuple[str, str]:
+    """
+    將 YYYY-MM 轉換為半開區間 [月初, 下個月初) 的時間字串
+    """
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start.strftime('%Y-%m-%d 00:00:00'), end.strftime('%Y-%m-%d 00:00:00')
+
+
+def archive_path(month: str) -> str:
+    """取得指定月份 (YYYY-MM) 的封存檔路徑"""
+    return os.path.join(ARCHIVE_DIR, f"{ARCHIVE_PREFIX}{month}.parquet")
+
+
+def list_archives() -> List[str]:
+    """
+    列出已封存的月份 (由新到舊)
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = []
+    for name in os.listdir(ARCHIVE_DIR):
+        if name.startswith(ARCHIVE_PREFIX) and name.endswith('.parquet'):
+            months.append(name[len(ARCHIVE_PREFIX):-len('.parquet')])
+    return sorted(months, reverse=True)
+
+
+def archived_months(start_time: Optional[str] = None, end_time: Optional[str] = None) -> List[str]:
+    """
+    列出與 [start_time, end_time) 有交集的封存月份 (由新到舊)；未安裝 pyarrow 時為空
+    """
+    if pa is None:
+        return []
+    months = []
+    for month in list_archives():
+        month_start, month_end = month_range(month)
+        if (start_time and month_end <= start_time) or (end_time and month_start >= end_time):
+            continue
+        months.append(month)
+    return months
+
+
+def _to_number(value, cast):
+    # SQLite 欄位為動態型別，可能存有 '-' 等非數值字串 (封存時視為缺值)
+    if value is None or value == '':
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rows_to_table(rows: List[Tuple], columns: List[str]):
+    """
+    將 SQL 查詢結果轉為 Arrow Table
+    """
+    arrays = []
+    for index, col in enumerate(columns):
+        values = [row[index] for row in rows]
+        kind = NUMERIC_TYPES.get(col)
+        if kind == 'int':
+            arrays.append(pa.array([_to_number(v, lambda x: int(float(x))) for v in values], type=pa.int64()))
+        elif kind == 'float':
+            arrays.append(pa.array([_to_number(v, float) for v in values], type=pa.float64()))
+        else:
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+def write_month(conn: sqlite3.Connection, month: str) -> int:
+    """
+    將資料庫中指定月份的記錄寫入封存檔 (已有封存檔時合併)，不刪除資料庫中的記錄
+
+    檔案先寫入暫存檔再以 os.replace 取代，寫入中途失敗不會留下不完整的封存檔。
+
+    Returns:
+        int: 封存檔中的總筆數
+    """
+    start_time, end_time = month_range(month)
+    cursor = conn.execute(
+        "SELECT * FROM weather_queries WHERE query_time >= ? AND query_time < ? ORDER BY query_time",
+        (start_time, end_time)
+    )
+    columns = [desc[0] for desc in cursor.description]
+    table = _rows_to_table(cursor.fetchall(), columns)
+
+    path = archive_path(month)
+    if os.path.exists(path):
+        existing = pq.read_table(path)
+        # 以資料庫的欄位為準 (舊封存檔缺少的欄位補空值)
+        for col in columns:
+            if col not in existing.column_names:
+                existing = existing.append_column(col, pa.nulls(existing.num_rows, table.schema.field(col).type))
+        existing = existing.select(columns).cast(table.schema)
+        # 上次封存後尚未從資料庫刪除的記錄會再次讀到，以 id 去除重複
+        existing = existing.filter(pc.invert(pc.is_in(existing['id'], value_set=table['id'])))
+        table = pa.concat_tables([existing, table]).sort_by([('query_time', 'ascending')])
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, compression=ARCHIVE_COMPRESSION)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def remove_month(month: str) -> None:
+    """刪除指定月份的封存檔"""
+    path = archive_path(month)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def clear_archives() -> int:
+    """
+    刪除所有封存檔 (清除所有歷史記錄時使用)
+
+    Returns:
+        int: 刪除的檔案數
+    """
+    months = list_archives()
+    for month in months:
+        remove_month(month)
+    return len(months)
+
+
+def read_month(
+    month: str,
+    columns: List[str],
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    city: Optional[str] = None
+) -> List[Tuple]:
+    """
+    讀取單一封存月份中符合條件的記錄 (依 query_time 由新到舊)
+
+    Returns:
+        List[Tuple]: 欄位順序與 columns 相同；封存檔沒有的欄位為 None
+    """
+    path = archive_path(month)
+    schema_names = pq.read_schema(path).names
+    # 篩選用的欄位 (query_time、指定城市時的 city) 即使不在 columns 中也要讀取，篩選後再只取 columns
+    needed = set(columns) | {'query_time'} | ({'city'} if city else set())
+    table = pq.read_table(path, columns=[col for col in needed if col in schema_names])
+    if city and 'city' not in table.column_names:
+        return []
+
+    mask = None
+    for condition in (
+        pc.greater_equal(table['query_time'], start_time) if start_time else None,
+        pc.less(table['query_time'], end_time) if end_time else None,
+        pc.equal(table['city'], city) if city else None,
+    ):
+        if condition is not None:
+            mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        table = table.filter(mask)
+    table = table.sort_by([('query_time', 'descending')])
+
+    values = [
+        table[col].to_pylist() if col in table.column_names else [None] * table.num_rows
+        for col in columns
+    ]
+    return list(zip(*values))
+
+
+def iter_archive_rows(
+    columns: List[str],
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    city: Optional[str] = None
+) -> Iterator[Tuple]:
+    """
+    依 query_time 由新到舊逐筆讀取所有符合條件的封存記錄 (一次只載入一個月份)
+    """
+    for month in archived_months(start_time, end_time):
+        yield from read_month(month, columns, start_time, end_time, city)
+
+
+def summary() -> Dict[str, Any]:
+    """
+    封存資料的統計 (筆數、最早 / 最晚時間、城市列表)；只讀取封存檔的 metadata 與必要欄位
+    """
+    result = {'months': [], 'records': 0, 'earliest': None, 'latest': None, 'cities': set()}
+    for month in archived_months():
+        path = archive_path(month)
+        table = pq.read_table(path, columns=['query_time', 'city'])
+        if table.num_rows == 0:
+            continue
+        result['months'].append(month)
+        result['records'] += table.num_rows
+        bounds = pc.min_max(table['query_time']).as_py()
+        if result['latest'] is None or bounds['max'] > result['latest']:
+            result['latest'] = bounds['max']
+        if result['earliest'] is None or bounds['min'] < result['earliest']:
+            result['earliest'] = bounds['min']
+        result['cities'].update(pc.unique(table['city']).to_pylist())
+    return result
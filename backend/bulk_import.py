@@ -0,0 +1,392 @@
+"""
+歷史資料批次匯入模組
+將 CSV / NDJSON / Parquet 檔案串流寫入 weather_queries (新部署預先載入資料、資料庫損毀後重建)：
+- 匯入期間先移除 weather_queries 的索引，完成後再重建 (逐筆維護索引比一次建立慢很多)
+- 每 batch_size 筆為一個交易，同一交易內更新每日統計彙總與匯入進度
+- 檔案解析與彙總在背景執行緒進行，與資料庫寫入同時執行
+- 中途中斷後以相同檔案重新執行，會從資料庫中記錄的進度繼續 (不會重複匯入)
+
+一般硬碟上約每秒 6 萬筆 (CSV，含每日統計彙總；瓶頸為 SQLite 單一寫入者的 INSERT)。
+
+匯出的檔案可以直接匯入：欄位名稱可以是資料庫欄位 (query_time, city, ...) 或 CSV 匯出的中文標題。
+匯入期間查詢會因為沒有索引而變慢，建議在服務離峰時執行。
+"""
+
+import contextlib
+import csv
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import rollups
+from data_exporter import EXPORT_COLUMNS
+from data_logger import HISTORY_COLUMNS, bump_data_version
+from db_connection import get_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# 匯入的欄位 (id 由資料庫重新編號)
+IMPORT_COLUMNS = [col for col in HISTORY_COLUMNS if col != 'id']
+REQUIRED_COLUMNS = ('query_time', 'city')
+NUMERIC_COLUMNS = {'temperature', 'min_temp', 'max_temp', 'feels_like', 'humidity', 'pop', 'aqi', 'pm25'}
+
+DEFAULT_BATCH_SIZE = 50000
+PROGRESS_INTERVAL = 2.0  # 秒
+
+# 中文標題 → 資料庫欄位
+_TITLE_TO_COLUMN = {title: col for col, title in EXPORT_COLUMNS}
+
+# 匯入進度 (與資料寫入在同一個交易中更新，中斷後不會遺漏或重複)
+CREATE_CHECKPOINT_SQL = '''
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        rows_done INTEGER NOT NULL DEFAULT 0,
+        index_sql TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def detect_format(path: str) -> Optional[str]:
+    """依副檔名判斷檔案格式"""
+    ext = os.path.splitext(path)[1].lower()
+    return {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet'}.get(ext)
+
+
+def _map_columns(names: List[str]) -> Dict[str, int]:
+    """
+    將檔案欄位名稱對應到資料庫欄位
+
+    Returns:
+        Dict: {資料庫欄位: 檔案中的欄位位置}
+
+    Raises:
+        ValueError: 缺少必要欄位
+    """
+    mapping = {}
+    for index, name in enumerate(names):
+        name = (name or '').strip()
+        col = _TITLE_TO_COLUMN.get(name, name)
+        if col in IMPORT_COLUMNS and col not in mapping:
+            mapping[col] = index
+    missing = [col for col in REQUIRED_COLUMNS if col not in mapping]
+    if missing:
+        raise ValueError(f"檔案缺少必要欄位: {', '.join(missing)}")
+    return mapping
+
+
+def _build_insert_sql(mapping: Dict[str, int]) -> str:
+    """
+    建立 INSERT 語句：以編號參數 (?N) 直接對應檔案中的欄位位置，每列不需要在 Python 端重新排列
+    數值欄位的空字串轉為 NULL (文字欄位保留空字串，與查詢記錄寫入的預設值相同)
+    """
+    columns = [col for col in IMPORT_COLUMNS if col in mapping]
+    values = [
+        f"NULLIF(?{mapping[col] + 1}, '')" if col in NUMERIC_COLUMNS else f"?{mapping[col] + 1}"
+        for col in columns
+    ]
+    return f"INSERT INTO weather_queries ({', '.join(columns)}) VALUES ({', '.join(values)})"
+
+
+def _batched(rows: Iterator, batch_size: int) -> Iterator[List]:
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def _open_csv(path: str, batch_size: int) -> Tuple[Dict[str, int], Iterator[List]]:
+    f = open(path, newline='', encoding='utf-8-sig')
+    reader = csv.reader(f)
+    header = next(reader, [])
+    try:
+        mapping = _map_columns(header)
+    except ValueError:
+        f.close()
+        raise
+    # 編號參數的數量等於用到的最大編號，多出的欄位要先切掉
+    width = max(mapping.values()) + 1
+
+    def batches():
+        try:
+            for batch in _batched(reader, batch_size):
+                # 欄位數不是 width 的列 (多出的欄位、空行) 切齊為 width 欄
+                yield [row if len(row) == width else (row + [''] * width)[:width] for row in batch]
+        finally:
+            f.close()
+
+    return mapping, batches()
+
+
+def _open_ndjson(path: str, batch_size: int) -> Tuple[Dict[str, int], Iterator[List]]:
+    f = open(path, encoding='utf-8-sig')
+    records = (json.loads(line) for line in f if line.strip())
+    first = next(records, None)
+    if first is None:
+        f.close()
+        raise ValueError("檔案沒有資料")
+    # 以第一筆的鍵決定欄位對應
+    keys = list(first.keys())
+    try:
+        mapping = _map_columns(keys)
+    except ValueError:
+        f.close()
+        raise
+    used = keys[:max(mapping.values()) + 1]
+
+    def batches():
+        try:
+            for batch in _batched(itertools.chain([first], records), batch_size):
+                yield [[record.get(key) for key in used] for record in batch]
+        finally:
+            f.close()
+
+    return mapping, batches()
+
+
+def _open_parquet(path: str, batch_size: int) -> Tuple[Dict[str, int], Iterator[List]]:
+    if pa is None:
+        raise ValueError("匯入 Parquet 需要安裝 pyarrow 套件")
+    parquet = pq.ParquetFile(path)
+    names = parquet.schema_arrow.names
+    file_mapping = _map_columns(names)
+    selected = sorted(file_mapping, key=file_mapping.get)
+    # 只讀取需要的欄位，位置改為讀出後的順序
+    mapping = {col: index for index, col in enumerate(selected)}
+
+    def batches():
+        for record_batch in parquet.iter_batches(batch_size=batch_size, columns=[names[file_mapping[col]] for col in selected]):
+            columns = []
+            for array in record_batch.columns:
+                if pa.types.is_timestamp(array.type):
+                    # 與資料庫相同的時間字串格式 (毫秒等單位的 %S 會帶小數，截到秒)
+                    array = pc.utf8_slice_codeunits(pc.strftime(array, format='%Y-%m-%d %H:%M:%S'), 0, 19)
+                columns.append(array.to_pylist())
+            yield list(zip(*columns))
+
+    return mapping, batches()
+
+
+_READERS = {'csv': _open_csv, 'ndjson': _open_ndjson, 'parquet': _open_parquet}
+
+
+def _fingerprint(path: str) -> str:
+    """檔案大小與修改時間 (續傳時確認是同一個檔案)"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _drop_indexes(conn: sqlite3.Connection) -> List[str]:
+    """
+    移除 weather_queries 的索引
+
+    Returns:
+        List[str]: 重建索引用的 CREATE INDEX 語句
+    """
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'weather_queries' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+    return [sql for _, sql in rows]
+
+
+def _restore_indexes(conn: sqlite3.Connection, index_sql: List[str]) -> None:
+    """以 _drop_indexes 回傳的語句重建索引 (已存在的索引略過)"""
+    for sql in index_sql:
+        conn.execute(sql.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+
+
+def _skip_rows(batches: Iterator[List[Tuple]], count: int) -> Iterator[List[Tuple]]:
+    """跳過前 count 筆 (已在上次匯入中寫入)"""
+    for batch in batches:
+        if count >= len(batch):
+            count -= len(batch)
+            continue
+        yield batch[count:] if count else batch
+        count = 0
+
+
+def _prepare_batches(batches: Iterator[List], mapping: Dict[str, int], update_rollups: bool) -> Iterator[Tuple]:
+    """
+    過濾沒有城市或時間的列，並先算好這一批的每日統計彙總
+
+    Yields:
+        Tuple: (要寫入的列, 原始筆數, 彙總結果或 None)
+    """
+    time_index, city_index = mapping['query_time'], mapping['city']
+    value_indexes = [mapping.get(col) for col in ('temperature', 'min_temp', 'max_temp', 'aqi')]
+    for batch in batches:
+        rows = [row for row in batch if row[city_index] and row[time_index]]
+        groups = None
+        if update_rollups:
+            groups = rollups.aggregate_rows(
+                (row[time_index], row[city_index]) + tuple(None if i is None else row[i] for i in value_indexes)
+                for row in rows
+            )
+        yield rows, len(batch), groups
+
+
+def _prefetch(items: Iterator, depth: int = 2) -> Iterator:
+    """
+    在背景執行緒預先產生下一批資料 (檔案解析與資料庫寫入同時進行)
+    呼叫端中途停止 (例如寫入失敗) 時關閉產生器，背景執行緒隨即結束並關閉來源檔案
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        # 以 timeout 等待佇列空位，呼叫端已停止時放棄，不會永遠卡在 put
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=worker, name='bulk-import-reader', daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def bulk_import(
+    path: str,
+    file_format: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    將檔案批次匯入 weather_queries (中斷後重新執行會自動續傳)
+
+    Args:
+        path: 檔案路徑
+        file_format: csv / ndjson / parquet，預設依副檔名判斷
+        batch_size: 每個交易寫入的筆數
+
+    Returns:
+        Tuple[Dict, str]: (匯入結果統計, 錯誤訊息)
+    """
+    file_format = file_format or detect_format(path)
+    if file_format not in _READERS:
+        return None, f"不支援的檔案格式: {path} (支援 csv / ndjson / parquet)"
+    if not os.path.exists(path):
+        return None, f"找不到檔案: {path}"
+
+    source = os.path.abspath(path)
+    fingerprint = _fingerprint(path)
+    conn = get_connection()
+
+    try:
+        mapping, batches = _READERS[file_format](path, batch_size)
+        insert_sql = _build_insert_sql(mapping)
+
+        conn.execute(CREATE_CHECKPOINT_SQL)
+        # DROP INDEX 與記錄重建語句的進度必須在同一個交易 (DDL 不會自動開始交易，需明確 BEGIN)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            checkpoint = conn.execute(
+                "SELECT fingerprint, rows_done, index_sql FROM import_checkpoints WHERE source = ?",
+                (source,)
+            ).fetchone()
+            if checkpoint:
+                if checkpoint[0] != fingerprint:
+                    # 無法續傳：還原上次移除的索引並清除進度，避免資料庫一直停留在沒有索引的狀態
+                    _restore_indexes(conn, json.loads(checkpoint[2]))
+                    conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,))
+                    return None, (f"檔案在上次匯入後已變更，無法續傳: {path} "
+                                  f"(已重建索引並清除匯入進度；上次匯入的 {checkpoint[1]:,} 筆仍在資料庫中，"
+                                  f"重新執行會從頭匯入)")
+                rows_done, index_sql = checkpoint[1], json.loads(checkpoint[2])
+                # 上次中斷時索引已被移除；若其他程式重建了索引，再移除一次
+                _drop_indexes(conn)
+                print(f"[Import] 從第 {rows_done:,} 筆繼續匯入 {path}")
+            else:
+                rows_done = 0
+                index_sql = _drop_indexes(conn)
+                conn.execute(
+                    "INSERT INTO import_checkpoints (source, fingerprint, rows_done, index_sql) VALUES (?, ?, 0, ?)",
+                    (source, fingerprint, json.dumps(index_sql))
+                )
+                print(f"[Import] 開始匯入 {path} (已暫時移除 {len(index_sql)} 個索引)")
+
+        update_rollups = rollups.rollup_ready(conn)
+        start = last_report = time.time()
+        imported = skipped = 0
+        prepared = _prefetch(_prepare_batches(_skip_rows(batches, rows_done), mapping, update_rollups))
+        with contextlib.closing(prepared):
+            for rows, batch_count, groups in prepared:
+                with conn:
+                    conn.executemany(insert_sql, rows)
+                    if groups:
+                        rollups.merge_groups(conn, groups)
+                    rows_done += batch_count
+                    conn.execute(
+                        "UPDATE import_checkpoints SET rows_done = ?, updated_at = CURRENT_TIMESTAMP WHERE source = ?",
+                        (rows_done, source)
+                    )
+                    bump_data_version(conn)
+                imported += len(rows)
+                skipped += batch_count - len(rows)
+
+                now = time.time()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    print(f"[Import] 已匯入 {imported:,} 筆 ({imported / (now - start):,.0f} 筆/秒)")
+        load_time = time.time() - start
+
+        # 重建索引並移除匯入進度 (同一交易；中斷時下次執行會重做這一步)
+        print(f"[Import] 資料寫入完成，重建 {len(index_sql)} 個索引...")
+        index_start = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _restore_indexes(conn, index_sql)
+            conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,))
+        conn.execute("ANALYZE weather_queries")
+        index_time = time.time() - index_start
+    except (sqlite3.Error, ValueError, OSError) as e:
+        return None, f"匯入失敗 (重新執行相同指令可從中斷處繼續): {e}"
+
+    total_time = load_time + index_time
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'rows_done': rows_done,
+        'load_seconds': round(load_time, 2),
+        'index_seconds': round(index_time, 2),
+        'rows_per_second': round(imported / total_time) if total_time else imported
+    }, None
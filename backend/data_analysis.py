@@ -1,122 +1,179 @@
 """
 天氣資料分析模組
-使用 Pandas 進行歷史天氣資料的統計與分析
+以 SQL 彙總每日統計彙總表計算歷史天氣資料的統計數據 (最新一筆與最近趨勢只讀取需要的欄位與時間範圍)，
+不必把整個 weather_queries 載入記憶體；資料庫與封存檔中的記錄都會計入
 """
 
 import sqlite3
-import pandas as pd
 import json
-from data_logger import DB_PATH
+from datetime import datetime, timedelta
+from typing import Optional
+from db_connection import get_connection
+from data_logger import apply_migrations, cached_result
+import archive_store
+import rollups
+
+NO_DATA_ERROR = "目前沒有足夠的歷史資料可供分析"
+
+# 最近趨勢涵蓋的天數
+TREND_DAYS = 7
+
+
+def _numeric(column: str) -> str:
+    """
+    只保留數值的 SQL 運算式 (與 pd.to_numeric(errors='coerce') 相同，'-' 等文字視為缺值)
+    """
+    return f"(CASE WHEN typeof({column}) IN ('integer', 'real') THEN {column} END)"
+
+
+def _average(total, count):
+    """總和 / 筆數，四捨五入到小數一位 (沒有資料時為 None)"""
+    return round(total / count, 1) if count else None
+
+
+def _latest_record(cursor: sqlite3.Cursor, city: Optional[str] = None):
+    """
+    取得最新一筆記錄的 (城市, 溫度, 查詢時間) (走 query_time 索引，只讀一列)
+    資料庫中沒有記錄時 (已全部封存) 改從最新的封存月份取得
+    """
+    cursor.execute(f"""
+        SELECT city, {_numeric('temperature')}, query_time FROM weather_queries
+        {"WHERE city = ?" if city else ""}
+        ORDER BY query_time DESC LIMIT 1
+    """, (city,) if city else ())
+    row = cursor.fetchone()
+    if row is None:
+        row = next(archive_store.iter_archive_rows(['city', 'temperature', 'query_time'], city=city), None)
+    return row or (None, None, None)
+
+
+def _extreme(row):
+    """將 (城市, 溫度, 時間) 轉換為回傳格式"""
+    if row is None:
+        return {"city": None, "temp": None, "date": None}
+    return {"city": row[0], "temp": float(row[1]), "date": str(row[2]).split('.')[0]}
+
+
+def _recent_trend(cursor: sqlite3.Cursor, latest_time, city: Optional[str] = None):
+    """
+    最近 7 天的每日平均溫度 (從最新一筆往回 7 天)
+    只讀取該時間範圍內的 query_time / temperature，半開區間可使用 query_time 索引
+    """
+    daily_trend = {"dates": [], "temps": []}
+    if not latest_time:
+        return daily_trend
+
+    latest_time = datetime.strptime(str(latest_time)[:19], '%Y-%m-%d %H:%M:%S')
+    since = (latest_time - timedelta(days=TREND_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute(f"""
+        SELECT substr(query_time, 1, 10) AS day, SUM({_numeric('temperature')}), COUNT({_numeric('temperature')})
+        FROM weather_queries
+        WHERE query_time >= ? {"AND city = ?" if city else ""}
+        GROUP BY day
+    """, (since, city) if city else (since,))
+    days = {day: [total or 0.0, count] for day, total, count in cursor.fetchall()}
+
+    # 趨勢範圍與封存月份重疊時 (例如資料庫已全部封存)，一併計入封存檔中的記錄
+    for query_time, temperature in archive_store.iter_archive_rows(['query_time', 'temperature'], since, None, city):
+        day = days.setdefault(str(query_time)[:10], [0.0, 0])
+        if temperature is not None:
+            day[0] += temperature
+            day[1] += 1
+
+    for day in sorted(days):
+        total, count = days[day]
+        daily_trend["dates"].append(day)
+        daily_trend["temps"].append(round(total / count, 1) if count else None)
+    return daily_trend
+
+
+def _build_statistics(total_records, avg_temp, avg_aqi, latest, hottest, coldest, city_counts, daily_trend):
+    """
+    組合 /api/stats/analysis 的回傳格式
+    """
+    latest_city, latest_temp, _ = latest
+    return {
+        "success": True,
+        "summary": {
+            "total_records": total_records,
+            "avg_temp": avg_temp,
+            "latest_temp": None if latest_temp is None else float(latest_temp),
+            "latest_city": latest_city,
+            "avg_aqi": avg_aqi
+        },
+        "extremes": {
+            "hottest": _extreme(hottest),
+            "coldest": _extreme(coldest)
+        },
+        "popular_cities": city_counts,
+        "trend": daily_trend
+    }
+
+
+def _rollup_statistics(conn: sqlite3.Connection, city: Optional[str] = None):
+    """
+    從每日統計彙總表計算統計數據 (不需讀取整個 weather_queries)
+    """
+    where, params = ("WHERE city = ?", (city,)) if city else ("", ())
+    cursor = conn.cursor()
+
+    cursor.execute(f"""
+        SELECT SUM(record_count), SUM(temp_count), SUM(temp_sum), SUM(aqi_count), SUM(aqi_sum)
+        FROM weather_daily_rollup {where}
+    """, params)
+    total_records, temp_count, temp_sum, aqi_count, aqi_sum = cursor.fetchone()
+    if not total_records:
+        return {
+            "success": False,
+            "error": NO_DATA_ERROR
+        }
+
+    # 最熱 / 最冷：同值時取最早的紀錄 (與 idxmax / idxmin 相同)
+    extreme_sql = f"""
+        SELECT city, {{col}}, {{col}}_time FROM weather_daily_rollup
+        WHERE {{col}} IS NOT NULL {"AND city = ?" if city else ""}
+        ORDER BY {{col}} {{order}}, {{col}}_time LIMIT 1
+    """
+    hottest = cursor.execute(extreme_sql.format(col='max_temp', order='DESC'), params).fetchone()
+    coldest = cursor.execute(extreme_sql.format(col='min_temp', order='ASC'), params).fetchone()
+
+    # 城市查詢熱度排行 (Top 3)
+    cursor.execute(f"""
+        SELECT city, SUM(record_count) AS total FROM weather_daily_rollup {where}
+        GROUP BY city ORDER BY total DESC LIMIT 3
+    """, params)
+    city_counts = {row[0]: row[1] for row in cursor.fetchall()}
+
+    latest = _latest_record(cursor, city)
+
+    return _build_statistics(
+        total_records, _average(temp_sum, temp_count), _average(aqi_sum, aqi_count),
+        latest, hottest, coldest, city_counts, _recent_trend(cursor, latest[2], city)
+    )
+
+
+def _compute_statistics(city: Optional[str] = None):
+    """
+    從每日統計彙總表計算 (寫入時增量更新，已封存月份的統計仍保留在彙總表中)
+    """
+    # 取得共用的資料庫連線
+    conn = get_connection()
+    if not rollups.rollup_ready(conn):
+        # 舊版資料庫尚未套用 migration：先建立並回填彙總表
+        apply_migrations()
+    return _rollup_statistics(conn, city)
+
 
 def get_weather_statistics(city: Optional[str] = None):
     """
-    從資料庫讀取歷史資料並計算統計數據
+    計算歷史天氣統計數據 (以資料版本快取，有新記錄寫入前重複呼叫不會重新查詢)
     
     Args:
         city: 選填，指定城市名稱。如果提供則只分析該城市資料
     """
     try:
-        # 連線至資料庫
-        conn = sqlite3.connect(DB_PATH)
-        
-        # 使用 Pandas 讀取資料（可選城市篩選）
-        if city:
-            df = pd.read_sql_query(
-                "SELECT * FROM weather_queries WHERE city = ?", 
-                conn, 
-                params=(city,)
-            )
-        else:
-            df = pd.read_sql_query("SELECT * FROM weather_queries", conn)
-        
-        conn.close()
-        
-        if df.empty:
-            return {
-                "success": False,
-                "error": "目前沒有足夠的歷史資料可供分析"
-            }
-            
-        # --- 數據處理 ---
-        
-        # 1. 確保數值型別正確
-        numeric_cols = ['temperature', 'min_temp', 'max_temp', 'humidity', 'aqi']
-        for col in numeric_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-        # 2. 計算總歷史平均溫度
-        avg_temp = round(df['temperature'].mean(), 1)
-        
-        # 3. 找出最熱與最冷的紀錄
-        max_temp_record = df.loc[df['max_temp'].idxmax()]
-        min_temp_record = df.loc[df['min_temp'].idxmin()]
-        
-        # 4. 城市查詢熱度排行 (Top 3)
-        city_counts = df['city'].value_counts().head(3).to_dict()
-        
-        # 5. 平均 AQI (空氣品質)
-        avg_aqi = round(df['aqi'].mean(), 1)
-
-        # 6. 最新氣溫 (Current/Latest Temp)
-        # 根據查詢時間排序，抓取最新的一筆
-        latest_record = df.sort_values('query_time', ascending=False).iloc[0]
-        latest_temp = latest_record['temperature']
-        latest_temp = None if pd.isna(latest_temp) else float(latest_temp)
-        latest_city = latest_record['city']
-        
-        # 7. 最近 7 天的平均溫度變化 (每日平均)
-        # 轉換時間欄位
-        df['query_time'] = pd.to_datetime(df['query_time'])
-        # 篩選最近 7 天
-        latest_date = df['query_time'].max()
-        seven_days_ago = latest_date - pd.Timedelta(days=7)
-        recent_df = df[df['query_time'] >= seven_days_ago]
-        
-        # 每日平均溫
-        daily_temp = recent_df.groupby(recent_df['query_time'].dt.date)['temperature'].mean().round(1)
-        # 轉成列表格式回傳給前端畫圖，並處理 NaN 值
-        temps_list = daily_temp.values.tolist()
-        # 將 NaN 轉換為 None (在 JSON 中會變成 null)
-        temps_list = [None if pd.isna(temp) else temp for temp in temps_list]
-        daily_trend = {
-            "dates": [str(d) for d in daily_temp.index],
-            "temps": temps_list
-        }
-
-        # --- 整理回傳結果 ---
-        # 處理極端溫度值，確保不是 NaN
-        max_temp_value = max_temp_record['max_temp']
-        max_temp_value = None if pd.isna(max_temp_value) else float(max_temp_value)
-        
-        min_temp_value = min_temp_record['min_temp']
-        min_temp_value = None if pd.isna(min_temp_value) else float(min_temp_value)
-        
-        stats = {
-            "success": True,
-            "summary": {
-                "total_records": len(df),
-                "avg_temp": float(avg_temp) if not pd.isna(avg_temp) else None,
-                "latest_temp": latest_temp,
-                "latest_city": latest_city,
-                "avg_aqi": float(avg_aqi) if not pd.isna(avg_aqi) else None
-            },
-            "extremes": {
-                "hottest": {
-                    "city": max_temp_record['city'],
-                    "temp": max_temp_value,
-                    "date": str(max_temp_record['query_time']).split('.')[0]
-                },
-                "coldest": {
-                    "city": min_temp_record['city'],
-                    "temp": min_temp_value,
-                    "date": str(min_temp_record['query_time']).split('.')[0]
-                }
-            },
-            "popular_cities": city_counts,
-            "trend": daily_trend
-        }
-        
-        return stats
+        # 資料沒有變動時直接回傳上次的結果
+        return cached_result(('analysis', city), lambda: _compute_statistics(city))
 
     except Exception as e:
         return {
@@ -3,20 +3,72 @@
 負責從資料庫查詢資料並轉換為 CSV、Excel、JSON 格式
 """
 
+import csv
+import json
 import sqlite3
 import pandas as pd
-from io import BytesIO
-from typing import Optional, Tuple
-from data_logger import DB_PATH, get_query_history
+from io import BytesIO, StringIO
+from typing import Optional, Tuple, Iterator
+from data_logger import DB_PATH, HISTORY_COLUMNS, get_query_history, iter_query_history, iter_history_rows
 
+# Parquet / Arrow 匯出需要 pyarrow (未安裝時其他匯出格式仍可使用)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
-def export_to_csv(
+# 匯出欄位 (資料庫欄位 → 中文標題)，ID 不匯出
+EXPORT_COLUMNS = [
+    ('query_time', '查詢時間'),
+    ('city', '城市'),
+    ('temperature', '溫度(°C)'),
+    ('min_temp', '最低溫(°C)'),
+    ('max_temp', '最高溫(°C)'),
+    ('feels_like', '體感溫度(°C)'),
+    ('humidity', '濕度(%)'),
+    ('weather_description', '天氣狀況'),
+    ('pop', '降雨機率(%)'),
+    ('aqi', 'AQI'),
+    ('pm25', 'PM2.5'),
+    ('aqi_status', '空氣品質'),
+    ('forecast_period', '預報時段'),
+    ('note', '備註'),
+]
+
+# 串流匯出時每批讀取的筆數
+STREAM_CHUNK_SIZE = 1000
+
+
+def _open_history_stream(
+    start_date: Optional[str],
+    end_date: Optional[str],
+    city: Optional[str]
+) -> Tuple[Optional[Iterator], Optional[list], Optional[str]]:
+    """
+    開啟歷史資料的逐批讀取，並先讀出第一批以判斷是否有資料
+    
+    Returns:
+        Tuple: (剩餘批次的 iterator, 第一批資料, 錯誤訊息)
+    """
+    try:
+        chunks = iter_query_history(start_date, end_date, city, chunk_size=STREAM_CHUNK_SIZE)
+        first_chunk = next(chunks, None)
+    except (sqlite3.Error, ValueError) as e:
+        return None, None, f"查詢歷史記錄失敗: {e}"
+    if not first_chunk:
+        return None, None, "沒有可匯出的資料"
+    return chunks, first_chunk, None
+
+
+def stream_csv(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     city: Optional[str] = None
-) -> Tuple[Optional[BytesIO], Optional[str]]:
+) -> Tuple[Optional[Iterator[bytes]], Optional[str]]:
     """
-    匯出資料為 CSV 格式
+    以串流方式匯出 CSV (每次只處理 STREAM_CHUNK_SIZE 筆，記憶體用量固定)
     
     Args:
         start_date: 開始日期 (格式: YYYY-MM-DD)
@@ -24,94 +76,288 @@ def export_to_csv(
         city: 城市名稱（選填）
         
     Returns:
-        Tuple[BytesIO, str]: (CSV 資料流, 錯誤訊息)
+        Tuple[Iterator[bytes], str]: (CSV 位元組串流, 錯誤訊息)
     """
-    try:
-        # 取得歷史記錄
-        records = get_query_history(start_date, end_date, city)
-        
-        if not records:
-            return None, "沒有可匯出的資料"
-        
-        # 轉換為 DataFrame
-        df = pd.DataFrame(records)
-        
-        # 重新命名欄位為中文
-        df.columns = [
-            'ID', '查詢時間', '城市', '溫度(°C)', '最低溫(°C)', '最高溫(°C)',
-            '體感溫度(°C)', '濕度(%)', '天氣狀況', '降雨機率(%)',
-            'AQI', 'PM2.5', '空氣品質', '預報時段'
-        ]
-        
-        # 移除 ID 欄位
-        df = df.drop('ID', axis=1)
-        
-        # 匯出為 CSV
-        output = BytesIO()
-        df.to_csv(output, index=False, encoding='utf-8-sig')  # utf-8-sig 支援中文
-        output.seek(0)
-        
-        return output, None
-        
-    except Exception as e:
-        return None, f"CSV 匯出失敗: {str(e)}"
+    chunks, first_chunk, error = _open_history_stream(start_date, end_date, city)
+    if error:
+        return None, error
 
+    def generate():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        # utf-8-sig 的 BOM，讓 Excel 正確辨識中文
+        yield '\ufeff'.encode('utf-8')
+        writer.writerow([title for _, title in EXPORT_COLUMNS])
+        for chunk in _chain_chunks(first_chunk, chunks):
+            for record in chunk:
+                writer.writerow([_csv_value(record.get(key)) for key, _ in EXPORT_COLUMNS])
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
 
-def export_to_excel(
+    return generate(), None
+
+
+def stream_json(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    city: Optional[str] = None
-) -> Tuple[Optional[BytesIO], Optional[str]]:
+    city: Optional[str] = None,
+    ndjson: bool = False
+) -> Tuple[Optional[Iterator[bytes]], Optional[str]]:
     """
-    匯出資料為 Excel 格式
+    以串流方式匯出 JSON 陣列 (或每行一筆的 NDJSON)
     
     Args:
         start_date: 開始日期 (格式: YYYY-MM-DD)
         end_date: 結束日期 (格式: YYYY-MM-DD)
         city: 城市名稱（選填）
+        ndjson: 是否輸出 NDJSON 格式
         
     Returns:
-        Tuple[BytesIO, str]: (Excel 資料流, 錯誤訊息)
+        Tuple[Iterator[bytes], str]: (JSON 位元組串流, 錯誤訊息)
     """
+    chunks, first_chunk, error = _open_history_stream(start_date, end_date, city)
+    if error:
+        return None, error
+
+    def generate():
+        if not ndjson:
+            yield b'['
+        first = True
+        for chunk in _chain_chunks(first_chunk, chunks):
+            parts = []
+            for record in chunk:
+                record = {key: value for key, value in record.items() if key != 'id'}
+                line = json.dumps(record, ensure_ascii=False)
+                if ndjson:
+                    parts.append(line + '\n')
+                else:
+                    parts.append(('\n  ' if first else ',\n  ') + line)
+                first = False
+            yield ''.join(parts).encode('utf-8')
+        if not ndjson:
+            yield b'\n]\n'
+
+    return generate(), None
+
+
+# --- Parquet / Arrow IPC 匯出 ---
+
+# 每個 row group (Arrow 為 record batch) 的筆數
+ROW_GROUP_SIZE = 50000
+
+# 欄位型別: int / float / str / time (query_time 轉為 timestamp)
+COLUMN_TYPES = {
+    'id': 'int',
+    'query_time': 'time',
+    'city': 'str',
+    'temperature': 'float',
+    'min_temp': 'float',
+    'max_temp': 'float',
+    'feels_like': 'float',
+    'humidity': 'int',
+    'weather_description': 'str',
+    'pop': 'int',
+    'aqi': 'int',
+    'pm25': 'float',
+    'aqi_status': 'str',
+    'forecast_period': 'str',
+    'note': 'str',
+}
+
+
+class _ChunkSink:
+    """
+    只能寫入的檔案物件：寫入的位元組先暫存，由串流產生器逐批取出
+    (自行記錄已寫入的總長度，讓 Parquet footer 的位移正確)
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'str': pa.string(),
+        'time': pa.timestamp('s'),
+    }
+    return pa.schema([(col, types[COLUMN_TYPES[col]]) for col in columns])
+
+
+def _to_number(value, cast):
+    # SQLite 欄位為動態型別，可能存有 '-' 等非數值字串
+    if value is None or value == '':
+        return None
     try:
-        # 取得歷史記錄
-        records = get_query_history(start_date, end_date, city)
-        
-        if not records:
-            return None, "沒有可匯出的資料"
-        
-        # 轉換為 DataFrame
-        df = pd.DataFrame(records)
-        
-        # 重新命名欄位為中文
-        df.columns = [
-            'ID', '查詢時間', '城市', '溫度(°C)', '最低溫(°C)', '最高溫(°C)',
-            '體感溫度(°C)', '濕度(%)', '天氣狀況', '降雨機率(%)',
-            'AQI', 'PM2.5', '空氣品質', '預報時段'
-        ]
-        
-        # 移除 ID 欄位
-        df = df.drop('ID', axis=1)
-        
-        # 匯出為 Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='天氣歷史資料', index=False)
-        output.seek(0)
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rows_to_table(rows, columns, schema):
+    """
+    將一批 SQL 查詢結果 (tuple) 轉為 Arrow Table
+    """
+    arrays = []
+    for index, col in enumerate(columns):
+        values = [row[index] for row in rows]
+        kind = COLUMN_TYPES[col]
+        if kind == 'int':
+            arrays.append(pa.array([_to_number(v, lambda x: int(float(x))) for v in values], type=pa.int64()))
+        elif kind == 'float':
+            arrays.append(pa.array([_to_number(v, float) for v in values], type=pa.float64()))
+        elif kind == 'time':
+            text = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+            arrays.append(pc.strptime(text, format='%Y-%m-%d %H:%M:%S', unit='s', error_is_null=True))
+        else:
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _parse_columns(columns: Optional[str]):
+    """
+    解析 columns 參數 (逗號分隔)，預設為全部欄位
+    """
+    if not columns:
+        return list(HISTORY_COLUMNS)
+    selected = [col.strip() for col in columns.split(',') if col.strip()]
+    unknown = [col for col in selected if col not in COLUMN_TYPES]
+    if unknown:
+        raise ValueError(f"未知的欄位: {', '.join(unknown)}")
+    return selected
+
+
+def _stream_columnar(start_date, end_date, city, columns, open_writer, write_table, format_name):
+    """
+    Parquet 與 Arrow IPC 共用的串流邏輯：逐批讀取 SQL → 轉為 Arrow → 寫入並取出位元組
+    """
+    if pa is None:
+        return None, f"{format_name} 匯出需要安裝 pyarrow 套件"
+    try:
+        selected = _parse_columns(columns)
+        chunks = iter_history_rows(selected, start_date, end_date, city, chunk_size=ROW_GROUP_SIZE)
+        first_chunk = next(chunks, None)
+    except (sqlite3.Error, ValueError) as e:
+        return None, f"查詢歷史記錄失敗: {e}"
+    if not first_chunk:
+        return None, "沒有可匯出的資料"
+
+    schema = _arrow_schema(selected)
+
+    def generate():
+        sink = _ChunkSink()
+        writer = open_writer(sink, schema)
+        try:
+            for rows in _chain_chunks(first_chunk, chunks):
+                write_table(writer, _rows_to_table(rows, selected, schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return generate(), None
+
+
+def stream_parquet(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    columns: Optional[str] = None
+) -> Tuple[Optional[Iterator[bytes]], Optional[str]]:
+    """
+    以串流方式匯出 Parquet (每 ROW_GROUP_SIZE 筆寫入一個 row group，zstd 壓縮)
+    
+    Args:
+        start_date: 開始日期 (格式: YYYY-MM-DD)
+        end_date: 結束日期 (格式: YYYY-MM-DD)
+        city: 城市名稱（選填）
+        columns: 逗號分隔的欄位名稱（選填，預設為全部）
         
-        return output, None
+    Returns:
+        Tuple[Iterator[bytes], str]: (Parquet 位元組串流, 錯誤訊息)
+    """
+    return _stream_columnar(
+        start_date, end_date, city, columns,
+        lambda sink, schema: pq.ParquetWriter(sink, schema, compression='zstd'),
+        lambda writer, table: writer.write_table(table),
+        "Parquet"
+    )
+
+
+def stream_arrow(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    columns: Optional[str] = None
+) -> Tuple[Optional[Iterator[bytes]], Optional[str]]:
+    """
+    以串流方式匯出 Arrow IPC stream 格式
+    
+    Args:
+        start_date: 開始日期 (格式: YYYY-MM-DD)
+        end_date: 結束日期 (格式: YYYY-MM-DD)
+        city: 城市名稱（選填）
+        columns: 逗號分隔的欄位名稱（選填，預設為全部）
         
-    except Exception as e:
-        return None, f"Excel 匯出失敗: {str(e)}"
+    Returns:
+        Tuple[Iterator[bytes], str]: (Arrow IPC 位元組串流, 錯誤訊息)
+    """
+    return _stream_columnar(
+        start_date, end_date, city, columns,
+        lambda sink, schema: pa.ipc.new_stream(sink, schema),
+        lambda writer, table: writer.write_table(table, max_chunksize=ROW_GROUP_SIZE),
+        "Arrow"
+    )
+
+
+def _chain_chunks(first_chunk, chunks):
+    """先回傳已讀出的第一批，再接著讀取剩餘批次"""
+    yield first_chunk
+    yield from chunks
+
 
+def _csv_value(value):
+    """與 pandas to_csv 相同：None 輸出為空字串"""
+    return '' if value is None else value
 
-def export_to_json(
+
+def export_to_excel(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     city: Optional[str] = None
-) -> Tuple[Optional[str], Optional[str]]:
+) -> Tuple[Optional[BytesIO], Optional[str]]:
     """
-    匯出資料為 JSON 格式
+    匯出資料為 Excel 格式
     
     Args:
         start_date: 開始日期 (格式: YYYY-MM-DD)
@@ -119,7 +365,7 @@ def export_to_json(
         city: 城市名稱（選填）
         
     Returns:
-        Tuple[str, str]: (JSON 字串, 錯誤訊息)
+        Tuple[BytesIO, str]: (Excel 資料流, 錯誤訊息)
     """
     try:
         # 取得歷史記錄
@@ -131,25 +377,29 @@ def export_to_json(
         # 轉換為 DataFrame
         df = pd.DataFrame(records)
         
-        # 移除 ID 欄位
-        df = df.drop('id', axis=1)
+        # 移除 ID 欄位並重新命名欄位為中文
+        df = df[[key for key, _ in EXPORT_COLUMNS]]
+        df.columns = [title for _, title in EXPORT_COLUMNS]
         
-        # 匯出為 JSON
-        json_str = df.to_json(orient='records', force_ascii=False, indent=2)
+        # 匯出為 Excel
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, sheet_name='天氣歷史資料', index=False)
+        output.seek(0)
         
-        return json_str, None
+        return output, None
         
     except Exception as e:
-        return None, f"JSON 匯出失敗: {str(e)}"
+        return None, f"Excel 匯出失敗: {str(e)}"
 
 
 if __name__ == '__main__':
     # 測試匯出功能
     print("測試 CSV 匯出...")
-    csv_data, error = export_to_csv()
-    if csv_data:
+    csv_stream, error = stream_csv()
+    if csv_stream:
         print("[OK] CSV 匯出成功")
-        print(f"資料大小: {len(csv_data.getvalue())} bytes")
+        print(f"資料大小: {sum(len(chunk) for chunk in csv_stream)} bytes")
     else:
         print(f"[Fail] {error}")
     
@@ -162,8 +412,9 @@ if __name__ == '__main__':
         print(f"[Fail] {error}")
     
     print("\n測試 JSON 匯出...")
-    json_data, error = export_to_json()
-    if json_data:
+    json_stream, error = stream_json()
+    if json_stream:
+        json_data = b"".join(json_stream).decode('utf-8')
         print("[OK] JSON 匯出成功")
         print(f"資料大小: {len(json_data)} bytes")
         print("\n預覽:")
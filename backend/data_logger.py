@@ -5,12 +5,23 @@
 
 import sqlite3
 import os
-from datetime import datetime
-from typing import Optional, List, Dict, Any, Tuple
+import atexit
+import heapq
+import itertools
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple, Iterator, Callable, Hashable
 
-# 資料庫檔案路徑
-DB_DIR = os.path.join(os.path.dirname(__file__), 'data')
-DB_PATH = os.path.join(DB_DIR, 'weather_history.db')
+# 資料庫檔案路徑與連線 (WAL 模式，每個執行緒重複使用連線)
+from db_connection import DB_DIR, DB_PATH, get_connection
+
+# 每日 / 城市統計彙總 (供 data_analysis 讀取)
+import rollups
+
+# 已搬到每月封存檔的舊記錄 (歷史查詢會一併讀取)
+import archive_store
 
 
 def init_database() -> None:
@@ -21,7 +32,7 @@ def init_database() -> None:
     os.makedirs(DB_DIR, exist_ok=True)
     
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             
             # 建立天氣查詢記錄表
@@ -45,12 +56,7 @@ def init_database() -> None:
                 )
             ''')
             
-            # 建立索引以提升查詢效率
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_city 
-                ON weather_queries(city)
-            ''')
-            
+            # 建立索引以提升查詢效率 (城市索引由 migration 建立為 (city, query_time) 複合索引)
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_query_time 
                 ON weather_queries(query_time)
@@ -59,26 +65,386 @@ def init_database() -> None:
             conn.commit()
             print(f"[OK] 資料庫初始化成功: {DB_PATH}")
 
-            # 檢查並新增 note 欄位 (Schema Migration)
-            try:
-                cursor.execute("SELECT note FROM weather_queries LIMIT 1")
-            except sqlite3.OperationalError:
-                print("[Info] 偵測到舊版資料庫，正在新增 'note' 欄位...")
-                cursor.execute("ALTER TABLE weather_queries ADD COLUMN note TEXT")
-                conn.commit()
-                print("[OK] 資料庫結構更新完成 (Added 'note' column)")
+        # 依版本號套用尚未執行的結構更新 (Schema Migration)
+        apply_migrations()
             
     except sqlite3.Error as e:
         print(f"[Error] 資料庫初始化失敗: {e}")
 
 
+# --- 版本化結構更新 ---
+# 目前版本記錄在 PRAGMA user_version；每個 migration 只會執行一次
+
+def _migration_add_note(cursor: sqlite3.Cursor) -> None:
+    """新增 note 欄位 (舊版資料庫沒有此欄位)"""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(weather_queries)")]
+    if 'note' not in columns:
+        cursor.execute("ALTER TABLE weather_queries ADD COLUMN note TEXT")
+
+
+def _migration_city_time_index(cursor: sqlite3.Cursor) -> None:
+    """
+    新增 (city, query_time) 複合索引：城市篩選 + 時間範圍 + 時間排序可以只走一次索引
+    複合索引的前綴已涵蓋 city 單欄查詢，因此移除舊的 idx_city
+    """
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_city_query_time
+        ON weather_queries(city, query_time)
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_city")
+
+
+def _migration_daily_rollup(cursor: sqlite3.Cursor) -> None:
+    """建立每日 / 城市統計彙總表，並以既有記錄回填"""
+    rollups.rebuild(cursor.connection)
+
+
+def _migration_data_version(cursor: sqlite3.Cursor) -> None:
+    """建立只有一列的資料版本表 (統計結果快取以此判斷資料是否變動)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+
+MIGRATIONS = [
+    (1, "新增 note 欄位", _migration_add_note),
+    (2, "新增 (city, query_time) 複合索引", _migration_city_time_index),
+    (3, "建立每日統計彙總表", _migration_daily_rollup),
+    (4, "建立資料版本表", _migration_data_version),
+]
+
+
+def apply_migrations() -> int:
+    """
+    套用尚未執行的 migration
+    
+    Returns:
+        int: 套用後的資料庫版本
+    """
+    conn = get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        with conn:
+            # 先取得寫入鎖再確認版本：多個 worker 同時啟動時只有一個會執行 migration
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if target <= version:
+                continue
+            print(f"[Info] 資料庫結構更新 v{target}: {description}...")
+            migrate(conn.cursor())
+            # PRAGMA 不支援參數綁定，target 為程式內定義的整數
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+        version = target
+        print(f"[OK] 資料庫結構已更新至 v{version}")
+    return version
+
+
+def _date_range(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    將 YYYY-MM-DD 日期轉換為半開區間 [start, end) 的時間字串，
+    讓 query_time 可以直接使用索引比較 (不需要包一層 date())
+    
+    Raises:
+        ValueError: 日期格式錯誤
+    """
+    start = end = None
+    if start_date:
+        start = datetime.strptime(start_date, '%Y-%m-%d').strftime('%Y-%m-%d 00:00:00')
+    if end_date:
+        end_day = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        end = end_day.strftime('%Y-%m-%d 00:00:00')
+    return start, end
+
+
+# --- 資料版本與結果快取 ---
+# 資料版本存在資料庫的 data_version 表，每次寫入 / 刪除 / 修改記錄時在同一個交易中遞增，
+# 其他 worker 或 db_manager 的寫入也會讓本行程的快取失效；
+# 資料沒有變動時重複查詢 (例如儀表板輪詢) 只需讀取一次版本號
+RESULT_CACHE_MAX_ENTRIES = 128  # 超過時整個清空 (key 含使用者輸入的城市名稱)
+RESULT_CACHE_TTL = 300          # 秒，版本未變動也重新計算 (沒有遞增版本的外部寫入最多影響這麼久)
+
+_RESULT_CACHE = {}  # key -> (資料版本, 快取時間, 結果)
+_VERSION_LOCK = threading.Lock()
+RESULT_CACHE_STATS = {
+    "hits": 0,
+    "misses": 0
+}
+
+
+def get_data_version() -> Optional[int]:
+    """
+    取得目前的資料版本；data_version 表尚未建立或無法讀取時為 None (此時不使用結果快取)
+    """
+    try:
+        row = get_connection().execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def bump_data_version(conn: sqlite3.Connection) -> None:
+    """
+    遞增資料版本，讓所有行程快取的統計結果失效
+    需在與寫入相同的交易中 (commit 之前) 呼叫，版本與資料一起生效
+    """
+    try:
+        conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    except sqlite3.OperationalError:
+        # 舊版資料庫尚未套用 migration (沒有 data_version 表)
+        pass
+
+
+def cached_result(key: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    資料版本未變動且快取未超過 RESULT_CACHE_TTL 時直接回傳上次的計算結果，否則重新計算並快取
+    compute 拋出例外時不會快取；回傳的物件為共用的快取內容，呼叫端不應修改
+    """
+    version = get_data_version()
+    now = time.time()
+    entry = _RESULT_CACHE.get(key)
+    if entry is not None and version is not None and entry[0] == version and now - entry[1] < RESULT_CACHE_TTL:
+        with _VERSION_LOCK:
+            RESULT_CACHE_STATS["hits"] += 1
+        return entry[2]
+
+    # 先記下計算前的版本：計算期間若有新寫入，下次查詢會因版本不符而重新計算
+    result = compute()
+    with _VERSION_LOCK:
+        RESULT_CACHE_STATS["misses"] += 1
+        if version is not None:
+            if len(_RESULT_CACHE) >= RESULT_CACHE_MAX_ENTRIES:
+                _RESULT_CACHE.clear()
+            _RESULT_CACHE[key] = (version, now, result)
+    return result
+
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    """
+    取得統計結果快取的命中資訊
+    """
+    return {
+        **RESULT_CACHE_STATS,
+        "entries": len(_RESULT_CACHE),
+        "data_version": get_data_version()
+    }
+
+
+# --- 非同步批次寫入 ---
+# log_weather_query 只把資料放進佇列，由單一背景執行緒以 executemany 批次寫入，
+# 避免每個請求都在請求執行緒上開連線、INSERT、commit (fsync)
+LOG_QUEUE_MAXSIZE = 10000   # 佇列上限，滿了就丟棄 (記錄於 dropped)
+LOG_BATCH_SIZE = 200        # 累積幾筆就寫入
+LOG_FLUSH_INTERVAL = 1.0    # 最多等待幾秒就寫入
+
+INSERT_QUERY_SQL = '''
+    INSERT INTO weather_queries (
+        city, temperature, min_temp, max_temp, feels_like,
+        humidity, weather_description, pop, aqi, pm25, 
+        aqi_status, forecast_period, query_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+_STOP = object()
+_WRITER_THREAD = None
+_WRITER_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+LOG_WRITER_STATS = {
+    "enqueued": 0,   # 放入佇列的筆數
+    "written": 0,    # 成功寫入的筆數
+    "dropped": 0,    # 佇列已滿而丟棄的筆數
+    "failed": 0,     # 寫入資料庫失敗的筆數
+    "batches": 0,    # 寫入的批次數
+    "restarts": 0,   # 背景執行緒意外結束後重新啟動的次數
+    "max_depth": 0   # 佇列曾經達到的最大深度
+}
+
+
+def _build_log_row(
+    city: str,
+    weather_data: Dict[str, Any],
+    aqi_data: Optional[Dict[str, Any]] = None
+) -> Tuple:
+    """
+    將天氣與 AQI 資料轉換為 weather_queries 的一列
+    """
+    # 提取天氣資料
+    temperature = weather_data.get('temperature')
+    min_temp = weather_data.get('min_temp')
+    max_temp = weather_data.get('max_temp')
+    
+    # 如果沒有 temperature，用 min_temp 和 max_temp 的平均值
+    if temperature is None and min_temp is not None and max_temp is not None:
+        try:
+            temperature = round((float(min_temp) + float(max_temp)) / 2, 1)
+        except (ValueError, TypeError):
+            temperature = None
+    
+    feels_like = weather_data.get('feels_like')
+    humidity = weather_data.get('humidity')
+    weather_description = weather_data.get('weather_description', '') or weather_data.get('weather_state', '')
+    pop = weather_data.get('pop')
+    forecast_period = weather_data.get('time', '') or weather_data.get('time_period', '')
+    
+    # 提取 AQI 資料
+    aqi = None
+    pm25 = None
+    aqi_status = None
+    
+    if aqi_data:
+        aqi = aqi_data.get('aqi')
+        pm25 = aqi_data.get('pm25')
+        aqi_status = aqi_data.get('status', '')
+    
+    # 查詢時間在放入佇列時決定 (與 CURRENT_TIMESTAMP 相同的 UTC 格式)，
+    # 批次寫入時才能同時更新對應日期的彙總
+    query_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    
+    return (
+        city, temperature, min_temp, max_temp, feels_like,
+        humidity, weather_description, pop, aqi, pm25,
+        aqi_status, forecast_period, query_time
+    )
+
+
+def _write_batch(rows: List[Tuple]) -> None:
+    """
+    以單一交易寫入一批記錄，並同時增量更新每日統計彙總
+    """
+    try:
+        with get_connection() as conn:
+            conn.executemany(INSERT_QUERY_SQL, rows)
+            if rollups.rollup_ready(conn):
+                rollups.apply_rows(conn, (
+                    (row[12], row[0], row[1], row[2], row[3], row[8]) for row in rows
+                ))
+            bump_data_version(conn)
+            conn.commit()
+        LOG_WRITER_STATS["written"] += len(rows)
+        LOG_WRITER_STATS["batches"] += 1
+    except Exception as e:
+        # 任何錯誤 (資料庫、彙總計算、非預期的資料型別) 都只算這一批失敗 (交易已回滾)，背景執行緒繼續運作
+        LOG_WRITER_STATS["failed"] += len(rows)
+        print(f"[Error] 記錄天氣查詢失敗 ({len(rows)} 筆): {e}")
+
+
+def _log_writer_loop() -> None:
+    """
+    背景寫入迴圈：累積到 LOG_BATCH_SIZE 筆或等待 LOG_FLUSH_INTERVAL 秒後寫入一次
+    """
+    stopping = False
+    while not stopping:
+        item = _LOG_QUEUE.get()
+        if item is _STOP:
+            _LOG_QUEUE.task_done()
+            break
+
+        batch = [item]
+        deadline = time.time() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = _LOG_QUEUE.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                _LOG_QUEUE.task_done()
+                break
+            batch.append(item)
+
+        try:
+            _write_batch(batch)
+        finally:
+            # 即使寫入發生例外也要標記完成，否則 flush_log_writer 會一直等待
+            for _ in batch:
+                _LOG_QUEUE.task_done()
+
+
+def start_log_writer() -> None:
+    """
+    啟動背景寫入執行緒 (重複呼叫不會建立多個；執行緒意外結束時重新啟動)
+    """
+    global _WRITER_THREAD
+    with _WRITER_LOCK:
+        if _WRITER_THREAD and _WRITER_THREAD.is_alive():
+            return
+        if _WRITER_THREAD is not None:
+            LOG_WRITER_STATS["restarts"] += 1
+            print("[Warn] 記錄背景寫入執行緒已結束，重新啟動")
+        _WRITER_THREAD = threading.Thread(target=_log_writer_loop, name='log-writer', daemon=True)
+        _WRITER_THREAD.start()
+
+
+def flush_log_writer(timeout: Optional[float] = None) -> bool:
+    """
+    等待佇列中的記錄全部寫入資料庫
+    
+    Returns:
+        bool: 是否在 timeout 內寫完
+    """
+    if _WRITER_THREAD is None or not _WRITER_THREAD.is_alive():
+        return _LOG_QUEUE.unfinished_tasks == 0
+    deadline = None if timeout is None else time.time() + timeout
+    with _LOG_QUEUE.all_tasks_done:
+        while _LOG_QUEUE.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            _LOG_QUEUE.all_tasks_done.wait(remaining)
+    return True
+
+
+def stop_log_writer(timeout: float = 5.0) -> None:
+    """
+    寫完佇列中剩餘的記錄後停止背景執行緒 (程式結束時自動呼叫)
+    """
+    global _WRITER_THREAD
+    with _WRITER_LOCK:
+        thread = _WRITER_THREAD
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            _LOG_QUEUE.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print("[Warn] 記錄佇列已滿，無法正常停止背景寫入")
+            return
+        thread.join(timeout)
+        _WRITER_THREAD = None
+
+
+atexit.register(stop_log_writer)
+
+
+def get_log_writer_stats() -> Dict[str, Any]:
+    """
+    取得背景寫入的統計資訊 (含目前佇列深度)
+    """
+    return {
+        **LOG_WRITER_STATS,
+        "queue_depth": _LOG_QUEUE.qsize(),
+        "running": bool(_WRITER_THREAD and _WRITER_THREAD.is_alive())
+    }
+
+
 def log_weather_query(
     city: str, 
     weather_data: Optional[Dict[str, Any]] = None,
     aqi_data: Optional[Dict[str, Any]] = None
 ) -> bool:
     """
-    記錄單次天氣查詢到資料庫
+    記錄單次天氣查詢到資料庫 (放入佇列，由背景執行緒批次寫入)
     
     Args:
         city: 城市名稱
@@ -86,63 +452,27 @@ def log_weather_query(
         aqi_data: 空氣品質資料字典
         
     Returns:
-        bool: 是否成功記錄
+        bool: 是否成功放入寫入佇列 (佇列已滿時回傳 False)
     """
     if not weather_data:
         return False
     
+    row = _build_log_row(city, weather_data, aqi_data)
+    start_log_writer()
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 提取天氣資料
-            temperature = weather_data.get('temperature')
-            min_temp = weather_data.get('min_temp')
-            max_temp = weather_data.get('max_temp')
-            
-            # 如果沒有 temperature，用 min_temp 和 max_temp 的平均值
-            if temperature is None and min_temp is not None and max_temp is not None:
-                try:
-                    temperature = round((float(min_temp) + float(max_temp)) / 2, 1)
-                except (ValueError, TypeError):
-                    temperature = None
-            
-            feels_like = weather_data.get('feels_like')
-            humidity = weather_data.get('humidity')
-            weather_description = weather_data.get('weather_description', '') or weather_data.get('weather_state', '')
-            pop = weather_data.get('pop')
-            forecast_period = weather_data.get('time', '') or weather_data.get('time_period', '')
-            
-            # 提取 AQI 資料
-            aqi = None
-            pm25 = None
-            aqi_status = None
-            
-            if aqi_data:
-                aqi = aqi_data.get('aqi')
-                pm25 = aqi_data.get('pm25')
-                aqi_status = aqi_data.get('status', '')
-            
-            # 插入記錄
-            cursor.execute('''
-                INSERT INTO weather_queries (
-                    city, temperature, min_temp, max_temp, feels_like,
-                    humidity, weather_description, pop, aqi, pm25, 
-                    aqi_status, forecast_period
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                city, temperature, min_temp, max_temp, feels_like,
-                humidity, weather_description, pop, aqi, pm25,
-                aqi_status, forecast_period
-            ))
-            
-            conn.commit()
-            return True
-            
-    except sqlite3.Error as e:
-        print(f"[Error] 記錄天氣查詢失敗: {e}")
+        _LOG_QUEUE.put_nowait(row)
+    except queue.Full:
+        with _STATS_LOCK:
+            LOG_WRITER_STATS["dropped"] += 1
         return False
 
+    depth = _LOG_QUEUE.qsize()
+    with _STATS_LOCK:
+        LOG_WRITER_STATS["enqueued"] += 1
+        if depth > LOG_WRITER_STATS["max_depth"]:
+            LOG_WRITER_STATS["max_depth"] = depth
+    return True
+
 
 def delete_record(record_id: int) -> bool:
     """
@@ -155,13 +485,19 @@ def delete_record(record_id: int) -> bool:
         bool: 是否刪除成功
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT city, query_time FROM weather_queries WHERE id = ?", (record_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
             cursor.execute("DELETE FROM weather_queries WHERE id = ?", (record_id,))
-            if cursor.rowcount > 0:
-                conn.commit()
-                return True
-            return False
+            # 刪除後極值可能改變，重新計算該日該城市的彙總
+            if rollups.rollup_ready(conn):
+                rollups.refresh_day(conn, str(row[1])[:10], row[0])
+            bump_data_version(conn)
+            conn.commit()
+            return True
     except sqlite3.Error as e:
         print(f"[Error] 刪除記錄失敗: {e}")
         return False
@@ -179,10 +515,11 @@ def update_note(record_id: int, note: str) -> bool:
         bool: 是否更新成功
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE weather_queries SET note = ? WHERE id = ?", (note, record_id))
             if cursor.rowcount > 0:
+                bump_data_version(conn)
                 conn.commit()
                 return True
             return False
@@ -191,6 +528,136 @@ def update_note(record_id: int, note: str) -> bool:
         return False
 
 
+# weather_queries 可供查詢 / 匯出的欄位
+HISTORY_COLUMNS = [
+    'id', 'query_time', 'city', 'temperature', 'min_temp', 'max_temp',
+    'feels_like', 'humidity', 'weather_description', 'pop', 'aqi', 'pm25',
+    'aqi_status', 'forecast_period', 'note'
+]
+
+
+def _build_history_query(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    columns: Optional[List[str]] = None
+) -> Tuple[str, List[Any]]:
+    """
+    建立歷史記錄查詢 SQL 與參數 (最新的在前)
+    
+    Args:
+        columns: 只讀取指定欄位 (必須在 HISTORY_COLUMNS 內)，預設為全部
+    """
+    if columns:
+        unknown = [col for col in columns if col not in HISTORY_COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的欄位: {', '.join(unknown)}")
+        query = f"SELECT {', '.join(columns)} FROM weather_queries WHERE 1=1"
+    else:
+        query = "SELECT * FROM weather_queries WHERE 1=1"
+    params = []
+    
+    # 加入日期篩選 (半開區間，可使用 query_time 索引)
+    start_time, end_time = _date_range(start_date, end_date)
+    if start_time:
+        query += " AND query_time >= ?"
+        params.append(start_time)
+    
+    if end_time:
+        query += " AND query_time < ?"
+        params.append(end_time)
+    
+    # 加入城市篩選
+    if city:
+        query += " AND city = ?"
+        params.append(city)
+    
+    # 按時間排序（最新的在前）
+    query += " ORDER BY query_time DESC"
+    return query, params
+
+
+def _iter_live_chunks(query: str, params: List[Any], chunk_size: int) -> Iterator[List[Tuple]]:
+    """
+    逐批讀取資料庫中的查詢結果
+    """
+    cursor = get_connection().cursor()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def iter_query_history(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    chunk_size: int = 1000
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    逐批讀取歷史天氣記錄 (一次只在記憶體中保留 chunk_size 筆)
+    
+    Args:
+        start_date: 開始日期 (格式: YYYY-MM-DD)
+        end_date: 結束日期 (格式: YYYY-MM-DD)
+        city: 城市名稱（選填）
+        chunk_size: 每批筆數
+        
+    Yields:
+        List[Dict]: 一批查詢結果
+        
+    Raises:
+        ValueError: 日期格式錯誤
+        sqlite3.Error: 資料庫錯誤
+    """
+    for rows in iter_history_rows(HISTORY_COLUMNS, start_date, end_date, city, chunk_size):
+        yield [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+
+def iter_history_rows(
+    columns: List[str],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    chunk_size: int = 50000
+) -> Iterator[List[Tuple]]:
+    """
+    逐批讀取指定欄位的歷史記錄 (tuple 形式，欄位順序與 columns 相同)
+    篩選條件直接下推到 SQL，只讀取需要的欄位；
+    查詢範圍涵蓋已封存的月份時，會依時間順序合併資料庫與封存檔的記錄
+    
+    Raises:
+        ValueError: 日期格式錯誤或欄位名稱不存在
+        sqlite3.Error: 資料庫錯誤
+    """
+    query, params = _build_history_query(start_date, end_date, city, columns)
+    start_time, end_time = _date_range(start_date, end_date)
+    if not archive_store.archived_months(start_time, end_time):
+        yield from _iter_live_chunks(query, params, chunk_size)
+        return
+
+    # 兩邊都依 query_time 由新到舊排列，合併時需要 query_time (不在 columns 內時額外讀取，輸出前去掉)
+    read_columns = list(columns) if 'query_time' in columns else list(columns) + ['query_time']
+    time_index = read_columns.index('query_time')
+    width = len(columns)
+    if len(read_columns) != width:
+        query, params = _build_history_query(start_date, end_date, city, read_columns)
+
+    live_rows = itertools.chain.from_iterable(_iter_live_chunks(query, params, chunk_size))
+    archived_rows = archive_store.iter_archive_rows(read_columns, start_time, end_time, city)
+    merged = heapq.merge(live_rows, archived_rows, key=lambda row: str(row[time_index]), reverse=True)
+    while True:
+        rows = list(itertools.islice(merged, chunk_size))
+        if not rows:
+            break
+        yield rows if len(read_columns) == width else [row[:width] for row in rows]
+
+
 def get_query_history(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
@@ -208,102 +675,75 @@ def get_query_history(
         List[Dict]: 查詢結果列表
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row  # 使結果可以用欄位名稱存取
-            cursor = conn.cursor()
-            
-            # 建立查詢 SQL
-            query = "SELECT * FROM weather_queries WHERE 1=1"
-            params = []
-            
-            # 加入日期篩選
-            if start_date:
-                query += " AND date(query_time) >= ?"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND date(query_time) <= ?"
-                params.append(end_date)
+        results = []
+        for chunk in iter_query_history(start_date, end_date, city):
+            results.extend(chunk)
+        return results
             
-            # 加入城市篩選
-            if city:
-                query += " AND city = ?"
-                params.append(city)
-            
-            # 按時間排序（最新的在前）
-            query += " ORDER BY query_time DESC"
-            
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            
-            # 轉換為字典列表
-            results = []
-            for row in rows:
-                results.append({
-                    'id': row['id'],
-                    'query_time': row['query_time'],
-                    'city': row['city'],
-                    'temperature': row['temperature'],
-                    'min_temp': row['min_temp'],
-                    'max_temp': row['max_temp'],
-                    'feels_like': row['feels_like'],
-                    'humidity': row['humidity'],
-                    'weather_description': row['weather_description'],
-                    'pop': row['pop'],
-                    'aqi': row['aqi'],
-                    'pm25': row['pm25'],
-                    'aqi_status': row['aqi_status'],
-                    'aqi_status': row['aqi_status'],
-                    'forecast_period': row['forecast_period'],
-                    # 如果 note 欄位不存在 (舊資料)，給空字串
-                    'note': row['note'] if 'note' in row.keys() else ''
-                })
-            
-            return results
-            
-    except sqlite3.Error as e:
+    except (sqlite3.Error, ValueError) as e:
         print(f"[Error] 查詢歷史記錄失敗: {e}")
         return []
 
 
+def _compute_export_stats() -> Dict[str, Any]:
+    """
+    查詢可匯出資料的統計資訊 (包含已封存的記錄)
+    
+    Raises:
+        sqlite3.Error: 資料庫錯誤
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 取得總筆數
+        cursor.execute("SELECT COUNT(*) FROM weather_queries")
+        total_records = cursor.fetchone()[0]
+        
+        # 取得日期範圍 (先取 MIN/MAX 再轉日期，可直接讀 idx_query_time 兩端)
+        cursor.execute("""
+            SELECT 
+                date((SELECT MIN(query_time) FROM weather_queries)) as earliest_date,
+                date((SELECT MAX(query_time) FROM weather_queries)) as latest_date
+        """)
+        date_range = cursor.fetchone()
+        
+        # 取得所有查詢過的城市
+        cursor.execute("""
+            SELECT DISTINCT city 
+            FROM weather_queries 
+            ORDER BY city
+        """)
+        cities = [row[0] for row in cursor.fetchall()]
+        
+    earliest_date, latest_date = date_range
+    
+    # 加上已封存的記錄
+    if archive_store.archived_months():
+        archived = archive_store.summary()
+        total_records += archived['records']
+        if archived['earliest'] and (not earliest_date or archived['earliest'][:10] < earliest_date):
+            earliest_date = archived['earliest'][:10]
+        if archived['latest'] and (not latest_date or archived['latest'][:10] > latest_date):
+            latest_date = archived['latest'][:10]
+        cities = sorted(set(cities) | {c for c in archived['cities'] if c})
+    
+    return {
+        'total_records': total_records,
+        'earliest_date': earliest_date or None,
+        'latest_date': latest_date or None,
+        'cities': cities
+    }
+
+
 def get_export_stats() -> Dict[str, Any]:
     """
-    取得可匯出資料的統計資訊
+    取得可匯出資料的統計資訊 (資料沒有變動時直接回傳快取結果)
     
     Returns:
         Dict: 包含總筆數、日期範圍、城市列表等資訊
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 取得總筆數
-            cursor.execute("SELECT COUNT(*) FROM weather_queries")
-            total_records = cursor.fetchone()[0]
-            
-            # 取得日期範圍
-            cursor.execute("""
-                SELECT 
-                    MIN(date(query_time)) as earliest_date,
-                    MAX(date(query_time)) as latest_date
-                FROM weather_queries
-            """)
-            date_range = cursor.fetchone()
-            
-            # 取得所有查詢過的城市
-            cursor.execute("""
-                SELECT DISTINCT city 
-                FROM weather_queries 
-                ORDER BY city
-            """)
-            cities = [row[0] for row in cursor.fetchall()]
-            
-            return {
-                'total_records': total_records,
-                'earliest_date': date_range[0] if date_range[0] else None,
-                'latest_date': date_range[1] if date_range[1] else None,
-                'cities': cities
-            }
+        return cached_result('export_stats', _compute_export_stats)
             
     except sqlite3.Error as e:
         print(f"[Error] 取得統計資訊失敗: {e}")
@@ -314,7 +754,6 @@ def get_export_stats() -> Dict[str, Any]:
             'cities': []
         }
 
-
 if __name__ == '__main__':
     # 測試資料庫初始化
     print("測試資料庫初始化...")
@@ -340,6 +779,7 @@ if __name__ == '__main__':
     }
     
     success = log_weather_query('臺北市', test_weather_data, test_aqi_data)
+    flush_log_writer(timeout=5)
     print(f"記錄結果: {'[OK] 成功' if success else '[Fail] 失敗'}")
     
     # 測試查詢歷史
@@ -0,0 +1,66 @@
+"""
+歷史資料庫連線管理模組
+集中管理 weather_history.db 的連線：
+- WAL 模式：讀取 (匯出、分析) 不會擋住寫入 (查詢記錄)，反之亦然
+- 調整 synchronous / cache_size / mmap_size / temp_store 等 pragma
+- 每個執行緒重複使用同一條連線，不必每次呼叫都重新建立
+"""
+
+import os
+import sqlite3
+import threading
+
+# 資料庫檔案路徑
+DB_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DB_PATH = os.path.join(DB_DIR, 'weather_history.db')
+
+# 連線參數
+BUSY_TIMEOUT = 5.0  # 秒，遇到其他行程持有寫入鎖時的等待時間
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",    # WAL 模式下仍可確保一致性，且不必每次 commit 都 fsync
+    "PRAGMA cache_size=-16000",     # 約 16 MB page cache
+    "PRAGMA mmap_size=268435456",   # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",     # 排序與暫存表放在記憶體
+    "PRAGMA foreign_keys=ON",
+)
+
+_local = threading.local()
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """
+    建立新連線並套用 pragma
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    取得目前執行緒專用的資料庫連線 (不存在時建立)
+
+    注意：連線由本模組管理，呼叫端不要 close()；
+    可以使用 `with conn:` 包住需要 commit / rollback 的寫入。
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DB_PATH)
+    if conn is None:
+        conn = _open_connection(DB_PATH)
+        connections[DB_PATH] = conn
+    return conn
+
+
+def close_connection() -> None:
+    """
+    關閉目前執行緒持有的所有連線
+    """
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
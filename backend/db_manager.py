@@ -6,13 +6,14 @@ Database Manager for Weather History
 import sqlite3
 import os
 import sys
-from data_logger import delete_record, update_note
+from data_logger import delete_record, update_note, apply_migrations, bump_data_version
 
-# Add directory to path to allow imports if needed, though this is standalone
-DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'weather_history.db')
-
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+# 共用的連線管理 (WAL 模式，連線由 db_connection 管理，不需要手動 close)
+from db_connection import DB_PATH, get_connection
+import rollups
+import archive_store
+from retention import run_retention
+from bulk_import import DEFAULT_BATCH_SIZE, bulk_import
 
 def show_stats():
     print("\n[Stat] 資料庫統計資訊")
@@ -47,16 +48,14 @@ def show_stats():
                 
     except Exception as e:
         print(f"[Error] 讀取統計失敗: {e}")
-    finally:
-        if conn: conn.close()
 
 def show_recent(limit=5):
     print(f"\n[Info] 最近 {limit} 筆記錄")
     print("-" * 30)
     try:
         conn = get_connection()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute(f"SELECT * FROM weather_queries ORDER BY query_time DESC LIMIT {limit}")
         rows = cursor.fetchall()
@@ -70,8 +69,6 @@ def show_recent(limit=5):
             
     except Exception as e:
         print(f"[Error] 讀取記錄失敗: {e}")
-    finally:
-        if conn: conn.close()
 
 def clear_data():
     print("\n[Warn] 警告: 這將會刪除所有歷史記錄！")
@@ -85,12 +82,13 @@ def clear_data():
         cursor = conn.cursor()
         cursor.execute("DELETE FROM weather_queries")
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='weather_queries'") # Reset ID
+        rollups.clear(conn)
+        bump_data_version(conn)
         conn.commit()
+        archive_store.clear_archives()
         print(f"[OK] 已清除所有資料，資料庫已重置。")
     except Exception as e:
         print(f"[Error] 清除失敗: {e}")
-    finally:
-        if conn: conn.close()
 
 def delete_data_ui():
     print("\n[Action] 刪除記錄")
@@ -161,6 +159,28 @@ if __name__ == '__main__':
             show_stats()
         elif cmd == 'recent':
             show_recent()
+        elif cmd == 'migrate':
+            version = apply_migrations()
+            print(f"[OK] 資料庫版本: v{version}")
+        elif cmd == 'retention':
+            result = run_retention(allow_full_vacuum=True)
+            print(f"[OK] 封存月份: {', '.join(result['archived']) or '無'}")
+            print(f"[OK] 刪除月份: {', '.join(result['purged']) or '無'}")
+            print(f"[OK] 釋放頁數: {result['freed_pages']}，耗時 {result['duration']} 秒")
+        elif cmd == 'import':
+            # python db_manager.py import <檔案> [每批筆數]
+            if len(sys.argv) < 3:
+                print("用法: python db_manager.py import <檔案.csv|.ndjson|.parquet> [每批筆數]")
+                print("       中斷後以相同指令續傳；匯入期間暫時移除索引，一般硬碟上約每秒 6 萬筆")
+            else:
+                batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_BATCH_SIZE
+                result, error = bulk_import(sys.argv[2], batch_size=batch_size)
+                if error:
+                    print(f"[Error] {error}")
+                else:
+                    print(f"[OK] 匯入 {result['imported']:,} 筆 (略過 {result['skipped']:,} 筆)，"
+                          f"寫入 {result['load_seconds']} 秒 + 重建索引 {result['index_seconds']} 秒，"
+                          f"平均 {result['rows_per_second']:,} 筆/秒")
         elif cmd == 'clear':
             # Bypass interactive confirm for script usage
             try:
@@ -168,12 +188,13 @@ if __name__ == '__main__':
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM weather_queries")
                 cursor.execute("DELETE FROM sqlite_sequence WHERE name='weather_queries'")
+                rollups.clear(conn)
+                bump_data_version(conn)
                 conn.commit()
+                archive_store.clear_archives()
                 print(f"[OK] 已清除所有資料，資料庫已重置。")
             except Exception as e:
                 print(f"[Error] 清除失敗: {e}")
-            finally:
-                if conn: conn.close()
         else:
             print(f"Unknown command: {cmd}")
     else:
@@ -0,0 +1,55 @@
+"""
+gunicorn 設定檔
+使用方式 (在 backend 目錄下):
+    gunicorn -c gunicorn.conf.py app:app
+
+多個 worker 之間以 leader_election 選出一個執行背景工作 (警報監控、天氣快照、預熱、資料保留)。
+使用 preload_app 時 app.py 在 master 行程匯入，這裡記下 master 的 PID，讓 master 不參加選舉，
+並在 post_fork 中讓每個 worker 開始選舉，背景工作只在 fork 出的 worker 中執行。
+警報推播 (SSE) 不由 worker 處理：master 啟動時另外啟動 alert_stream.py (asyncio，單一執行緒服務所有連線)，
+並以環境變數把 port 告訴 worker，網頁改連到該 port 接收推播。
+"""
+
+import os
+import subprocess
+import sys
+
+bind = "0.0.0.0:5000"
+workers = 2
+# 一般請求 (部分需等待上游 API) 以執行緒處理
+worker_class = "gthread"
+threads = 8
+
+# 警報推播伺服器的 port (需與 alert_stream.py 的 STREAM_PORT_ENV 相同；worker 由 /api/alerts 告知網頁)
+ALERT_STREAM_PORT = 5001
+os.environ["WEATHER_ALERT_STREAM_PORT"] = str(ALERT_STREAM_PORT)
+_alert_stream_process = None
+
+# 記錄 master PID (需與 api/leader_election.py 的 MASTER_PID_ENV 相同)
+os.environ["WEATHER_GUNICORN_MASTER_PID"] = str(os.getpid())
+
+
+def post_fork(server, worker):
+    """
+    preload 時 app.py 已在 master 匯入並要求選舉：fork 完成後在 worker 中開始
+    (未 preload 時 app.py 在 worker 中匯入，會自行開始選舉)
+    """
+    leader_election = sys.modules.get("leader_election")
+    if leader_election is not None and leader_election.ELECTION_REQUESTED:
+        leader_election.start_leader_election()
+
+
+def on_starting(server):
+    """master 啟動時另外啟動警報推播伺服器"""
+    global _alert_stream_process
+    _alert_stream_process = subprocess.Popen(
+        [sys.executable, "alert_stream.py", str(ALERT_STREAM_PORT)],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+
+def on_exit(server):
+    """master 結束時一併停止警報推播伺服器"""
+    if _alert_stream_process is not None:
+        _alert_stream_process.terminate()
+        _alert_stream_process.wait(timeout=10)
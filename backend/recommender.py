@@ -1,93 +1,240 @@
 """
 智慧天氣推薦系統 (Feature #18)
 根據演算法計算舒適度分數，推薦最適合出遊的城市
+
+每份全台天氣快照 (與 AQI 測站索引) 只計算一次評分，結果存成 NumPy 陣列組成的評分表；
+推薦與 top-k 篩選查詢直接在評分表上以向量運算與 argpartition 取前幾名，不必每次重新解析與排序。
 """
 
-from weather_api import get_all_weather
-import math
+import threading
+from typing import Any, Dict, NamedTuple, Optional
 
-def get_recommended_cities():
+import numpy as np
+
+from weather_api import find_city_aqi, peek_aqi_index
+from weather_snapshot import get_all_weather_snapshot, get_snapshot
+
+# 理想溫度 (20-26 度)
+IDEAL_TEMP = 23
+COMFORT_TEMP_RANGE = 3
+
+# 地區 → 縣市 (top-k 查詢的 region 篩選)
+REGIONS = {
+    "北部": ["臺北市", "新北市", "基隆市", "桃園市", "新竹市", "新竹縣", "宜蘭縣"],
+    "中部": ["苗栗縣", "臺中市", "彰化縣", "南投縣", "雲林縣"],
+    "南部": ["嘉義市", "嘉義縣", "臺南市", "高雄市", "屏東縣"],
+    "東部": ["花蓮縣", "臺東縣"],
+    "離島": ["澎湖縣", "金門縣", "連江縣"],
+}
+CITY_REGION = {city: region for region, cities in REGIONS.items() for city in cities}
+
+# top-k 查詢最多回傳的城市數
+MAX_TOP_K = 22
+
+
+class ComfortTable(NamedTuple):
     """
-    計算全台城市舒適度分數並回傳前三名
+    一份天氣快照的評分結果 (各欄位為同長度的陣列，順序與快照中的縣市相同)
     """
-    all_weather, error = get_all_weather()
-    
-    if error:
-        return {
-            "success": False,
-            "error": error
-        }
-        
-    scored_cities = []
-    
-    scored_cities = []
-    
+    cities: np.ndarray      # 縣市名稱 (object)
+    regions: np.ndarray     # 地區名稱 (object，未知為空字串)
+    weather: np.ndarray     # 天氣描述 (object)
+    temps: np.ndarray       # 溫度 (float)
+    pops: np.ndarray        # 降雨機率 (int)
+    aqi: np.ndarray         # AQI (float，沒有資料為 NaN)
+    scores: np.ndarray      # 舒適度分數 0-100 (int)
+    rank_keys: np.ndarray   # 排序鍵：分數相同時保留原本順序 (int)
+
+
+# 目前的評分表與計算時使用的資料版本 (快照建立時間, AQI 快取時間)；版本變動時才重新計算
+_TABLE_LOCK = threading.Lock()
+_TABLE_SOURCE = (None, None)
+_TABLE: Optional[ComfortTable] = None
+
+
+def _parse_aqi(aqi_data) -> float:
+    """AQI 資料字典 → 數值 (沒有資料或為 '-' 時為 NaN)"""
+    try:
+        return float(aqi_data["aqi"])
+    except (TypeError, KeyError, ValueError):
+        return float("nan")
+
+
+def build_comfort_table(all_weather, aqi_index=None) -> ComfortTable:
+    """
+    將全台天氣 (與 AQI 測站索引) 轉換為評分表
+
+    溫度 / 降雨機率無法解析的縣市不列入 (與逐筆計算時相同)。
+    """
+    cities, weather, temps, pops, aqi = [], [], [], [], []
     for city_name, city_data in all_weather.items():
-        # --- 1. 提取關鍵指標 ---
         try:
-            temp = float(city_data.get('temp', 25)) # Note: key is 'temp' in weather_api.py, but I used 'temperature' in recommender.py? 
-            # In weather_api.py: "temp": temp
-            # So I should use 'temp'.
+            temp = float(city_data.get('temp', 25))
             rain_prob = int(city_data.get('pop', 0))
-            # 這裡假設如果沒有 AQI 資料就給預設值
-            aqi = 50 
         except (ValueError, TypeError):
             continue
-            
-        # --- 2. 評分演算法 (Scoring Algorithm) ---
-        score = 100
-        reasons = []
-        
-        # A. 溫度評分 (理想溫度 20-26度)
-        # 偏離理想溫度越遠扣分越多
-        ideal_temp = 23
-        temp_diff = abs(temp - ideal_temp)
-        
-        if temp_diff <= 3:
-            reasons.append("氣溫舒適")
-        else:
-            # 每偏離 1 度扣 2 分
-            deduction = temp_diff * 2
-            score -= deduction
-            
-        # B. 降雨機率評分
-        # 降雨機率越高扣分越多
-        if rain_prob <= 10:
-            reasons.append("降雨機率低")
-        elif rain_prob <= 30:
-            score -= 10
-        elif rain_prob <= 50:
-            score -= 30
-        else:
-            score -= 50 # 不建議出遊
-            
-        # C. 特殊加分/扣分
-        weather_desc = city_data.get('weather_state', '') # weather_state in weather_api
-        if "晴" in weather_desc:
-            score += 5
-            if "晴" not in reasons:  # 避免重複
-                 pass # reasons.append("陽光普照") 但可能跟降雨機率低重複，從簡
-        
-        # 確保分數在 0-100 之間
-        score = max(0, min(100, score))
-        
-        scored_cities.append({
-            "city": city_name,
-            "score": int(score),
-            "temp": temp,
-            "weather": weather_desc,
-            "reasons": reasons[:2], # 取前兩個優點
-            "pop": rain_prob
-        })
-        
-    # --- 3. 排序與篩選 ---
-    # 根據分數由高到低排序
-    scored_cities.sort(key=lambda x: x['score'], reverse=True)
-    
-    # 取前三名
-    top_3 = scored_cities[:3]
-    
+        cities.append(city_name)
+        weather.append(city_data.get('weather_state', ''))
+        temps.append(temp)
+        pops.append(rain_prob)
+        aqi.append(_parse_aqi(find_city_aqi(aqi_index, city_name)) if aqi_index else float("nan"))
+
+    temps = np.array(temps, dtype=np.float64)
+    pops = np.array(pops, dtype=np.int64)
+    aqi = np.array(aqi, dtype=np.float64)
+    weather = np.array(weather, dtype=object)
+
+    # A. 溫度評分：偏離理想溫度超過 3 度時，每偏離 1 度扣 2 分
+    temp_diff = np.abs(temps - IDEAL_TEMP)
+    score = 100 - np.where(temp_diff <= COMFORT_TEMP_RANGE, 0, temp_diff * 2)
+
+    # B. 降雨機率評分
+    score -= np.select([pops <= 10, pops <= 30, pops <= 50], [0, 10, 30], 50)
+
+    # C. 空氣品質評分 (AQI 超過 100 開始扣分；沒有資料不扣分)
+    with np.errstate(invalid='ignore'):
+        score -= np.select([aqi > 200, aqi > 150, aqi > 100], [30, 20, 10], 0)
+
+    # D. 晴天加分
+    score += np.array(["晴" in desc for desc in weather], dtype=bool) * 5
+
+    # 確保分數在 0-100 之間
+    scores = np.clip(score, 0, 100).astype(np.int64)
+    count = len(cities)
+
+    return ComfortTable(
+        cities=np.array(cities, dtype=object),
+        regions=np.array([CITY_REGION.get(city, '') for city in cities], dtype=object),
+        weather=weather,
+        temps=temps,
+        pops=pops,
+        aqi=aqi,
+        scores=scores,
+        rank_keys=scores * count + np.arange(count - 1, -1, -1),
+    )
+
+
+def get_comfort_table():
+    """
+    取得目前天氣快照的評分表 (快照或 AQI 索引更新後才重新計算)
+
+    Returns:
+        (ComfortTable, 錯誤訊息)
+    """
+    global _TABLE, _TABLE_SOURCE
+    # AQI 只讀取快取 (過期時在背景更新)，請求不等待環境部 API；沒有資料時不計入空氣品質
+    aqi_index, aqi_time = peek_aqi_index()
+    snapshot = get_snapshot()
+    if snapshot is None:
+        # 尚無快照 (服務剛啟動) 時走一般查詢，不快取評分表
+        all_weather, error = get_all_weather_snapshot()
+        if error:
+            return None, error
+        return build_comfort_table(all_weather, aqi_index), None
+
+    # 以時間戳記比對：sqlite / redis 快取每次讀取都會得到新的物件
+    source = (snapshot.created_at, aqi_time)
+    with _TABLE_LOCK:
+        if _TABLE is None or _TABLE_SOURCE != source:
+            _TABLE = build_comfort_table(snapshot.data, aqi_index)
+            _TABLE_SOURCE = source
+        return _TABLE, None
+
+
+def top_k(table: ComfortTable, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    以 argpartition 取出分數最高的 k 筆 (分數相同時維持原順序)，回傳由高到低的索引
+    """
+    candidates = np.arange(len(table.cities)) if mask is None else np.flatnonzero(mask)
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    keys = table.rank_keys[candidates]
+    if k < len(candidates):
+        part = np.argpartition(-keys, k - 1)[:k]
+        candidates, keys = candidates[part], keys[part]
+    return candidates[np.argsort(-keys)]
+
+
+def _to_recommendation(table: ComfortTable, index: int) -> Dict[str, Any]:
+    """
+    將評分表中的一列轉換為回傳格式
+    """
+    temp = float(table.temps[index])
+    pop = int(table.pops[index])
+    aqi = table.aqi[index]
+
+    reasons = []
+    if abs(temp - IDEAL_TEMP) <= COMFORT_TEMP_RANGE:
+        reasons.append("氣溫舒適")
+    if pop <= 10:
+        reasons.append("降雨機率低")
+    if aqi <= 50:
+        reasons.append("空氣品質良好")
+
+    return {
+        "city": table.cities[index],
+        "score": int(table.scores[index]),
+        "temp": temp,
+        "weather": table.weather[index],
+        "reasons": reasons[:2],  # 取前兩個優點
+        "pop": pop,
+        "aqi": None if np.isnan(aqi) else int(aqi),
+        "region": table.regions[index] or None
+    }
+
+
+def get_top_cities(
+    k: int = 3,
+    region: Optional[str] = None,
+    max_pop: Optional[int] = None,
+    min_temp: Optional[float] = None,
+    max_temp: Optional[float] = None
+):
+    """
+    依篩選條件取出舒適度最高的 k 個城市
+
+    Args:
+        k: 回傳的城市數 (1 ~ MAX_TOP_K)
+        region: 地區 (北部 / 中部 / 南部 / 東部 / 離島)
+        max_pop: 降雨機率上限 (%)
+        min_temp / max_temp: 溫度範圍 (度)
+    """
+    if region is not None and region not in REGIONS:
+        return {
+            "success": False,
+            "error": f"未知的地區: {region} (可用: {', '.join(REGIONS)})"
+        }
+
+    table, error = get_comfort_table()
+    if error:
+        return {
+            "success": False,
+            "error": error
+        }
+
+    mask = np.ones(len(table.cities), dtype=bool)
+    if region is not None:
+        mask &= table.regions == region
+    if max_pop is not None:
+        mask &= table.pops <= max_pop
+    if min_temp is not None:
+        mask &= table.temps >= min_temp
+    if max_temp is not None:
+        mask &= table.temps <= max_temp
+
+    indices = top_k(table, max(1, min(k, MAX_TOP_K)), mask)
     return {
         "success": True,
-        "recommendations": top_3
+        "recommendations": [_to_recommendation(table, i) for i in indices],
+        "matched": int(mask.sum())
     }
+
+
+def get_recommended_cities():
+    """
+    計算全台城市舒適度分數並回傳前三名
+    """
+    result = get_top_cities(3)
+    if result["success"]:
+        result.pop("matched")
+    return result
@@ -0,0 +1,231 @@
+"""
+歷史資料保留政策模組
+定期把超過保留期間的月份從 weather_queries 搬到每月封存檔，刪除超過保存期限的資料，
+並以 incremental VACUUM 釋放資料庫檔案中的空間，讓常用的資料表維持小而快。
+
+設定 (config.ini，皆為選用)：
+    [history]
+    live_months = 0         # 資料庫中保留最近幾個月 (含本月)，更舊的月份搬到封存檔 (0 表示不封存)
+    retention_months = 0    # 資料最多保存幾個月 (0 表示永久保存)
+    interval_hours = 24     # 背景執行的間隔
+
+封存與刪除都預設關閉：封存後的記錄無法再以 id 修改或刪除，需明確設定後才會執行。
+資料庫切換為 incremental VACUUM 需要一次完整 VACUUM，只在手動執行
+(python db_manager.py retention) 時進行，背景執行緒不會自動執行。
+"""
+
+import configparser
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import archive_store
+import rollups
+from data_logger import bump_data_version
+from db_connection import get_connection
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.ini')
+
+DEFAULT_LIVE_MONTHS = 0
+DEFAULT_RETENTION_MONTHS = 0
+DEFAULT_INTERVAL_HOURS = 24
+
+STOP_EVENT = threading.Event()
+RETENTION_THREAD = None
+LAST_RUN = {}
+# 每次執行完成後呼叫 (例如發布結果給其他 worker)
+RESULT_LISTENERS = []
+
+
+def get_retention_config() -> Dict[str, int]:
+    """
+    讀取 config.ini 的 [history] 設定 (不存在時使用預設值)
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.read(CONFIG_PATH, encoding='utf-8')
+    section = config['history'] if config.has_section('history') else {}
+
+    def read_int(key, default, minimum):
+        try:
+            return max(minimum, int(section.get(key, default)))
+        except ValueError:
+            print(f"[Warn] config.ini [history] {key} 格式錯誤，使用預設值 {default}")
+            return default
+
+    return {
+        'live_months': read_int('live_months', DEFAULT_LIVE_MONTHS, 0),
+        'retention_months': read_int('retention_months', DEFAULT_RETENTION_MONTHS, 0),
+        'interval_hours': read_int('interval_hours', DEFAULT_INTERVAL_HOURS, 1),
+    }
+
+
+def _month_start(now: datetime, months_back: int) -> str:
+    """
+    取得 now 所在月份往前 months_back 個月的月初時間字串
+    """
+    index = now.year * 12 + (now.month - 1) - months_back
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01 00:00:00"
+
+
+def enable_incremental_vacuum(conn) -> bool:
+    """
+    將資料庫切換為 auto_vacuum=INCREMENTAL (只需一次，切換時會執行一次完整 VACUUM)
+
+    Returns:
+        bool: 是否執行了切換
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    print("[Retention] 啟用 incremental VACUUM (首次需要完整 VACUUM)...")
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def archive_old_months(conn, cutoff: str) -> List[str]:
+    """
+    將 cutoff 之前的月份逐月寫入封存檔，再從資料庫刪除
+
+    先寫好封存檔才刪除資料庫中的記錄；中途失敗時重新執行會以 id 去除重複，不會遺失或重複資料。
+    彙總表保留這些月份的統計，歷史分析結果不受影響。
+    """
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(query_time, 1, 7) FROM weather_queries WHERE query_time < ? ORDER BY 1",
+        (cutoff,)
+    )]
+    for month in months:
+        count = archive_store.write_month(conn, month)
+        start_time, end_time = archive_store.month_range(month)
+        with conn:
+            conn.execute(
+                "DELETE FROM weather_queries WHERE query_time >= ? AND query_time < ?",
+                (start_time, end_time)
+            )
+            bump_data_version(conn)
+        print(f"[Retention] 已封存 {month} (封存檔共 {count} 筆)")
+    return months
+
+
+def purge_expired(conn, cutoff: str) -> List[str]:
+    """
+    刪除 cutoff 之前的封存檔、資料庫記錄與彙總
+
+    Returns:
+        List[str]: 被刪除的封存月份
+    """
+    removed = [month for month in archive_store.list_archives() if archive_store.month_range(month)[1] <= cutoff]
+    for month in removed:
+        archive_store.remove_month(month)
+    with conn:
+        conn.execute("DELETE FROM weather_queries WHERE query_time < ?", (cutoff,))
+        if rollups.rollup_ready(conn):
+            conn.execute(f"DELETE FROM {rollups.ROLLUP_TABLE} WHERE day < ?", (cutoff[:10],))
+        bump_data_version(conn)
+    return removed
+
+
+def retention_enabled(config: Optional[Dict[str, int]] = None) -> bool:
+    """是否設定了封存或刪除 (兩者皆為 0 時保留政策不做任何事)"""
+    config = config or get_retention_config()
+    return bool(config['live_months'] or config['retention_months'])
+
+
+def run_retention(now: Optional[datetime] = None, allow_full_vacuum: bool = False) -> Dict[str, Any]:
+    """
+    執行一次完整的保留政策：封存舊月份 → 刪除過期資料 → incremental VACUUM
+
+    Args:
+        allow_full_vacuum: 資料庫尚未啟用 incremental VACUUM 時，是否執行切換所需的完整 VACUUM
+                           (會鎖住資料庫一段時間，只在手動執行時允許)
+
+    Returns:
+        Dict: 本次執行的結果 (封存 / 刪除的月份、釋放的頁數、耗時)
+    """
+    global LAST_RUN
+    config = get_retention_config()
+    now = now or datetime.now(timezone.utc)
+    start = time.time()
+    conn = get_connection()
+    result = {'archived': [], 'purged': [], 'freed_pages': 0, 'error': None}
+
+    try:
+        if config['live_months'] and archive_store.available():
+            result['archived'] = archive_old_months(conn, _month_start(now, config['live_months'] - 1))
+        elif config['live_months']:
+            print("[Retention] 未安裝 pyarrow，略過封存 (資料保留在資料庫中)")
+
+        if config['retention_months']:
+            result['purged'] = purge_expired(conn, _month_start(now, config['retention_months'] - 1))
+
+        if allow_full_vacuum:
+            enable_incremental_vacuum(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute("PRAGMA incremental_vacuum")
+            result['freed_pages'] = free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    except Exception as e:
+        result['error'] = str(e)
+        print(f"[Retention] 執行失敗: {e}")
+
+    result['duration'] = round(time.time() - start, 3)
+    result['finished_at'] = time.time()
+    LAST_RUN = result
+    for listener in RESULT_LISTENERS:
+        try:
+            listener(result)
+        except Exception as e:
+            print(f"[Retention] 通知執行結果失敗: {e}")
+    return result
+
+
+def retention_loop() -> None:
+    """
+    背景迴圈：依 interval_hours 定期執行保留政策
+    """
+    print("[Retention] 背景資料保留服務已啟動")
+    while not STOP_EVENT.is_set():
+        result = run_retention()
+        if result['archived'] or result['purged'] or result['freed_pages']:
+            print(f"[Retention] 完成：封存 {len(result['archived'])} 個月、刪除 {len(result['purged'])} 個月、"
+                  f"釋放 {result['freed_pages']} 頁，耗時 {result['duration']} 秒")
+        if STOP_EVENT.wait(get_retention_config()['interval_hours'] * 3600):
+            break
+    print("[Retention] 背景資料保留服務已停止")
+
+
+def start_retention_scheduler() -> None:
+    """
+    啟動背景資料保留執行緒 (沒有設定封存或刪除時不啟動)
+    """
+    global RETENTION_THREAD
+    if RETENTION_THREAD and RETENTION_THREAD.is_alive():
+        return
+    if not retention_enabled():
+        print("[Retention] 未設定 [history] live_months / retention_months，不啟動背景資料保留服務")
+        return
+    STOP_EVENT.clear()
+    RETENTION_THREAD = threading.Thread(target=retention_loop, name='retention', daemon=True)
+    RETENTION_THREAD.start()
+
+
+def stop_retention_scheduler() -> None:
+    """
+    停止背景資料保留執行緒
+    """
+    STOP_EVENT.set()
+
+
+def get_retention_status() -> Dict[str, Any]:
+    """
+    取得保留政策設定、封存月份與最近一次執行結果
+    """
+    return {
+        'config': get_retention_config(),
+        'archives': archive_store.list_archives(),
+        'last_run': LAST_RUN,
+        'running': bool(RETENTION_THREAD and RETENTION_THREAD.is_alive())
+    }
@@ -0,0 +1,164 @@
+"""
+每日統計彙總 (rollup) 模組
+weather_daily_rollup 依 (日期, 城市) 保存筆數、總和與極值，
+新記錄寫入時以增量方式更新，統計分析只需讀取彙總表，不必掃描整個 weather_queries。
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+ROLLUP_TABLE = 'weather_daily_rollup'
+
+CREATE_ROLLUP_SQL = '''
+    CREATE TABLE IF NOT EXISTS weather_daily_rollup (
+        day TEXT NOT NULL,
+        city TEXT NOT NULL,
+        record_count INTEGER NOT NULL DEFAULT 0,
+        temp_count INTEGER NOT NULL DEFAULT 0,
+        temp_sum REAL NOT NULL DEFAULT 0,
+        max_temp REAL,
+        max_temp_time TEXT,
+        min_temp REAL,
+        min_temp_time TEXT,
+        aqi_count INTEGER NOT NULL DEFAULT 0,
+        aqi_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, city)
+    )
+'''
+
+# 合併新批次的彙總：筆數與總和相加；極值只有在嚴格更大 / 更小時才取代 (保留最早出現的紀錄)
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO weather_daily_rollup (
+        day, city, record_count, temp_count, temp_sum,
+        max_temp, max_temp_time, min_temp, min_temp_time, aqi_count, aqi_sum
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, city) DO UPDATE SET
+        record_count = record_count + excluded.record_count,
+        temp_count = temp_count + excluded.temp_count,
+        temp_sum = temp_sum + excluded.temp_sum,
+        max_temp_time = CASE
+            WHEN excluded.max_temp IS NOT NULL AND (max_temp IS NULL OR excluded.max_temp > max_temp)
+            THEN excluded.max_temp_time ELSE max_temp_time END,
+        max_temp = CASE
+            WHEN excluded.max_temp IS NOT NULL AND (max_temp IS NULL OR excluded.max_temp > max_temp)
+            THEN excluded.max_temp ELSE max_temp END,
+        min_temp_time = CASE
+            WHEN excluded.min_temp IS NOT NULL AND (min_temp IS NULL OR excluded.min_temp < min_temp)
+            THEN excluded.min_temp_time ELSE min_temp_time END,
+        min_temp = CASE
+            WHEN excluded.min_temp IS NOT NULL AND (min_temp IS NULL OR excluded.min_temp < min_temp)
+            THEN excluded.min_temp ELSE min_temp END,
+        aqi_count = aqi_count + excluded.aqi_count,
+        aqi_sum = aqi_sum + excluded.aqi_sum
+'''
+
+# 彙總所需的欄位 (順序與 aggregate_rows 的輸入相同)
+SOURCE_COLUMNS = 'query_time, city, temperature, min_temp, max_temp, aqi'
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """與 pd.to_numeric(errors='coerce') 相同：無法轉換的值視為缺值"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def aggregate_rows(rows: Iterable[Tuple]) -> Dict[Tuple[str, str], list]:
+    """
+    將 (query_time, city, temperature, min_temp, max_temp, aqi) 依 (日期, 城市) 彙總
+
+    Returns:
+        {(day, city): [record_count, temp_count, temp_sum, max_temp, max_temp_time,
+                       min_temp, min_temp_time, aqi_count, aqi_sum]}
+    """
+    groups = {}
+    for query_time, city, temperature, min_temp, max_temp, aqi in rows:
+        key = (str(query_time)[:10], city)
+        agg = groups.get(key)
+        if agg is None:
+            agg = groups[key] = [0, 0, 0.0, None, None, None, None, 0, 0.0]
+        agg[0] += 1
+
+        temperature = _to_float(temperature)
+        if temperature is not None:
+            agg[1] += 1
+            agg[2] += temperature
+
+        max_temp = _to_float(max_temp)
+        if max_temp is not None and (agg[3] is None or max_temp > agg[3]):
+            agg[3], agg[4] = max_temp, query_time
+
+        min_temp = _to_float(min_temp)
+        if min_temp is not None and (agg[5] is None or min_temp < agg[5]):
+            agg[5], agg[6] = min_temp, query_time
+
+        aqi = _to_float(aqi)
+        if aqi is not None:
+            agg[7] += 1
+            agg[8] += aqi
+    return groups
+
+
+def rollup_ready(conn: sqlite3.Connection) -> bool:
+    """
+    彙總表是否已建立 (由 migration 建立並回填歷史資料)
+    """
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ROLLUP_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def apply_rows(conn: sqlite3.Connection, rows: Iterable[Tuple]) -> None:
+    """
+    將新寫入的記錄增量合併進彙總表 (需在與 INSERT 相同的交易中呼叫)
+    """
+    merge_groups(conn, aggregate_rows(rows))
+
+
+def merge_groups(conn: sqlite3.Connection, groups: Dict[Tuple[str, str], list]) -> None:
+    """
+    將 aggregate_rows 的結果合併進彙總表 (可先在其他執行緒彙總，再於寫入交易中合併)
+    """
+    conn.executemany(UPSERT_ROLLUP_SQL, [key + tuple(agg) for key, agg in groups.items()])
+
+
+def refresh_day(conn: sqlite3.Connection, day: str, city: str) -> None:
+    """
+    重新計算單一 (日期, 城市) 的彙總 (刪除記錄後極值可能改變，無法以增量方式扣除)
+    """
+    next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE day = ? AND city = ?", (day, city))
+    rows = conn.execute(
+        f"SELECT {SOURCE_COLUMNS} FROM weather_queries "
+        "WHERE city = ? AND query_time >= ? AND query_time < ? ORDER BY id",
+        (city, day, next_day)
+    )
+    apply_rows(conn, rows)
+
+
+def rebuild(conn: sqlite3.Connection, chunk_size: int = 50000) -> None:
+    """
+    清空並從 weather_queries 重新建立全部彙總 (migration 與資料修復時使用)
+    """
+    conn.execute(CREATE_ROLLUP_SQL)
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+    cursor = conn.execute(f"SELECT {SOURCE_COLUMNS} FROM weather_queries ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        apply_rows(conn, rows)
+
+
+def clear(conn: sqlite3.Connection) -> None:
+    """
+    清空彙總表 (清除所有歷史記錄時使用)
+    """
+    if rollup_ready(conn):
+        conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+
@@ -0,0 +1,110 @@
+"""
+統計分析效能測試：SELECT * 載入 Pandas vs. 每日統計彙總表
+
+在暫存資料庫產生大量假資料 (預設 100 萬筆)，比較 get_weather_statistics 的兩種算法：
+- 舊寫法：SELECT * 全部載入 DataFrame 後計算 (含 note / aqi_status 等用不到的欄位)
+- 彙總表：由 SQLite 彙總 weather_daily_rollup (寫入時增量更新)，最新一筆與趨勢只掃描最後 7 天
+
+每種算法都記錄耗時 (中位數) 與 Python 端的記憶體峰值 (tracemalloc)。
+
+使用方式:
+    python benchmarks/bench_analysis.py --rows 1000000
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import pandas as pd  # noqa: E402
+
+import db_connection  # noqa: E402
+import rollups  # noqa: E402
+from bench_history_query import populate  # noqa: E402
+
+
+def legacy_statistics(conn, city=None):
+    """
+    舊版 get_weather_statistics 的計算方式 (僅供比較)
+    """
+    if city:
+        df = pd.read_sql_query("SELECT * FROM weather_queries WHERE city = ?", conn, params=(city,))
+    else:
+        df = pd.read_sql_query("SELECT * FROM weather_queries", conn)
+    for col in ['temperature', 'min_temp', 'max_temp', 'humidity', 'aqi']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['temperature'].mean()
+    df.loc[df['max_temp'].idxmax()]
+    df.loc[df['min_temp'].idxmin()]
+    df['city'].value_counts().head(3).to_dict()
+    df['aqi'].mean()
+    df.sort_values('query_time', ascending=False).iloc[0]
+    df['query_time'] = pd.to_datetime(df['query_time'])
+    recent_df = df[df['query_time'] >= df['query_time'].max() - pd.Timedelta(days=7)]
+    return recent_df.groupby(recent_df['query_time'].dt.date)['temperature'].mean().round(1)
+
+
+def measure(func, repeat):
+    """
+    回傳 (耗時中位數, 記憶體峰值 bytes)
+    """
+    durations = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(durations), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='weather_bench_')
+    db_connection.DB_PATH = os.path.join(tmp_dir, 'bench.db')
+
+    import data_analysis
+    import data_logger
+
+    data_logger.init_database()
+    conn = db_connection.get_connection()
+
+    print(f"產生 {args.rows:,} 筆測試資料...")
+    start = time.perf_counter()
+    conn.execute("DROP TABLE weather_daily_rollup")
+    populate(conn, args.rows)
+    print(f"完成，耗時 {time.perf_counter() - start:.1f} 秒\n")
+
+    # 建立彙總表 (回填只在 migration 時執行一次)
+    start = time.perf_counter()
+    with conn:
+        rollups.rebuild(conn)
+    print(f"建立每日統計彙總表，耗時 {time.perf_counter() - start:.1f} 秒\n")
+
+    cases = [("全部城市", None), ("單一城市", '臺中市')]
+    for name, city in cases:
+        print(f"=== {name} ===")
+        legacy_time, legacy_peak = measure(lambda: legacy_statistics(conn, city), args.repeat)
+        rollup_time, rollup_peak = measure(lambda: data_analysis._rollup_statistics(conn, city), args.repeat)
+        print(f"  舊寫法: {legacy_time * 1000:9.1f} ms  記憶體峰值 {legacy_peak / 2**20:8.1f} MB")
+        print(f"  彙總表: {rollup_time * 1000:9.1f} ms  記憶體峰值 {rollup_peak / 2**20:8.1f} MB"
+              f"  ({legacy_time / rollup_time:.1f}x)")
+
+    db_connection.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+歷史查詢效能測試：date(query_time) 全表掃描 vs. 半開區間 + 複合索引
+
+在暫存資料庫產生大量假資料 (預設 200 萬筆)，比較：
+- 舊寫法：date(query_time) >= ? AND date(query_time) <= ? (無法使用索引)
+- 新寫法：query_time >= ? AND query_time < ? + (city, query_time) 複合索引
+
+使用方式:
+    python benchmarks/bench_history_query.py --rows 2000000
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import db_connection  # noqa: E402
+
+CITIES = [
+    "臺北市", "新北市", "桃園市", "臺中市", "臺南市", "高雄市", "基隆市", "新竹市", "嘉義市",
+    "新竹縣", "苗栗縣", "彰化縣", "南投縣", "雲林縣", "嘉義縣", "屏東縣", "宜蘭縣", "花蓮縣",
+    "臺東縣", "澎湖縣", "金門縣", "連江縣"
+]
+
+
+def populate(conn, rows):
+    """
+    以遞迴 CTE 產生 rows 筆資料，時間平均分布在 2 年內
+    """
+    seconds_per_row = max(1, int(2 * 365 * 86400 / rows))
+    conn.execute("CREATE TEMP TABLE cities(idx INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO cities(idx, name) VALUES (?, ?)", list(enumerate(CITIES)))
+    conn.execute(f'''
+        WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < {rows})
+        INSERT INTO weather_queries (query_time, city, temperature, min_temp, max_temp, pop, aqi)
+        SELECT datetime('2024-01-01', '+' || (i * {seconds_per_row}) || ' seconds'),
+               (SELECT name FROM cities WHERE idx = i % {len(CITIES)}),
+               15 + (i % 20), 10 + (i % 15), 20 + (i % 15), i % 100, i % 200
+        FROM seq
+    ''')
+    conn.commit()
+
+
+def timed(conn, sql, params, repeat):
+    durations = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(conn.execute(sql, params).fetchall())
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), count
+
+
+def plan(conn, sql, params):
+    return "; ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='weather_bench_')
+    db_connection.DB_PATH = os.path.join(tmp_dir, 'bench.db')
+
+    import data_logger
+
+    # 先建立舊版結構 (只有單欄索引)，產生資料後量測舊寫法
+    conn = db_connection.get_connection()
+    conn.execute('''
+        CREATE TABLE weather_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            city TEXT NOT NULL,
+            temperature REAL, min_temp REAL, max_temp REAL, feels_like REAL,
+            humidity INTEGER, weather_description TEXT, pop INTEGER, aqi INTEGER,
+            pm25 REAL, aqi_status TEXT, forecast_period TEXT,
+            query_type TEXT DEFAULT 'current', note TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_city ON weather_queries(city)")
+    conn.execute("CREATE INDEX idx_query_time ON weather_queries(query_time)")
+
+    print(f"產生 {args.rows:,} 筆測試資料...")
+    start = time.perf_counter()
+    populate(conn, args.rows)
+    print(f"完成，耗時 {time.perf_counter() - start:.1f} 秒\n")
+
+    start_date, end_date, city = '2024-06-01', '2024-06-07', '臺中市'
+    start_time, end_time = data_logger._date_range(start_date, end_date)
+
+    old_sql = "SELECT * FROM weather_queries WHERE date(query_time) >= ? AND date(query_time) <= ?"
+    new_sql = "SELECT * FROM weather_queries WHERE query_time >= ? AND query_time < ?"
+    cases = [
+        ("日期區間", old_sql, (start_date, end_date), new_sql, (start_time, end_time)),
+        ("日期區間 + 城市",
+         old_sql + " AND city = ?", (start_date, end_date, city),
+         new_sql + " AND city = ?", (start_time, end_time, city)),
+    ]
+    order = " ORDER BY query_time DESC"
+
+    old_results = []
+    for name, sql, params, _, _ in cases:
+        old_results.append((plan(conn, sql + order, params), timed(conn, sql + order, params, args.repeat)))
+
+    # 套用 migration (新增複合索引、移除 idx_city) 後量測新寫法
+    conn.execute("PRAGMA user_version = 1")
+    data_logger.apply_migrations()
+    conn.execute("ANALYZE")
+
+    for (name, _, _, sql, params), (old_plan, (old_time, old_count)) in zip(cases, old_results):
+        new_plan = plan(conn, sql + order, params)
+        new_time, new_count = timed(conn, sql + order, params, args.repeat)
+        print(f"=== {name} ===")
+        print(f"  舊: {old_time * 1000:9.1f} ms  ({old_count} 筆)  plan: {old_plan}")
+        print(f"  新: {new_time * 1000:9.1f} ms  ({new_count} 筆)  plan: {new_plan}")
+        print(f"  加速: {old_time / new_time:.1f}x\n")
+
+    db_connection.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
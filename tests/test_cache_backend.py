@@ -0,0 +1,193 @@
+"""
+快取後端測試
+RedisCacheBackend 以本機的精簡 RESP 替身伺服器 (resp_server fixture) 測試，不需要真的 Redis
+
+執行方式 (在專案根目錄):
+    python -m pytest tests
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import cache_backend
+from cache_backend import MemoryCacheBackend, RedisCacheBackend, SQLiteCacheBackend
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """只實作 RedisCacheBackend 用到的指令：GET / SET [PX] / DEL / SCAN / PING / SELECT / AUTH"""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            now = time.time()
+            if command == b"GET":
+                value, expires = store.get(args[1], (None, None))
+                if expires is not None and now >= expires:
+                    store.pop(args[1], None)
+                    value = None
+                reply = self._bulk(value)
+            elif command == b"SET":
+                expires = None
+                if len(args) >= 5 and args[3].upper() == b"PX":
+                    expires = now + int(args[4]) / 1000
+                store[args[1]] = (args[2], expires)
+                reply = b"+OK\r\n"
+            elif command == b"DEL":
+                removed = sum(store.pop(key, None) is not None for key in args[1:])
+                reply = b":%d\r\n" % removed
+            elif command == b"SCAN":
+                prefix = args[3].rstrip(b"*")
+                keys = [key for key in store if key.startswith(prefix)]
+                reply = b"*2\r\n" + self._bulk(b"0") + b"*%d\r\n" % len(keys) + b"".join(self._bulk(k) for k in keys)
+            elif command in (b"PING", b"SELECT", b"AUTH"):
+                reply = b"+OK\r\n"
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RespHandler)
+    server.daemon_threads = True
+    server.store = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_redis_get_set_pop(resp_server):
+    port = resp_server.server_address[1]
+    cache = RedisCacheBackend(f"redis://127.0.0.1:{port}/0")
+
+    assert cache.get("weather_臺北市") is None
+    cache["weather_臺北市"] = (1700000000.5, {"temp": 25, "city": "臺北市"})
+
+    assert cache["weather_臺北市"] == (1700000000.5, {"temp": 25, "city": "臺北市"})
+    assert "weather_臺北市" in cache
+    assert len(cache) == 1
+    # 另一個行程 (新的客戶端) 讀到同一份資料
+    other = RedisCacheBackend(f"redis://127.0.0.1:{port}/0")
+    assert other.get("weather_臺北市") == (1700000000.5, {"temp": 25, "city": "臺北市"})
+
+    assert cache.pop("weather_臺北市") == (1700000000.5, {"temp": 25, "city": "臺北市"})
+    assert cache.get("weather_臺北市") is None
+    assert other.get("weather_臺北市") is None
+
+
+def test_redis_entries_expire_after_ttl(resp_server):
+    port = resp_server.server_address[1]
+    cache = RedisCacheBackend(f"redis://127.0.0.1:{port}/0", ttl=0.2)
+
+    cache["aqi_index"] = (time.time(), {"best": {}})
+    assert cache.get("aqi_index") is not None
+    time.sleep(0.3)
+    assert cache.get("aqi_index") is None
+
+
+def test_redis_reuses_decoded_data_until_timestamp_changes(resp_server):
+    port = resp_server.server_address[1]
+    writer = RedisCacheBackend(f"redis://127.0.0.1:{port}/0")
+    reader = RedisCacheBackend(f"redis://127.0.0.1:{port}/0")
+
+    writer["aqi_index"] = (100.0, {"best": {"臺北市": {"aqi": 30}}})
+    first = reader.get("aqi_index")
+    assert reader.get("aqi_index")[1] is first[1]
+
+    writer["aqi_index"] = (200.0, {"best": {"臺北市": {"aqi": 80}}})
+    assert reader.get("aqi_index") == (200.0, {"best": {"臺北市": {"aqi": 80}}})
+
+
+def test_redis_connection_failure_is_a_miss():
+    cache = RedisCacheBackend(f"redis://127.0.0.1:{_unused_port()}/0", socket_timeout=0.5)
+
+    assert cache.get("weather_臺北市") is None
+    assert "weather_臺北市" not in cache
+    cache["weather_臺北市"] = (time.time(), {"temp": 25})  # 寫入失敗只記錄，不拋出例外
+    assert cache.get("weather_臺北市", "default") == "default"
+    assert len(cache) == 0
+
+
+def test_sqlite_reuses_decoded_data_until_timestamp_changes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    writer = SQLiteCacheBackend(path)
+    reader = SQLiteCacheBackend(path)
+
+    writer["aqi_index"] = (100.0, {"best": {"臺北市": {"aqi": 30}}})
+    first = reader.get("aqi_index")
+    assert reader.get("aqi_index")[1] is first[1]
+
+    writer["aqi_index"] = (200.0, {"best": {"臺北市": {"aqi": 80}}})
+    assert reader.get("aqi_index") == (200.0, {"best": {"臺北市": {"aqi": 80}}})
+    writer.pop("aqi_index")
+    assert reader.get("aqi_index") is None
+
+
+def test_memory_contains_respects_ttl():
+    cache = MemoryCacheBackend(ttl=60)
+    cache["weather_臺北市"] = (time.time() - 120, {"temp": 25})
+    cache["weather_新北市"] = (time.time(), {"temp": 24})
+
+    assert "weather_臺北市" not in cache
+    assert "weather_新北市" in cache
+    assert cache.stats()["expired"] == 1
+
+
+def test_memory_reads_sweep_expired_entries(monkeypatch):
+    cache = MemoryCacheBackend(ttl=60)
+    for i in range(5):
+        cache[f"week_{i}"] = (time.time() - 120, {"temp": i})
+    cache["aqi_index"] = (time.time(), {"best": {}})
+    assert len(cache) == 6
+
+    # 只有讀取、沒有寫入時，超過 PURGE_INTERVAL 後仍會清除過期資料
+    monkeypatch.setattr(cache_backend, "PURGE_INTERVAL", 0)
+    assert cache.get("aqi_index") is not None
+    assert len(cache) == 1
+
+
+def test_memory_size_estimate_is_close_to_json_length():
+    data = {
+        "by_county": {f"縣市{i}": [{"sitename": f"測站{j}", "aqi": "35", "pm2.5": "12"} for j in range(20)]
+                      for i in range(22)},
+        "best": {f"縣市{i}": {"aqi": 30 + i, "status": "良好"} for i in range(22)},
+    }
+    actual = len(json.dumps(data, ensure_ascii=False))
+    estimate = cache_backend._estimate_size("aqi_index", data)
+    assert actual / 2 < estimate < actual * 2
@@ -1707,10 +1707,51 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // ==================== Feature #15: Extreme Weather Alerts ====================
-    function initAlerts() {
-        // Poll immediately and then every 60 seconds
-        pollAlerts();
-        setInterval(pollAlerts, 60000);
+    async function initAlerts() {
+        // Show the current alerts right away; the response also says where the push stream is served
+        const data = await pollAlerts();
+
+        // Browsers without EventSource: poll every 60 seconds
+        if (!window.EventSource) {
+            setInterval(pollAlerts, 60000);
+            return;
+        }
+
+        // In production the stream is served by a separate process (alert_stream.py) on its own port.
+        // Server pushes the current alerts on connect and again whenever they change.
+        // EventSource reconnects by itself and sends Last-Event-ID, so unchanged alerts are not resent.
+        const streamUrl = data && data.stream_port
+            ? `${window.location.protocol}//${window.location.hostname}:${data.stream_port}/api/alerts/stream`
+            : '/api/alerts/stream';
+        const source = new EventSource(streamUrl);
+        source.addEventListener('alerts', (event) => {
+            try {
+                showAlerts(JSON.parse(event.data).alerts);
+            } catch (error) {
+                console.error('Failed to parse alert event:', error);
+            }
+        });
+        source.onerror = () => {
+            // Stream is not available (e.g. the push server is down): fall back to polling
+            if (source.readyState === EventSource.CLOSED) {
+                console.warn('Alert stream unavailable, falling back to polling');
+                pollAlerts();
+                setInterval(pollAlerts, 60000);
+                return;
+            }
+            console.warn('Alert stream disconnected, reconnecting...');
+        };
+    }
+
+    function showAlerts(alerts) {
+        const container = document.getElementById('alert-container');
+        if (!container) return;
+
+        if (alerts && alerts.length > 0) {
+            renderAlerts(alerts);
+        } else {
+            container.innerHTML = ''; // Clear if no alerts
+        }
     }
 
     async function pollAlerts() {
@@ -1720,14 +1761,11 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const response = await fetch('/api/alerts');
             const data = await response.json();
-
-            if (data.success && data.alerts.length > 0) {
-                renderAlerts(data.alerts);
-            } else {
-                container.innerHTML = ''; // Clear if no alerts
-            }
+            showAlerts(data.success ? data.alerts : []);
+            return data;
         } catch (error) {
             console.error('Failed to poll alerts:', error);
+            return null;
         }
     }
 